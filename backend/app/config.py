@@ -1,9 +1,270 @@
 import os
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-BASE_URL = "http://localhost:30003"
+BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:30003")
 
 CHAT_MODEL = "/home/netzone22/data/LLM/Qwen3-VL-32B-Instruct"
 REASONING_MODEL = "/home/netzone22/data/LLM/Qwen3-VL-32B-Instruct"
 # http://60.13.232.228:2643/vlm
 # http://60.13.232.228:2643/llm
+
+# ================= 上游连接池 =================
+# 关闭后退回到每次请求新建 AsyncClient 的旧行为，便于对比延迟
+LLM_CLIENT_POOLING = os.getenv("LLM_CLIENT_POOLING", "1") == "1"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+# 需要安装 h2 (pip install httpx[http2])，未安装时自动退回 HTTP/1.1
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "0") == "1"
+
+# ================= 非流式响应缓存 =================
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 为空则只使用内存缓存；配置路径后启用 SQLite 持久层
+LLM_CACHE_DB_PATH = os.getenv("LLM_CACHE_DB_PATH", "")
+# 请求头带上该字段 (值为 1/true) 时跳过缓存强制重新生成
+LLM_CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+
+# ================= 相同请求合并 =================
+LLM_SINGLEFLIGHT_ENABLED = os.getenv("LLM_SINGLEFLIGHT_ENABLED", "1") == "1"
+
+# ================= 上游准入与优先级调度 =================
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "16"))
+# 各优先级最多排队的请求数，超过立即返回 429
+LLM_QUEUE_LIMITS = {
+    "interactive": int(os.getenv("LLM_QUEUE_LIMIT_INTERACTIVE", "64")),
+    "json": int(os.getenv("LLM_QUEUE_LIMIT_JSON", "128")),
+    "batch": int(os.getenv("LLM_QUEUE_LIMIT_BATCH", "16")),
+}
+# 排队超过该秒数仍未拿到名额，返回 503
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# ================= 全文并行生成 =================
+# /generate/document 单个请求最多同时生成的小节数（仍受全局调度器约束）
+DOC_GEN_MAX_PARALLEL = int(os.getenv("DOC_GEN_MAX_PARALLEL", "8"))
+
+# ================= 批量评审 =================
+REVIEW_BATCH_MAX_PARALLEL = int(os.getenv("REVIEW_BATCH_MAX_PARALLEL", "8"))
+
+# ================= Prompt 布局与前缀缓存 =================
+# 固定指令在前、可变内容在后，便于推理服务复用前缀 KV cache
+LLM_PREFIX_STABLE_PROMPTS = os.getenv("LLM_PREFIX_STABLE_PROMPTS", "1") == "1"
+# 把前端传来的 X-Session-Id 作为 OpenAI 兼容的 user 字段透传给上游，
+# 支持会话亲和的服务端可据此把同一会话路由到持有其前缀缓存的实例
+LLM_SEND_SESSION_HINTS = os.getenv("LLM_SEND_SESSION_HINTS", "0") == "1"
+
+# ================= 上下文 token 预算 =================
+# 各模型的上下文窗口 (tokens)，未列出的模型使用默认值
+LLM_DEFAULT_CONTEXT_WINDOW = int(os.getenv("LLM_DEFAULT_CONTEXT_WINDOW", "32768"))
+LLM_CONTEXT_WINDOWS = {
+    CHAT_MODEL: LLM_DEFAULT_CONTEXT_WINDOW,
+    REASONING_MODEL: LLM_DEFAULT_CONTEXT_WINDOW,
+}
+# 为模型输出预留的 tokens
+LLM_COMPLETION_RESERVE = int(os.getenv("LLM_COMPLETION_RESERVE", "4096"))
+# 指向模型目录或 tokenizer.json 且安装了 tokenizers 时使用真实分词，否则按字符估算
+LLM_TOKENIZER_PATH = os.getenv("LLM_TOKENIZER_PATH", "")
+# token 计数缓存的总大小上限（字节）：短文本以原文为键，长文本只保存摘要
+TOKEN_CACHE_MAX_BYTES = int(os.getenv("TOKEN_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+# 各路由可变内容的 token 上限（再与模型窗口取较小值）；未列出的路由只受模型窗口约束
+# 路由均为去掉 /api/writing 前缀的路径；/generate/document 的各节与 /generate/chunk 共用预算，
+# 流式大纲与 /outline/from-materials 共用预算
+ROUTE_INPUT_BUDGETS = {
+    "/chat": 2000,
+    "/continue": 1000,
+    "/fix-todo": 1000,
+    "/detailed-info": 1500,
+    "/generate/chunk": 1500,
+    "/auto-write/questions": 1500,
+    "/auto-write/next-question": 1500,
+    "/outline/from-materials": 3000,
+    "/guide/global": 1500,
+}
+
+# ================= 长文档分段处理 =================
+# 润色 / 重写 / 评审 / 按建议修改：内容超过阈值时自动切段并发处理（请求可用 longDoc 显式开关）
+LONG_DOC_THRESHOLD_TOKENS = int(os.getenv("LONG_DOC_THRESHOLD_TOKENS", "3000"))
+LONG_DOC_SEGMENT_TOKENS = int(os.getenv("LONG_DOC_SEGMENT_TOKENS", "1500"))
+LONG_DOC_MAX_PARALLEL = int(os.getenv("LONG_DOC_MAX_PARALLEL", "6"))
+
+# ================= 流式响应取消 =================
+# 同一 X-Session-Id 在这些路由上发起新请求时，取消上一条仍在生成的流（逗号分隔，去掉 /api/writing 前缀的路径）
+STREAM_SUPERSEDE_ROUTES = {
+    r.strip()
+    for r in os.getenv("STREAM_SUPERSEDE_ROUTES", "/continue,/smart-edit").split(",")
+    if r.strip()
+}
+
+# ================= 指标 =================
+# GET /metrics 导出 Prometheus 文本格式；关闭后中间件与各处埋点直接跳过
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# ================= 可续传的流式生成 =================
+# /generate/stream 与 /generate/chunk 的输出在服务端缓冲，断线后可凭 stream id 续传
+RESUMABLE_STREAMS_ENABLED = os.getenv("RESUMABLE_STREAMS_ENABLED", "1") == "1"
+# 生成结束后缓冲保留的秒数
+RESUMABLE_TTL = float(os.getenv("RESUMABLE_TTL", "600"))
+# 最后一个连接断开后等待重连的秒数，超时无人重连则取消上游生成
+RESUMABLE_GRACE = float(os.getenv("RESUMABLE_GRACE", "60"))
+# /generate/chunk 的等待时间：单节生成短、前端放弃后往往直接重新请求，等太久只是白白占用解码
+RESUMABLE_CHUNK_GRACE = float(os.getenv("RESUMABLE_CHUNK_GRACE", "5"))
+RESUMABLE_MAX_STREAMS = int(os.getenv("RESUMABLE_MAX_STREAMS", "512"))
+RESUMABLE_MAX_BYTES = int(os.getenv("RESUMABLE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# ================= 多推理节点负载均衡 =================
+# JSON 数组 [{"url": "http://host:port", "weight": 2, "models": [...], "apiKey": "..."}]，
+# 或逗号分隔的 URL 列表；未配置时只使用 BASE_URL
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "") or BASE_URL
+# least_outstanding：按在途请求数 / 权重；latency：再乘以该节点延迟的滑动平均
+LLM_LB_STRATEGY = os.getenv("LLM_LB_STRATEGY", "least_outstanding")
+# 连续失败多少次后熔断，以及熔断后的冷却秒数；所有节点都熔断时退回到最接近恢复的节点，不直接拒绝
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "15"))
+# 非流式调用（以及尚未输出首个 token 的流式调用）失败时换节点重试的最大次数
+LLM_FAILOVER_RETRIES = int(os.getenv("LLM_FAILOVER_RETRIES", "2"))
+# 主动健康检查（多节点时启用），间隔为 0 时关闭
+LLM_HEALTH_PATH = os.getenv("LLM_HEALTH_PATH", "/health")
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "10"))
+
+# ================= 参考资料检索 =================
+# 资料超出 prompt 预算时按与章节标题 / 要点的相关度选块，而不是只保留开头
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "1") == "1"
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "200"))
+# 进程内最多缓存的资料索引数（LRU）
+RETRIEVAL_MAX_INDEXES = int(os.getenv("RETRIEVAL_MAX_INDEXES", "64"))
+
+# ================= 文档会话 =================
+# 大纲、各节正文和对话记录保存在服务端，编辑时只发送增量，调用接口时只传 docSessionId + nodeId
+DOC_SESSIONS_MAX = int(os.getenv("DOC_SESSIONS_MAX", "256"))
+# 会话闲置多少秒后过期（每次读写都会续期）
+DOC_SESSION_TTL = float(os.getenv("DOC_SESSION_TTL", "7200"))
+# 单个会话的正文与对话总字符数上限
+DOC_SESSION_MAX_CHARS = int(os.getenv("DOC_SESSION_MAX_CHARS", "2000000"))
+
+# ================= 评审结果记忆 =================
+# 按 (章节标题, 正文哈希) 记住单节评审结果，再次评审全文时只重评改动过的小节
+REVIEW_MEMO_ENABLED = os.getenv("REVIEW_MEMO_ENABLED", "1") == "1"
+REVIEW_MEMO_TTL = float(os.getenv("REVIEW_MEMO_TTL", "86400"))
+REVIEW_MEMO_MAX_BYTES = int(os.getenv("REVIEW_MEMO_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# ================= 流式输出合并 =================
+# 上游的增量往往只有一两个字：首个片段立即发出，之后攒够 STREAM_FLUSH_BYTES 字节或
+# 距本批第一个片段 STREAM_FLUSH_MS 毫秒时合并为一次写出；两者都为 0 时逐片段发送（旧行为）
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "96"))
+STREAM_FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", "30"))
+# 解析上游 SSE 时，普通文本增量直接定位 content 字段解码，不对整行 json.loads
+LLM_STREAM_FAST_PARSE = os.getenv("LLM_STREAM_FAST_PARSE", "1") == "1"
+# 流式请求带 stream_options.include_usage，由上游在最后一个 chunk 返回真实的 token 用量；
+# 上游不支持时关闭，输出 token 数改为按生成文本估算
+LLM_STREAM_INCLUDE_USAGE = os.getenv("LLM_STREAM_INCLUDE_USAGE", "1") == "1"
+
+# ================= 结构化输出（约束解码） =================
+# 需要返回 JSON 的接口把期望的结构以 JSON Schema 发给上游：
+# json_schema：response_format={"type": "json_schema", ...}（vLLM / SGLang / OpenAI）
+# guided_json：vLLM 的 guided_json 扩展参数
+# json_object：只约束输出为 JSON 对象（DeepSeek 官方接口等），顶层为数组的结构不约束
+# off：不发送，完全依赖解析端修复
+# 上游返回 400 / 422 时该节点记为不支持，去掉参数重试，之后不再发送
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "json_schema")
+
+# ================= 异步任务 =================
+# 长文生成、按建议修改、按指导重写可以提交为后台任务，先返回 jobId，再轮询或订阅 SSE 取结果
+# 任务与结果保存在本地 SQLite，进程重启后未完成的任务重新排队
+# 相对路径按 backend 目录解析，与启动时的工作目录无关
+JOBS_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    os.getenv("JOBS_DB_PATH", os.path.join("data", "jobs.db")),
+)
+# 同时运行的任务数
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+# 运行中的部分输出每隔多少秒写回一次
+JOBS_FLUSH_SECONDS = float(os.getenv("JOBS_FLUSH_SECONDS", "1"))
+# 因进程退出被中断的任务最多重新运行几次
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# 已结束的任务保留多少秒
+JOBS_RETENTION = float(os.getenv("JOBS_RETENTION", str(7 * 86400)))
+
+# ================= 超时、重试与对冲 =================
+# 建立连接的超时
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# 非流式调用等待整个响应的超时
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
+# 流式调用：等待首个 token（含推理模型的思考内容）的超时，以及之后相邻 token 之间的最大空闲
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "60"))
+LLM_IDLE_TIMEOUT = float(os.getenv("LLM_IDLE_TIMEOUT", "30"))
+# 非流式调用遇到超时、连接失败、429 / 502 / 503 / 504 时的重试次数，退避基数与上限（秒）
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.25"))
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "4"))
+# 对冲请求：对下列短 JSON 路由（去掉 /api/writing 前缀的路径），等待超过该路由最近的 p95 后再发一份，先返回者胜出
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_ROUTES = [
+    r.strip()
+    for r in os.getenv(
+        "LLM_HEDGE_ROUTES",
+        "/points,/suggestions,/related-queries",
+    ).split(",")
+    if r.strip()
+]
+# 样本不足 LLM_HEDGE_MIN_SAMPLES 个时使用的对冲延迟（秒）
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "2"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# 按路由覆盖以上设置（JSON，键同样去掉 /api/writing 前缀）：{"/points": {"timeout": 15, "retries": 3, "hedge": true},
+#   "/polish": {"firstToken": 20, "idle": 10}}
+LLM_ROUTE_POLICIES = os.getenv("LLM_ROUTE_POLICIES", "{}")
+
+# ================= 模型分层路由 =================
+# 按接口把请求分到快速小模型 (fast) 或大模型 (heavy)；默认两层都指向现有模型，部署小模型后配置 LLM_FAST_MODEL 即可
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "1") == "1"
+MODEL_TIERS = {
+    "fast": os.getenv("LLM_FAST_MODEL") or CHAT_MODEL,
+    "heavy": os.getenv("LLM_HEAVY_MODEL") or REASONING_MODEL,
+}
+# 接口（去掉 /api/writing 前缀；后台任务为 job:<kind>）→ 层级；未列出的接口使用代码中指定的模型
+# heavy：大模型繁忙时可降级到 fast；heavy_only：长文生成、大纲、评审等，始终使用大模型
+# 可用 MODEL_ROUTES (JSON，如 {"/chat": "fast"}) 覆盖或补充
+MODEL_ROUTES = {
+    **{route: "fast" for route in (
+        "/continue", "/related-queries", "/suggestions", "/suggestions/stream",
+        "/points", "/points/stream", "/points/more", "/guide/contextual", "/auto-write/next-question",
+    )},
+    **{route: "heavy" for route in (
+        "/polish", "/rewrite", "/smart-edit", "/chat", "/fix-todo", "/selection-ref", "/partial-merge",
+        "/rewrite/guidance", "/detailed-info", "/guide/global", "/auto-write/questions", "/generate/template",
+    )},
+    **{route: "heavy_only" for route in (
+        "/outline", "/outline/stream", "/outline/from-materials", "/outline/from-materials/stream",
+        "/review", "/review/chunk", "/review/batch", "/review/full", "/review/apply",
+        "/generate", "/generate/stream", "/generate/chunk", "/generate/document",
+        "job:generate", "job:review_apply", "job:rewrite_guidance",
+    )},
+}
+MODEL_ROUTES_OVERRIDES = os.getenv("MODEL_ROUTES", "{}")
+# 大模型在途（含排队）请求数或流式首 token 延迟的滑动平均超过阈值时，heavy 接口降级到 fast；
+# 触发后至少保持 MODEL_DOWNGRADE_HOLD 秒，避免来回切换
+MODEL_DOWNGRADE_INFLIGHT = int(os.getenv("MODEL_DOWNGRADE_INFLIGHT", "12"))
+MODEL_DOWNGRADE_TTFT = float(os.getenv("MODEL_DOWNGRADE_TTFT", "3"))
+MODEL_DOWNGRADE_HOLD = float(os.getenv("MODEL_DOWNGRADE_HOLD", "30"))
+
+# ================= 编辑脚本输出 =================
+# 修改类接口 (editScript=true) 让模型只返回 {find, replace} 替换列表，由服务端定位并应用到原文
+# find 逐字匹配不到时，允许忽略空白差异再匹配一次（模型常改动换行和空格）
+EDIT_SCRIPT_FUZZY = os.getenv("EDIT_SCRIPT_FUZZY", "1") == "1"
+# 单次替换条数上限；超过时说明改动面很大，整段重新生成更合适
+EDIT_SCRIPT_MAX_EDITS = int(os.getenv("EDIT_SCRIPT_MAX_EDITS", "40"))
+
+# ================= WebSocket 通道 =================
+# 编辑器的交互调用可复用一条 WebSocket 连接 (/api/writing/ws)，多个操作并发，按 id 区分、可单独取消
+# 允许经通道调用的接口（去掉 /api/writing 前缀）；只开放请求体为单个模型的 POST 接口
+CHANNEL_ROUTES = {
+    r.strip()
+    for r in os.getenv(
+        "CHANNEL_ROUTES",
+        "/continue,/smart-edit,/chat,/suggestions,/suggestions/stream,/related-queries,"
+        "/points,/points/stream,/points/more,/guide/contextual,/detailed-info",
+    ).split(",")
+    if r.strip()
+}
+# 单条连接同时进行的操作数上限，超出的 start 直接返回 429
+CHANNEL_MAX_OPS = int(os.getenv("CHANNEL_MAX_OPS", "16"))
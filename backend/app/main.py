@@ -1,6 +1,83 @@
-from fastapi import FastAPI
-from app.routers import writing
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.routers import writing, channel
+from app.services.llm_service import init_client, close_client
+from app.services.scheduler import SchedulerRejected
+from app.services.context_budget import ContextTooLargeError
+from app.services.metrics import MetricsMiddleware, render_metrics
+from app.services.resumable import StreamGone
+from app.services.upstreams import upstream_pool
+from app.services.retrieval import MaterialsNotFound
+from app.services.doc_sessions import DocumentSessionError
+from app.services.jobs import job_queue, JobNotFound
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时建立共享的上游连接池和节点健康检查，关闭时统一释放
+    await init_client()
+    upstream_pool.start_health_checks()
+    # 恢复上次未完成的后台任务
+    await job_queue.start(writing.run_job)
+    yield
+    await job_queue.stop()
+    await upstream_pool.stop_health_checks()
+    await close_client()
+
+
+app = FastAPI(title="AI Writing Backend", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus 文本格式，供抓取
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.exception_handler(SchedulerRejected)
+async def scheduler_rejected_handler(request: Request, exc: SchedulerRejected):
+    # 排队已满返回 429，排队超时返回 503，前端可据此退避重试
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.message},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(ContextTooLargeError)
+async def context_too_large_handler(request: Request, exc: ContextTooLargeError):
+    # 超出上下文预算的输入在到达推理服务前就拒绝，避免无效 prefill 和上游 400
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.message, "tokens": exc.tokens, "budget": exc.budget},
+    )
+
+
+@app.exception_handler(StreamGone)
+async def stream_gone_handler(request: Request, exc: StreamGone):
+    # 缓冲已过期或生成已取消，前端应重新发起生成
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
+
+
+@app.exception_handler(MaterialsNotFound)
+async def materials_not_found_handler(request: Request, exc: MaterialsNotFound):
+    # materialsId 对应的索引已被淘汰（或进程重启），前端重新上传即可
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
+
+
+@app.exception_handler(DocumentSessionError)
+async def doc_session_error_handler(request: Request, exc: DocumentSessionError):
+    # 404 会话过期需重新创建；409 版本冲突需 GET 最新状态后重发；422 补丁不合法
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
+
+
+@app.exception_handler(JobNotFound)
+async def job_not_found_handler(request: Request, exc: JobNotFound):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
 
-app = FastAPI(title="AI Writing Backend")
 
 app.include_router(writing.router)
+app.include_router(channel.router)
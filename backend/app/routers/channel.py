@@ -0,0 +1,97 @@
+# channel.py
+"""
+WebSocket 通道的接入 (/api/writing/ws)，协议见 services/channel.py
+- start 帧按 route 分派给 writing 路由中的同名 POST 接口：请求体用该接口的请求模型校验，
+  接口本身的逻辑（上下文预算、缓存、调度、模型路由、流式合并与取代）完全复用
+- 浏览器的 WebSocket 无法自定义请求头，客户端与编辑会话 ID 通过查询参数 clientId / sessionId 传递
+"""
+import inspect
+from typing import Any, Dict, Tuple
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ValidationError
+
+from app.config import CHANNEL_ROUTES
+from app.routers import writing
+from app.services.channel import Channel, ChannelError
+from app.services.llm_service import current_session
+from app.services.metrics import current_route
+from app.services.scheduler import current_client
+from app.services.stream_control import Operation, current_operation
+
+router = APIRouter(prefix="/api/writing", tags=["Writing"])
+
+# route -> (接口函数, 请求体参数名, 请求模型, 是否接受 cache 参数)
+_endpoints: Dict[str, Tuple[Any, str, type, bool]] = {}
+
+
+def _endpoint(route: str) -> Tuple[Any, str, type, bool]:
+    if route not in CHANNEL_ROUTES:
+        raise ChannelError(404, f"接口不支持通道调用：{route}")
+    if route not in _endpoints:
+        path = writing.router.prefix + route
+        for r in writing.router.routes:
+            if not isinstance(r, APIRoute) or r.path != path or "POST" not in r.methods:
+                continue
+            params = inspect.signature(r.endpoint).parameters
+            models = [
+                (name, p.annotation) for name, p in params.items()
+                if isinstance(p.annotation, type) and issubclass(p.annotation, BaseModel)
+            ]
+            if len(models) == 1:
+                _endpoints[route] = (r.endpoint, *models[0], "cache" in params)
+            break
+        else:
+            raise ChannelError(404, f"接口不存在：{route}")
+    if route not in _endpoints:
+        raise ChannelError(404, f"接口不支持通道调用：{route}")
+    return _endpoints[route]
+
+
+async def dispatch(route: str, body: Dict[str, Any], cache: bool) -> Tuple[str, Any]:
+    endpoint, name, model, takes_cache = _endpoint(route)
+    try:
+        req = model.model_validate(body)
+    except ValidationError as e:
+        raise ChannelError(422, jsonable_encoder(e.errors(include_url=False)))
+    kwargs = {name: req}
+    if takes_cache:
+        kwargs["cache"] = cache
+    response = await endpoint(**kwargs)
+    if isinstance(response, StreamingResponse):
+        return ("sse" if response.media_type == "text/event-stream" else "text"), response.body_iterator
+    return "result", jsonable_encoder(response)
+
+
+@router.websocket("/ws")
+async def channel_endpoint(websocket: WebSocket, clientId: str = "", sessionId: str = ""):
+    client = clientId or websocket.headers.get("X-Client-Id") or (
+        websocket.client.host if websocket.client else "anonymous"
+    )
+    session_id = sessionId or websocket.headers.get("X-Session-Id")
+
+    def bind(route: str):
+        # 与 HTTP 路由的 bind_client 相同的上下文，调度公平性、指标和流取代都按操作生效
+        path = writing.router.prefix + route
+        current_client.set(client)
+        current_route.set(path)
+        if session_id:
+            current_session.set(session_id)
+        current_operation.set(Operation(path, session_id))
+
+    await websocket.accept()
+    channel = Channel(websocket.send_text, dispatch, bind)
+    try:
+        while True:
+            # 二进制帧也交给 channel，回复错误帧后连接继续可用
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            await channel.handle(message.get("text"))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await channel.close()
@@ -1,91 +1,234 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import StreamingResponse
 from app.schemas import *
-from app.services.llm_service import call_llm, call_llm_stream
-from app.config import CHAT_MODEL, REASONING_MODEL
+from app.services.llm_service import (
+    call_llm,
+    call_llm_stream,
+    get_latency_stats,
+    get_singleflight_stats,
+    current_session,
+)
+from app.services.llm_cache import get_cache_stats
+from app.services.stream_json import IncrementalJSONParser
+from app.services.prompts import render_prompt, list_templates
+from app.services.context_budget import Part, fit_parts, ensure_fits, get_budget_stats
+from app.services.stream_control import guard_stream, current_request, get_stream_stats
+from app.services.metrics import current_route, json_parse_total, json_parse_seconds
+from app.services.resumable import resumable_store
+from app.services.upstreams import upstream_pool
+from app.services.retrieval import materials_store
+from app.services.doc_sessions import doc_sessions
+from app.services.review_memo import review_memo
+from app.services.jobs import job_queue, JobContext
+from app.services.stream_batching import coalesce, get_batching_stats
+from app.services import structured
+from app.services.structured import get_structured_stats
+from app.services.resilience import get_resilience_stats
+from app.services import edit_script
+from app.services.edit_script import EditScriptError, get_edit_script_stats
+from app.services.channel import get_channel_stats
+from app.services.model_router import model_router
+from app.services.long_doc import (
+    split_document,
+    segment_titles,
+    is_long,
+    stream_segments,
+    map_segments,
+    reduce_reviews,
+    get_long_doc_stats,
+)
+from app.services.scheduler import (
+    scheduler,
+    current_client,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_JSON,
+    PRIORITY_BATCH,
+    PRIORITY_JOB,
+)
+from app.config import (
+    CHAT_MODEL,
+    REASONING_MODEL,
+    LLM_CACHE_BYPASS_HEADER,
+    DOC_GEN_MAX_PARALLEL,
+    REVIEW_BATCH_MAX_PARALLEL,
+    LONG_DOC_THRESHOLD_TOKENS,
+    LONG_DOC_SEGMENT_TOKENS,
+    LONG_DOC_MAX_PARALLEL,
+    RESUMABLE_STREAMS_ENABLED,
+    RESUMABLE_CHUNK_GRACE,
+    RETRIEVAL_ENABLED,
+)
+import asyncio
 import json
+import logging
 import re
 # 确保安装了 pip install json_repair
 from json_repair import repair_json
 
-router = APIRouter(prefix="/api/writing", tags=["Writing"])
+# 解析失败的次数见 /metrics 的 writing_json_parse_total；这里只记录细节便于排查
+logger = logging.getLogger(__name__)
+
+async def bind_client(request: Request):
+    """
+    记录当前请求来自哪个客户端，调度器按客户端公平排队
+    前端可通过 X-Client-Id 区分同一出口 IP 后的不同用户，X-Session-Id 标识编辑会话
+    """
+    client = request.headers.get("X-Client-Id") or (
+        request.client.host if request.client else "anonymous"
+    )
+    current_client.set(client)
+    current_request.set(request)
+    route = request.scope.get("route")
+    if route is not None:
+        current_route.set(route.path)
+    session_id = request.headers.get("X-Session-Id")
+    if session_id:
+        current_session.set(session_id)
+
+router = APIRouter(
+    prefix="/api/writing",
+    tags=["Writing"],
+    dependencies=[Depends(bind_client)],
+)
 
 import time # 记得在文件头部 import time
 
-AUTO_WRITE_SYSTEM_PROMPT = """# 基于事实锚定的动态访谈与写作专家 
-## 1. 核心原则
-你是一位严谨的商业分析师。你的工作是基于用户的输入指令进行**启发式访谈**，并依据访谈收集到的**真实信息**撰写文档。
-**【最高指令 - 防幻觉机制】：**
-*   **严禁捏造数据：** 正文中出现的任何数据（百分比、金额、时间参数等）、具体企业名称、引用语，必须严格来源于用户在 5 轮访谈中的回答。
-*   **定性代替定量：** 如果用户只提供了定性描述（如“效率很低”），你在正文中只能写“效率显著低下”，**绝对不能**自动补全为“效率下降了 30%”。
-*   **事实一致性：** 你的输出必须是用户回答的忠实映射，加上专业的逻辑润色，而非创造性的虚构。
 
-## 2. 工作流程 
+def use_cache(request: Request) -> bool:
+    """
+    路由级缓存开关：声明 Depends(use_cache) 即表示该路由参与缓存，
+    请求头带 X-Cache-Bypass: 1 时跳过缓存强制重新生成
+    """
+    bypass = request.headers.get(LLM_CACHE_BYPASS_HEADER, "").lower()
+    return bypass not in ("1", "true", "yes")
 
-### 阶段一：指令解析与提问规划 (Parsing)
-当用户输入一段包含 **[章节标题]**、**[二级要点]** 和 **[行动引导 Action Guide]** 的文本时：
-1.  分析“行动引导”中的 Steps，确定需要从用户那里获取哪些**具体素材**（如：场景、痛点细节、具体数据证据、机会点）。
-2.  规划 5 个问题，确保问题能覆盖所有 Steps 的要求。
+async def prime_stream(stream):
+    """
+    先取出第一个片段再返回响应：排队被拒 (429/503) 或上游连接失败
+    能以正常的 HTTP 错误码返回，而不是在 200 之后中断
+    """
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return ""
+
+async def create_stream_response(
+    model: str,
+    messages: list,
+    priority: int = PRIORITY_INTERACTIVE,
+    resumable: bool = False,
+    resume_grace: Optional[float] = None,
+):
+    """
+    创建一个返回纯文本流的 StreamingResponse
+    前端直接读取 raw bytes 即可；resumable=True 时响应头带 X-Stream-Id，断线后可按字节偏移续传，
+    resume_grace 为断线后等待重连的秒数（为空时用 RESUMABLE_GRACE）
+    """
+    # 调用你的 llm_service 的 stream 方法；细碎的增量合并后再写出
+    stream = coalesce(call_llm_stream(model, messages, priority=priority))
+    if resumable and RESUMABLE_STREAMS_ENABLED:
+        return await create_resumable_text_response(resumable_store.start(stream, grace=resume_grace))
+    return await create_text_stream_response(stream)
 
-### 阶段二：动态启发式访谈 
-开启 5 轮对话。**严禁一次性问完。**
+async def create_text_stream_response(stream):
+    """把任意文本片段流包装成纯文本 StreamingResponse（首个片段先取出）"""
+    stream = guard_stream(stream)
+    first = await prime_stream(stream)
 
-*   **提问策略：**
-    *   **Q1-Q5 动态生成：** 根据用户输入的 Action Guide 逐步提问。
-    *   **数据索取（关键）：** 如果 Action Guide 中包含“验证”、“数据报告”等要求，你必须在提问中显式询问用户：*“您手头是否有具体的统计数据（如百分比、金额）来支持这一观点？如果没有，我们将使用定性描述。”*
-    *   **启发式引导：** 继续使用 A/B 选项或场景例子帮助用户思考，但引导语中涉及的数据必须声明为“例如”。
+    async def generator():
+        # 直接 yield 文本片段，不加 'data: ' 前缀，方便前端直接展示
+        if first:
+            yield first
+        async for chunk in stream:
+            yield chunk
 
-### 阶段三：正文撰写 
-当用户回答完 Q5 后，基于收集到的信息撰写正文。
+    return StreamingResponse(generator(), media_type="text/plain")
 
-*   **写作规范：**
-    *   **结构：** 使用用户输入的标题。
-    *   **内容：** 将用户的回答串联成逻辑严密的商业分析。
-    *   **数据处理：**
-        *   若用户提供了数据（如“错误率50%”），请引用。
-        *   若用户未提供数据，使用“据调研观察”、“行业普遍反馈”、“显著存在”等定性词汇，**严禁**编造“78%”、“TOP 5”等细节。
 
----
+async def create_resumable_text_response(stream_id: str, offset: int = 0):
+    """从缓冲的第 offset 个字节开始输出纯文本；偏移落在多字节字符中间时按字节续上"""
+    start, skip = resumable_store.index_for_bytes(stream_id, offset)
 
-## 3. 示例：
+    async def chunks():
+        async for idx, chunk in resumable_store.subscribe(stream_id, start, resumed=offset > 0):
+            if skip and idx == start:
+                yield chunk.encode("utf-8")[skip:]
+            else:
+                yield chunk
 
-**用户输入指令：**
-> 行动引导：Step 3 开展普遍性验证，用户可选渠道：行业数据报告...
+    stream = guard_stream(chunks())
+    first = await prime_stream(stream)
 
-**AI 提问 (Q4)：**
-> “根据引导，我们需要验证痛点的普遍性。请问您是否有具体的行业数据或调研样本数据来佐证这一点？（例如：具体的错误率数值、成本占比等）。**如果您暂时没有具体数字，请告知我，我将在文档中侧重于描述现象的普遍性而非具体量化指标。**”
+    async def generator():
+        if first:
+            yield first
+        async for chunk in stream:
+            yield chunk
 
-**用户回答 (Q4)：**
+    return StreamingResponse(
+        generator(), media_type="text/plain", headers={"X-Stream-Id": stream_id}
+    )
 
-> “具体数据没有，但是跟几个仓库经理聊，大家都说这个问题很严重，主要是这就导致了很多人离职。”
 
-**AI 错误写法 (禁止)：**
-> “调研显示，75% 的仓库面临严重问题，导致离职率上升 20%。” *(错误：编造数据)*
+async def create_resumable_sse_response(stream_id: str, last_event_id: int = -1):
+    """SSE 输出，事件 id 为 "<stream id>:<序号>"，重连时从 Last-Event-ID 的下一个片段开始"""
+    stream = guard_stream(
+        resumable_store.subscribe(stream_id, last_event_id + 1, resumed=last_event_id >= 0)
+    )
+    first = await prime_stream(stream)
 
-**AI 正确写法 (允许)：**
-> “调研访谈显示，这一问题在行业内具有显著的普遍性。多位仓库管理人员反馈，该痛点不仅影响作业效率，更成为一线人员高流失率的关键诱因。” *(正确：忠实反映用户提供的“严重”和“导致离职”)*
+    async def event_generator():
+        if first:
+            idx, chunk = first
+            yield f"id: {stream_id}:{idx}\n{sse_data(chunk)}"
+        async for idx, chunk in stream:
+            yield f"id: {stream_id}:{idx}\n{sse_data(chunk)}"
 
----
+    return StreamingResponse(
+        event_generator(), media_type="text/event-stream", headers={"X-Stream-Id": stream_id}
+    )
 
-## 4. 关键约束 
-1.  你的知识库仅用于优化语言表达和逻辑连接，**不可用于补充具体的行业数据**（除非用户明确要求你使用你的内部知识库进行估算，并标记为“估算值”）。
-2.   用户的回答是正文内容的唯一素材来源。
-3. 每次只问一个问题。"""
 
-def create_stream_response(model: str, prompt: str):
-    """
-    创建一个返回纯文本流的 StreamingResponse
-    前端直接读取 raw bytes 即可
-    """
-    async def generator():
-        # 调用你的 llm_service 的 stream 方法
-        async for chunk in call_llm_stream(model, [{"role": "user", "content": prompt}]):
-            # 直接 yield 文本片段，不加 'data: ' 前缀，方便前端直接展示
-            yield chunk
+def materials_part(text: str, query: str, priority: int = 1) -> Part:
+    """参考资料：放不下时按与 query 的相关度选取片段，而不是只保留开头"""
+    select = materials_store.selector(query) if RETRIEVAL_ENABLED else None
+    return Part("materials", text, priority=priority, select=select)
 
-    return StreamingResponse(generator(), media_type="text/plain")
+
+def session_content(req, text: str) -> str:
+    """正文：请求里没带时按 docSessionId + nodeId 从文档会话取"""
+    return doc_sessions.resolve_content(text, req.docSessionId, req.nodeId)
+
+
+def session_chat(req, messages: list) -> list:
+    """对话记录：请求里没带时取文档会话中 chatKey（默认 nodeId）下的记录"""
+    resolved = doc_sessions.resolve_chat(messages, req.docSessionId, req.chatKey or req.nodeId)
+    return [m if isinstance(m, ChatMessageModel) else ChatMessageModel(**m) for m in resolved]
 
 
+def build_auto_write_context(req, route: str):
+    """一键代写访谈的上下文：标题必保留，其次写作要点，参考资料按 route 的剩余预算检索相关片段"""
+    points_str = "\n".join(
+        [
+            f"- {p.get('text', p) if isinstance(p, dict) else str(p)}"
+            for p in req.writingPoints
+        ]
+    )
+    materials = materials_store.resolve(req.materials.strip(), req.materialsId)
+
+    fitted = fit_parts(REASONING_MODEL, route, [
+        Part("title", req.sectionTitle, required=True),
+        Part("points", points_str, priority=0),
+        materials_part(materials, f"{req.sectionTitle}\n{points_str}"),
+    ])
+
+    context_parts = [f"章节标题：{fitted['title']}"]
+    if fitted["points"]:
+        context_parts.append(f"写作要点：\n{fitted['points']}")
+    if fitted["materials"]:
+        context_parts.append(f"参考资料：{fitted['materials']}")
+    return context_parts
+
 @router.post("/auto-write/questions")
 async def generate_auto_write_questions(req: AutoWriteQuestionsRequest):
     fallback_questions = [
@@ -97,33 +240,11 @@ async def generate_auto_write_questions(req: AutoWriteQuestionsRequest):
 
     ]
 
-    points_str = "\n".join(
-        [
-            f"- {p.get('text', p) if isinstance(p, dict) else str(p)}"
-            for p in req.writingPoints
-        ]
-    )
+    context_parts = build_auto_write_context(req, "/auto-write/questions")
 
-    context_parts = [f"章节标题：{req.sectionTitle}"]
-    if points_str:
-        context_parts.append(f"写作要点：\n{points_str}")
-    if req.materials.strip():
-        context_parts.append(f"参考资料：{req.materials[:800]}")
-
-    prompt = (
-        "你正在为一键代写收集素材，需要规划 5 条按顺序展开的访谈提问。"
-        "严格遵循系统提示中的访谈规范，确保每个问题都围绕行动引导逐步索取关键信息。"
-        "输出 JSON 数组：元素是按顺序的中文问题字符串，可附带 1-2 行引导示例（使用“例如：”或项目符号），不要编号或额外解释。"
-        f"\n\n上下文信息：\n{chr(10).join(context_parts)}"
-    )
+    messages = render_prompt("auto_write_questions", CONTEXT="\n".join(context_parts))
 
-    raw_result = await call_llm(
-        REASONING_MODEL,
-        [
-            {"role": "system", "content": AUTO_WRITE_SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ],
-    )
+    raw_result = await call_llm(REASONING_MODEL, messages, schema=structured.STRING_LIST)
 
     questions = clean_and_parse_json(raw_result, default_value=[])
 
@@ -154,22 +275,12 @@ async def generate_auto_write_next_question(req: AutoWriteNextQuestionRequest):
         "最终希望呈现的语气和风格是什么？（如专业、鼓励、客观等）",
     ]
 
-    points_str = "\n".join(
-        [
-            f"- {p.get('text', p) if isinstance(p, dict) else str(p)}"
-            for p in req.writingPoints
-        ]
-    )
-
-    context_parts = [f"章节标题：{req.sectionTitle}"]
-    if points_str:
-        context_parts.append(f"写作要点：\n{points_str}")
-    if req.materials.strip():
-        context_parts.append(f"参考资料：{req.materials[:800]}")
+    context_parts = build_auto_write_context(req, "/auto-write/next-question")
 
+    history = session_chat(req, req.history)
     dialog_lines = []
     question_index = 0
-    for msg in req.history:
+    for msg in history:
         if msg.role == "assistant":
             question_index += 1
             dialog_lines.append(f"Q{question_index}: {msg.text}")
@@ -177,28 +288,20 @@ async def generate_auto_write_next_question(req: AutoWriteNextQuestionRequest):
             dialog_lines.append(f"A{question_index}: {msg.text}")
 
     dialog_block = "\n".join(dialog_lines) if dialog_lines else "(暂无历史)"
-    user_turns = [m for m in req.history if m.role == "user"]
+    user_turns = [m for m in history if m.role == "user"]
     current_round = len(user_turns) + 1
     fallback_idx = max(0, min(len(fallback_questions) - 1, len(user_turns)))
     fallback_question = fallback_questions[fallback_idx]
 
-    prompt = (
-        "请按照访谈专家的工作流程继续进行 5 轮启发式对话，每次只提出 1 个核心追问。"
-        f"当前轮次：第 {current_round} 轮 / 5。"
-        "结合上下文与已收集的问答，生成下一条能推进素材收集的追问，避免重复或宽泛。"
-        "如果行动引导或历史回答提示需要数据验证，请显式询问用户是否有百分比/金额等具体数据，若没有则说明将以定性描述。"
-        "输出格式：直接给出中文问题文本，如需引导可在后续追加 1-3 行示例/选项（使用“例如：”或项目符号），不要编号或其它解释。"
-        f"\n\n上下文：\n{chr(10).join(context_parts)}"
-        f"\n当前对话：\n{dialog_block}"
+    # 轮次等可变信息放在最后，固定的访谈规范与指令可命中前缀缓存
+    messages = render_prompt(
+        "auto_write_next_question",
+        CONTEXT="\n".join(context_parts),
+        DIALOG=dialog_block,
+        ROUND=f"第 {current_round} 轮",
     )
 
-    raw_question = await call_llm(
-        REASONING_MODEL,
-        [
-            {"role": "system", "content": AUTO_WRITE_SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ],
-    )
+    raw_question = await call_llm(REASONING_MODEL, messages)
     question = raw_question.strip().split("\n")[0] if isinstance(raw_question, str) else ""
 
     if not question:
@@ -207,31 +310,33 @@ async def generate_auto_write_next_question(req: AutoWriteNextQuestionRequest):
     return {"result": question}
 
 # 添加到文件顶部的 process 函数附近
-def process_writing_points(raw_data):
+def build_writing_point(p, i: int, base_id: int):
+    """单个写作要点：流式接口逐条产出时与 process_writing_points 使用同一套 ID"""
+    # 兼容 LLM 返回纯字符串的情况
+    text = p if isinstance(p, str) else p.get("text", "未命名要点")
+    sub_points = []
+    if isinstance(p, dict):
+         sub_points = p.get("subPoints", [])
+
+    return {
+        "id": f"wp-gen-{base_id}-{i}",  # ✅ 关键：生成唯一 ID
+        "text": text,
+        "subPoints": sub_points,
+        "isCompleted": False,
+        "tags": []
+    }
+
+def process_writing_points(raw_data, base_id: int = None):
     """
     给写作要点添加 ID 和默认状态
     """
     if not isinstance(raw_data, list):
         return []
     
-    processed = []
-    base_id = int(time.time() * 1000)
+    if base_id is None:
+        base_id = int(time.time() * 1000)
     
-    for i, p in enumerate(raw_data):
-        # 兼容 LLM 返回纯字符串的情况
-        text = p if isinstance(p, str) else p.get("text", "未命名要点")
-        sub_points = []
-        if isinstance(p, dict):
-             sub_points = p.get("subPoints", [])
-        
-        processed.append({
-            "id": f"wp-gen-{base_id}-{i}",  # ✅ 关键：生成唯一 ID
-            "text": text,
-            "subPoints": sub_points,
-            "isCompleted": False,
-            "tags": []
-        })
-    return processed
+    return [build_writing_point(p, i, base_id) for i, p in enumerate(raw_data)]
 
 # 添加到文件顶部
 def normalize_review_data(data):
@@ -266,7 +371,53 @@ def normalize_review_data(data):
     }
 
 
-def process_llm_outline_to_frontend_structure(raw_data):
+def _build_outline_points(raw_points, owner_id: str):
+    points = []
+    if isinstance(raw_points, list):
+        for k, p in enumerate(raw_points):
+            # 兼容字符串或对象格式
+            p_text = p.get("text", "") if isinstance(p, dict) else str(p)
+            p_sub = p.get("subPoints", []) if isinstance(p, dict) else []
+            points.append({
+                "id": f"wp-{owner_id}-{k}",
+                "text": p_text,
+                "subPoints": p_sub,
+                "isCompleted": False,
+                "tags": []
+            })
+    return points
+
+def build_outline_l1_node(l1: dict, i1: int, base_id: int):
+    """一级标题 (章节) 节点"""
+    l1_id = f"{base_id}-{i1}"
+    return {
+        "id": l1_id,
+        "title": l1.get("title", f"第{i1+1}章"),
+        "level": 1,
+        "parentId": None,
+        "content": "",
+        "status": "draft",
+        "isLocked": False,
+        "writingPoints": _build_outline_points(l1.get("writingPoints", []), l1_id),
+        "chapterGuide": l1.get("chapterGuide", "本章概述...")
+    }
+
+def build_outline_l2_node(l2: dict, i1: int, i2: int, base_id: int):
+    """二级标题 (小节) 节点，ID 由父章节 ID 推出，可先于父节点产出"""
+    l1_id = f"{base_id}-{i1}"
+    l2_id = f"{l1_id}-{i2}"
+    return {
+        "id": l2_id,
+        "title": l2.get("title", f"{i1+1}.{i2+1} 小节"),
+        "level": 2,
+        "parentId": l1_id,
+        "content": "",
+        "status": "draft",
+        "isLocked": False,
+        "writingPoints": _build_outline_points(l2.get("writingPoints", []), l2_id)
+    }
+
+def process_llm_outline_to_frontend_structure(raw_data, base_id: int = None):
     """
     将 LLM 生成的嵌套 JSON 转换为前端需要的扁平化 OutlineNode 列表。
     自动生成 ID，处理 parentId，补充 status 等字段。
@@ -276,306 +427,620 @@ def process_llm_outline_to_frontend_structure(raw_data):
     
     flat_nodes = []
     # 使用当前时间戳作为基础 ID，模拟前端 Date.now()
-    base_id = int(time.time() * 1000)
+    if base_id is None:
+        base_id = int(time.time() * 1000)
 
     for i1, l1 in enumerate(raw_data):
+        if not isinstance(l1, dict):
+            continue
         # 1. 处理一级标题 (章节)
-        l1_id = f"{base_id}-{i1}"
-        l1_points = []
-        raw_l1_points = l1.get("writingPoints", [])
-        if isinstance(raw_l1_points, list):
-            for k, p in enumerate(raw_l1_points):
-                p_text = p.get("text", "") if isinstance(p, dict) else str(p)
-                p_sub = p.get("subPoints", []) if isinstance(p, dict) else []
-                l1_points.append({
-                    "id": f"wp-{l1_id}-{k}",
-                    "text": p_text,
-                    "subPoints": p_sub,
-                    "isCompleted": False,
-                    "tags": []
-                })
-        
-        node_l1 = {
-            "id": l1_id,
-            "title": l1.get("title", f"第{i1+1}章"),
-            "level": 1,
-            "parentId": None,
-            "content": "",
-            "status": "draft",
-            "isLocked": False,
-            "writingPoints": l1_points,
-            "chapterGuide": l1.get("chapterGuide", "本章概述...")
-        }
-        flat_nodes.append(node_l1)
+        flat_nodes.append(build_outline_l1_node(l1, i1, base_id))
 
         # 2. 处理二级标题 (小节)
         children = l1.get("children", [])
         if isinstance(children, list):
             for i2, l2 in enumerate(children):
-                l2_id = f"{l1_id}-{i2}"
-                
-                # 处理写作要点 (Writing Points) 及其 ID
-                raw_points = l2.get("writingPoints", [])
-                processed_points = []
-                if isinstance(raw_points, list):
-                    for k, p in enumerate(raw_points):
-                        # 兼容字符串或对象格式
-                        p_text = p.get("text", "") if isinstance(p, dict) else str(p)
-                        p_sub = p.get("subPoints", []) if isinstance(p, dict) else []
-                        processed_points.append({
-                            "id": f"wp-{l2_id}-{k}",
-                            "text": p_text,
-                            "subPoints": p_sub,
-                            "isCompleted": False,
-                            "tags": []
-                        })
-
-                node_l2 = {
-                    "id": l2_id,
-                    "title": l2.get("title", f"{i1+1}.{i2+1} 小节"),
-                    "level": 2,
-                    "parentId": l1_id,
-                    "content": "",
-                    "status": "draft",
-                    "isLocked": False,
-                    "writingPoints": processed_points
-                }
-                flat_nodes.append(node_l2)
+                if isinstance(l2, dict):
+                    flat_nodes.append(build_outline_l2_node(l2, i1, i2, base_id))
     
     return flat_nodes
 
+def _parsed(outcome: str, start: float, value):
+    route = current_route.get()
+    json_parse_total.inc(route, outcome)
+    json_parse_seconds.observe(time.perf_counter() - start, route, outcome)
+    return value
+
 def clean_and_parse_json(answer_LLM: str, default_value=None):
     """
     通用 JSON 清洗与解析函数
+    约束解码的上游直接返回合法 JSON，先严格解析；失败再走 repair_json 修复
     """
     if default_value is None:
         default_value = {}
-        
+    start = time.perf_counter()
+
+    try:
+        parsed_json = json.loads(answer_LLM)
+        if isinstance(parsed_json, (dict, list)):
+            return _parsed("strict", start, parsed_json)
+    except (TypeError, ValueError):
+        pass
+
     try:
         # 使用 json_repair 修复并解析 (return_objects=True 直接返回 dict/list)
         parsed_json = repair_json(answer_LLM, return_objects=True)
         
         # 如果解析出来是字符串(说明没修好)，或者为空，返回默认值
         if isinstance(parsed_json, str) or parsed_json is None:
-            print(f"[JSON Parse Warn] 解析结果仍为字符串或空: {str(parsed_json)[:50]}")
+            logger.warning("JSON 解析结果仍为字符串或空: %s", str(parsed_json)[:50])
             # 尝试二次兜底：有时候 repair_json 对 markdown 代码块处理不完美，手动去皮
             match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", answer_LLM)
             if match:
-                return repair_json(match.group(1), return_objects=True)
-            return default_value
-            
-        return parsed_json
+                return _parsed("fallback", start, repair_json(match.group(1), return_objects=True))
+            return _parsed("default", start, default_value)
+
+        return _parsed("ok", start, parsed_json)
     except Exception as e:
-        print(f"[JSON Parse Error] 解析彻底失败: {e}")
-        return default_value
+        logger.warning("JSON 解析彻底失败: %s", e)
+        return _parsed("error", start, default_value)
+
+def sse_data(text: str) -> str:
+    """纯文本片段的 SSE 帧：片段内的换行拆成多行 data，客户端按规范以换行拼回"""
+    return "data: " + text.replace("\n", "\ndata: ") + "\n\n"
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def create_json_stream_response(model: str, messages: list, watch, on_value, on_done, schema=None):
+    """
+    结构化输出的流式版本：边生成边增量解析 JSON
+    watch(path) 选出需要提前推送的位置，on_value(path, value) 产出 (event, data)，
+    结束时以 done 事件返回与非流式接口一致的完整结果
+    """
+    stream = guard_stream(call_llm_stream(model, messages, schema=schema))
+    first = await prime_stream(stream)
+
+    async def event_generator():
+        parser = IncrementalJSONParser(watch)
+        parts = []
+
+        async def chunks():
+            if first:
+                yield first
+            async for chunk in stream:
+                yield chunk
+
+        async for chunk in chunks():
+            parts.append(chunk)
+            for path, value in parser.feed(chunk):
+                for event, data in on_value(path, value):
+                    yield sse_event(event, data)
+        yield sse_event("done", on_done("".join(parts)))
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+async def stream_outline_response(messages: list):
+    """
+    流式大纲：小节 (level 2) 在其所属章节闭合前就会推送，parentId 已可用；
+    章节节点在整个章节闭合后推送。done 事件携带按顺序排列的完整扁平列表
+    """
+    base_id = int(time.time() * 1000)
+
+    def watch(path):
+        return len(path) == 1 or (len(path) == 3 and path[1] == "children")
+
+    def on_value(path, value):
+        if not isinstance(value, dict):
+            return
+        if len(path) == 1:
+            yield "node", build_outline_l1_node(value, path[0], base_id)
+        else:
+            yield "node", build_outline_l2_node(value, path[0], path[2], base_id)
+
+    def on_done(full_text):
+        cleaned = clean_and_parse_json(full_text, default_value=[])
+        return process_llm_outline_to_frontend_structure(cleaned, base_id)
+
+    return await create_json_stream_response(
+        REASONING_MODEL, messages, watch, on_value, on_done, schema=structured.OUTLINE
+    )
 
 # ================= 核心生成功能 =================
 
+def build_outline_prompt(req: OutlineRequest) -> list:
+    return render_prompt("outline", TOPIC=req.topic, REQUIREMENTS=req.requirements)
+
 @router.post("/outline")
-async def generate_outline(req: OutlineRequest):
-    prompt = f"""
-    请为以下主题生成一个详细写作大纲（JSON数组，包含嵌套children）。
-    主题：{req.topic}
-    写作要求：{req.requirements}
-    """
-    raw_result = await call_llm(
-        REASONING_MODEL,
-        [{"role": "user", "content": prompt}],
-    )
-    
+async def generate_outline(req: OutlineRequest, cache: bool = Depends(use_cache)):
+    messages = build_outline_prompt(req)
+    raw_result = await call_llm(REASONING_MODEL, messages, cache=cache, schema=structured.OUTLINE)
+
     cleaned_data = clean_and_parse_json(raw_result, default_value=[])
     # 同样应用结构转换
     final_structure = process_llm_outline_to_frontend_structure(cleaned_data)
     
     return {"result": final_structure}
 
+@router.post("/outline/stream")
+async def generate_outline_stream(req: OutlineRequest):
+    """流式大纲：每个章节/小节闭合后立即以 node 事件推送"""
+    return await stream_outline_response(build_outline_prompt(req))
+
+def build_article_prompt(req: ArticleRequest) -> list:
+    ensure_fits(CHAT_MODEL, "/generate", req.outline, req.requirements)
+    return render_prompt("article", OUTLINE=req.outline, REQUIREMENTS=req.requirements)
+
 @router.post("/generate")
 async def generate_article(req: ArticleRequest):
-    prompt = f"""
-    根据以下大纲撰写完整文章：
-    大纲：
-    {req.outline}
-    要求：
-    {req.requirements}
-    """
-    result = await call_llm(
-        CHAT_MODEL,
-        [{"role": "user", "content": prompt}],
-    )
+    messages = build_article_prompt(req)
+    result = await call_llm(CHAT_MODEL, messages, priority=PRIORITY_BATCH)
     return {"result": result}
 
 @router.post("/generate/stream")
 async def generate_article_stream(req: ArticleRequest):
+    messages = build_article_prompt(req)
+    if RESUMABLE_STREAMS_ENABLED:
+        stream_id = resumable_store.start(
+            coalesce(call_llm_stream(CHAT_MODEL, messages, priority=PRIORITY_BATCH))
+        )
+        return await create_resumable_sse_response(stream_id)
+
+    stream = guard_stream(coalesce(call_llm_stream(CHAT_MODEL, messages, priority=PRIORITY_BATCH)))
+    first = await prime_stream(stream)
+
     async def event_generator():
-        prompt = f"""
-        根据以下大纲撰写完整文章：
-        大纲：{req.outline}
-        要求：{req.requirements}
-        """
-        async for chunk in call_llm_stream(
-            CHAT_MODEL,
-            [{"role": "user", "content": prompt}],
-        ):
-            yield f"data: {chunk}\n\n"
+        if first:
+            yield sse_data(first)
+        async for chunk in stream:
+            yield sse_data(chunk)
 
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
     )
 
+def parse_last_event_id(stream_id: str, last_event_id: str) -> int:
+    """Last-Event-ID 形如 "<stream id>:<序号>"，不属于该流或无法解析时从头开始"""
+    sid, _, seq = last_event_id.rpartition(":")
+    if sid not in ("", stream_id) or not seq.isdigit():
+        return -1
+    return int(seq)
+
+@router.get("/streams/{stream_id}")
+async def resume_stream(
+    stream_id: str,
+    request: Request,
+    offset: Optional[int] = None,
+    lastEventId: Optional[str] = None,
+):
+    """
+    续传 /generate/stream、/generate/chunk 的输出（或接上仍在进行的生成），不会重新调用上游
+    纯文本流传 offset（已收到的字节数）；SSE 流带 Last-Event-ID 头或 lastEventId 参数
+    """
+    if offset is not None:
+        return await create_resumable_text_response(stream_id, offset)
+    last = request.headers.get("Last-Event-ID") or lastEventId or ""
+    return await create_resumable_sse_response(stream_id, parse_last_event_id(stream_id, last))
+
 # ================= 编辑与润色 =================
 
+def stream_long_document(content: str, build_messages):
+    """
+    长文档分段并发生成，按原顺序拼接输出
+    第一段走交互优先级尽快出字，其余段以 JSON 优先级在后台提前生成
+    """
+    segments = split_document(content, LONG_DOC_SEGMENT_TOKENS)
+
+    def make_stream(i: int, segment: str):
+        priority = PRIORITY_INTERACTIVE if i == 0 else PRIORITY_JSON
+        return call_llm_stream(REASONING_MODEL, build_messages(segment), priority=priority)
+
+    return coalesce(stream_segments(segments, make_stream, LONG_DOC_MAX_PARALLEL))
+
 @router.post("/polish")
 async def polish(req: PolishRequest):
-    prompt = f"""
-    请对以下内容进行全文润色，使语言更专业流畅，保持原意不变：
-    {req.content}
-    """
-    return create_stream_response(REASONING_MODEL, prompt)
+    content = session_content(req, req.content)
+    if is_long(content, LONG_DOC_THRESHOLD_TOKENS, req.longDoc):
+        return await create_text_stream_response(stream_long_document(
+            content, lambda seg: render_prompt("polish", CONTENT=seg)
+        ))
+    ensure_fits(REASONING_MODEL, "/polish", content)
+    messages = render_prompt("polish", CONTENT=content)
+    return await create_stream_response(REASONING_MODEL, messages)
 
 @router.post("/rewrite")
 async def rewrite(req: RewriteRequest):
-    prompt = f"""
-    请根据以下特定要求重写这段文本：
-    【原文】：{req.content}
-    【重写要求】：{req.requirements}
-    """
+    content = session_content(req, req.content)
+    if is_long(content, LONG_DOC_THRESHOLD_TOKENS, req.longDoc):
+        return await create_text_stream_response(stream_long_document(
+            content,
+            lambda seg: render_prompt("rewrite", CONTENT=seg, REQUIREMENTS=req.requirements),
+        ))
+    ensure_fits(REASONING_MODEL, "/rewrite", content, req.requirements)
+    messages = render_prompt("rewrite", CONTENT=content, REQUIREMENTS=req.requirements)
 
-    return create_stream_response(REASONING_MODEL, prompt)
+    return await create_stream_response(REASONING_MODEL, messages)
 
 @router.post("/smart-edit")
 async def smart_edit(req: SmartEditRequest):
-    action = "重写" if req.type == 'rewrite' else "续写"
-    prompt = f"""
-    你是一个智能写作助手。请根据用户指令对选中的文本进行{action}。
-    【选中文本】：{req.selection}
-    【用户指令】：{req.instruction}
-    请直接输出{action}后的结果。
-    """
-    return create_stream_response(CHAT_MODEL, prompt)
+    name = "smart_edit_rewrite" if req.type == 'rewrite' else "smart_edit_continue"
+    ensure_fits(CHAT_MODEL, "/smart-edit", req.selection, req.instruction)
+    messages = render_prompt(name, CONTENT=req.selection, INSTRUCTION=req.instruction)
+    return await create_stream_response(CHAT_MODEL, messages)
 
 @router.post("/continue")
 async def continue_writing(req: ContinueRequest):
-    prompt = f"""
-    请根据上文内容，自然地续写接下来的2-3个句子。
-    【上文】：{req.precedingText[-1000:]} 
-    """
-    return create_stream_response(CHAT_MODEL, prompt)
+    fitted = fit_parts(CHAT_MODEL, "/continue", [Part("context", req.precedingText, keep="tail")])
+    messages = render_prompt("continue", CONTEXT=fitted["context"])
+    return await create_stream_response(CHAT_MODEL, messages)
 
 # ================= 评审与助手 =================
 
+async def collect_stream(stream) -> str:
+    return "".join([chunk async for chunk in stream])
+
+async def review_sections(segments: list, items: list, memo: bool, node_ids: list = None) -> dict:
+    """
+    逐节评审后合并；items 为 [(标题, 正文)]，segments 为对应的带标题全文（用于加权和命名）
+    未改动的小节直接复用记忆的结果，report 列出每节分数来自本次评审 (fresh) 还是记忆 (cached)
+    """
+    default = {"score": 0, "summary": "解析失败", "todos": []}
+
+    async def stream_call(model: str, messages: list, schema=None) -> str:
+        return await collect_stream(call_llm_stream(model, messages, priority=PRIORITY_JSON, schema=schema))
+
+    async def review_item(i: int, item: tuple):
+        title, content = item
+        return await review_section(title, content, memo=memo, call=stream_call)
+
+    outcomes = await map_segments(items, review_item, LONG_DOC_MAX_PARALLEL)
+    results = []
+    report = {"fresh": 0, "cached": 0, "failed": 0, "sections": []}
+    for i, ((title, _), (ok, outcome)) in enumerate(zip(items, outcomes)):
+        if ok and outcome[1]:
+            result, _, cached = outcome
+            status = "cached" if cached else "fresh"
+        else:
+            result, status = None, "failed"
+        results.append(result)
+        report[status] += 1
+        entry = {"index": i, "title": title, "status": status, "score": result["score"] if result else None}
+        if node_ids:
+            entry["nodeId"] = node_ids[i]
+        report["sections"].append(entry)
+    if not any(results):
+        return {"result": default, "report": report}
+    merged = reduce_reviews(segments, results)
+    merged["segments"] = len(segments)
+    merged["failedSegments"] = results.count(None)
+    return {"result": merged, "report": report}
+
 @router.post("/review")
-async def review(req: ReviewRequest):
-    # ✅ [已修复] 增加 JSON 解析
-    prompt = f"""
-    请作为专业编辑对以下文章进行评审。
-    【文章内容】：{req.content}
-    
-    请严格返回合法的 JSON 格式，包含以下字段：
-    1. score (0-100的整数评分)
-    2. summary (简短的评审摘要)
-    3. todos (包含3-5条具体的修改建议数组，字符串列表)
-    """
-    raw_result = await call_llm(
-        REASONING_MODEL,
-        [{"role": "user", "content": prompt}],
-    )
+async def review(req: ReviewRequest, cache: bool = Depends(use_cache)):
     # 默认返回安全结构
     default = {"score": 0, "summary": "解析失败", "todos": []}
+    if req.docSessionId and not req.nodeId and not req.content:
+        # 文档会话的全文评审按大纲小节进行，只有改动过的小节会调用模型
+        nodes = [n for n in doc_sessions.get(req.docSessionId).nodes if (n.get("content") or "").strip()]
+        if not nodes:
+            return {"result": default}
+        return await review_sections(
+            ["#" * max(1, int(n.get("level") or 1)) + f" {n.get('title', '')}\n{n['content']}" for n in nodes],
+            [(n.get("title", ""), n["content"]) for n in nodes],
+            memo=cache,
+            node_ids=[n.get("id") for n in nodes],
+        )
+    content = session_content(req, req.content)
+    if is_long(content, LONG_DOC_THRESHOLD_TOKENS, req.longDoc):
+        # 分段评审后合并：各段并发，结果按段长度加权；段落未变时复用上次的评审结果
+        segments = split_document(content, LONG_DOC_SEGMENT_TOKENS)
+        titles = segment_titles(segments)
+        return await review_sections(
+            segments, list(zip(titles, segments)), memo=cache
+        )
+
+    # ✅ [已修复] 增加 JSON 解析
+    ensure_fits(REASONING_MODEL, "/review", content)
+    messages = render_prompt("review", CONTENT=content)
+    raw_result = await call_llm(REASONING_MODEL, messages, schema=structured.REVIEW)
     return {"result": clean_and_parse_json(raw_result, default_value=default)}
 
 @router.post("/chat")
 async def chat_assistant(req: ChatRequest):
 
-    prompt = f"""
-    请根据提供的上下文回答用户的问题。
-    【上下文】：{req.context[-2000:]}
-    【用户问题】：{req.query}
-    """
+    fitted = fit_parts(CHAT_MODEL, "/chat", [
+        Part("query", req.query, required=True),
+        Part("context", req.context, keep="tail"),
+    ])
+    messages = render_prompt("chat", CONTEXT=fitted["context"], QUERY=fitted["query"])
 
-    return create_stream_response(CHAT_MODEL, prompt)
+    return await create_stream_response(CHAT_MODEL, messages)
+
+async def edit_or_rewrite(model: str, template: str, original: str, diff: bool = True, **values) -> dict:
+    """
+    编辑脚本模式：模型只返回替换列表，应用到 original 后返回新文本、带偏移的替换列表和 diff
+    脚本解析或定位失败时按原模板整段重新生成 (mode=full, fallback=原因)；
+    diff=False 表示整段生成的结果不是 original 的新版本（如 fix-todo 只重写一段），此时不给 diff
+    """
+    raw = await call_llm(model, render_prompt(f"{template}_edits", **values), schema=structured.EDIT_SCRIPT)
+    try:
+        patched, edits = edit_script.apply(original, raw)
+        return {
+            "result": patched,
+            "mode": "edits",
+            "fallback": None,
+            "edits": edits,
+            "diff": edit_script.unified_diff(original, patched),
+        }
+    except EditScriptError as e:
+        result = await call_llm(model, render_prompt(template, **values))
+        return {
+            "result": result,
+            "mode": "full",
+            "fallback": e.reason,
+            "edits": None,
+            "diff": edit_script.unified_diff(original, result) if diff else None,
+        }
 
 @router.post("/fix-todo")
 async def fix_todo(req: TodoFixRequest):
-    prompt = f"""
-    文章中有一处需要修改。
-    【原段落上下文】：{req.content[-500:]}
-    【修改意见】：{req.todo}
-    请根据意见重写该段落。
-    """
-    return create_stream_response(CHAT_MODEL, prompt)
+    content = session_content(req, req.content)
+    fitted = fit_parts(CHAT_MODEL, "/fix-todo", [
+        Part("todo", req.todo, required=True),
+        Part("content", content, keep="tail"),
+    ])
+    if req.editScript:
+        # 替换直接定位在完整原文上；回退时的整段生成只重写相关段落，与原文不可比
+        return await edit_or_rewrite(
+            CHAT_MODEL, "fix_todo", content, diff=False, TODO=fitted["todo"], CONTENT=fitted["content"]
+        )
+    messages = render_prompt("fix_todo", TODO=fitted["todo"], CONTENT=fitted["content"])
+    return await create_stream_response(CHAT_MODEL, messages)
 
 @router.post("/detailed-info")
 async def generate_detailed_info(req: DetailedInfoRequest):
-    prompt = f"""
-    请针对主题 "{req.topic}" 提供详细的背景信息和解释。
-    【相关上下文】：{req.context[-1000:]}
-    请输出一段详细、专业的说明文字。
-    """
-    return create_stream_response(CHAT_MODEL, prompt)
+    fitted = fit_parts(CHAT_MODEL, "/detailed-info", [
+        Part("topic", req.topic, required=True),
+        Part("context", req.context, keep="tail"),
+    ])
+    messages = render_prompt("detailed_info", TOPIC=fitted["topic"], CONTEXT=fitted["context"])
+    return await create_stream_response(CHAT_MODEL, messages)
+
+SUGGESTION_FIELDS = {
+    "userQuestions": ("userQuestions", "user_questions", "questions"),
+    "aiInfo": ("aiInfo", "ai_info", "info"),
+}
+
+def build_suggestions_prompt(req: SuggestionRequest) -> list:
+    return render_prompt("suggestions", TOPIC=req.topic)
+
+def normalize_suggestions(parsed):
+    # ✅ 字段映射兜底
+    if not isinstance(parsed, dict):
+        parsed = {}
+    return {
+        field: next((parsed.get(a) for a in aliases if parsed.get(a)), [])
+        for field, aliases in SUGGESTION_FIELDS.items()
+    }
 
 @router.post("/suggestions")
-async def generate_suggestions(req: SuggestionRequest):
-    prompt = f"猜测用户想问的3个问题及2个关键信息点。主题：{req.topic}。返回JSON：{{userQuestions:[], aiInfo:[]}}"
-    raw_result = await call_llm(CHAT_MODEL, [{"role": "user", "content": prompt}])
+async def generate_suggestions(req: SuggestionRequest, cache: bool = Depends(use_cache)):
+    messages = build_suggestions_prompt(req)
+    raw_result = await call_llm(CHAT_MODEL, messages, cache=cache, schema=structured.SUGGESTIONS)
     
     parsed = clean_and_parse_json(raw_result, default_value={})
     
-    # ✅ 字段映射兜底
-    final_data = {
-        "userQuestions": parsed.get("userQuestions") or parsed.get("user_questions") or parsed.get("questions") or [],
-        "aiInfo": parsed.get("aiInfo") or parsed.get("ai_info") or parsed.get("info") or []
-    }
-    
-    return {"result": final_data}
+    return {"result": normalize_suggestions(parsed)}
 
+@router.post("/suggestions/stream")
+async def generate_suggestions_stream(req: SuggestionRequest):
+    """流式推荐：每条问题/信息点闭合后以 item 事件推送，field 为规范化后的字段名"""
+    alias_to_field = {a: f for f, aliases in SUGGESTION_FIELDS.items() for a in aliases}
 
-@router.post("/generate/chunk")
-async def generate_chunk_content(req: ChunkGenerateRequest):
+    def on_value(path, value):
+        yield "item", {"field": alias_to_field[path[0]], "value": value}
+
+    def on_done(full_text):
+        return normalize_suggestions(clean_and_parse_json(full_text, default_value={}))
+
+    return await create_json_stream_response(
+        CHAT_MODEL,
+        build_suggestions_prompt(req),
+        watch=lambda path: len(path) == 2 and path[0] in alias_to_field,
+        on_value=on_value,
+        on_done=on_done,
+        schema=structured.SUGGESTIONS,
+    )
+
+
+def build_chunk_prompt(section_title: str, context: str, style: str, writing_points: list,
+                       custom_template: str = None, materials: str = "") -> list:
+    """小节正文生成的 prompt，/generate/chunk 与 /generate/document 共用"""
     points_str = "无特定要点"
-    if req.writingPoints:
+    if writing_points:
         lines = []
-        for i, p in enumerate(req.writingPoints):
+        for i, p in enumerate(writing_points):
             text = p.get('text', '') if isinstance(p, dict) else str(p)
             lines.append(f"{i+1}. {text}")
         points_str = "\n".join(lines)
 
-    prompt = f"""
-    请撰写文章的一个小节。
-    【章节标题】：{req.sectionTitle}
-    【上下文/前文摘要】：{req.context[-500:]}
-    【写作风格】：{req.style}
-    【本小节核心写作要点】：{points_str}
-    请直接返回 Markdown 格式的正文内容。
+    # 标题必保留；写作要点优先于前文，前文保留最靠近本节的结尾部分；参考资料用剩余预算检索
+    fitted = fit_parts(CHAT_MODEL, "/generate/chunk", [
+        Part("title", section_title, required=True),
+        Part("points", points_str, priority=0),
+        Part("context", context, priority=1, keep="tail"),
+        materials_part(materials, f"{section_title}\n{points_str}", priority=2),
+    ])
+    context_text = fitted["context"]
+    if fitted["materials"]:
+        context_text = f"{context_text}\n\n参考资料：\n{fitted['materials']}".strip()
+    return render_prompt(
+        "chunk",
+        custom=custom_template,
+        TITLE=fitted["title"],
+        CONTEXT=context_text,
+        STYLE=style,
+        POINTS=fitted["points"],
+    )
+
+@router.post("/generate/chunk")
+async def generate_chunk_content(req: ChunkGenerateRequest):
+    messages = build_chunk_prompt(
+        req.sectionTitle, req.context, req.style, req.writingPoints, req.customPromptTemplate,
+        materials=materials_store.resolve(req.materials, req.materialsId),
+    )
+    return await create_stream_response(
+        CHAT_MODEL, messages, resumable=True, resume_grace=RESUMABLE_CHUNK_GRACE
+    )
+
+
+def summarize_section(title: str, content: str, limit: int = 150) -> str:
+    """前文摘要：取小节开头若干字，不额外调用模型"""
+    text = " ".join(content.split())
+    return f"{title}：{text[:limit]}"
+
+@router.post("/generate/document")
+async def generate_document(req: DocumentGenerateRequest):
     """
-    return create_stream_response(CHAT_MODEL, prompt)
+    按扁平化大纲并行生成所有二级小节，SSE 事件按 nodeId 区分：
+    section_start / delta / section_done / section_error，最后发送 done
+    chainChapters=True 时，后一章等待前一章完成并拿到其摘要作为上下文
+    """
+    nodes = [n for n in req.outline if isinstance(n, dict)]
+    titles = {n.get("id"): n.get("title", "") for n in nodes}
+    # 资料索引按内容缓存，各小节共用同一份索引；先在线程池里建好，各小节直接按相关度选取
+    materials = materials_store.resolve(req.materials, req.materialsId)
+    if materials and RETRIEVAL_ENABLED:
+        await materials_store.ingest_async(materials)
+    chapters = []  # [(chapter_node, [section_node, ...])]
+    for node in nodes:
+        if node.get("level") == 1:
+            chapters.append((node, []))
+        elif node.get("level") == 2:
+            if chapters and chapters[-1][0].get("id") == node.get("parentId"):
+                chapters[-1][1].append(node)
+            else:
+                # parentId 不在前一个一级标题下时单独成组
+                chapters.append(({"id": node.get("parentId"), "title": titles.get(node.get("parentId"), "")}, [node]))
+
+    parallel = max(1, min(req.parallel, DOC_GEN_MAX_PARALLEL))
+    semaphore = asyncio.Semaphore(parallel)
+    events: asyncio.Queue = asyncio.Queue()
+    summaries: dict = {}
+    chapter_done = [asyncio.Event() for _ in chapters]
+
+    async def run_section(chapter_idx: int, chapter: dict, section: dict, sibling_titles: list):
+        node_id = section.get("id")
+        if req.chainChapters and chapter_idx > 0:
+            await chapter_done[chapter_idx - 1].wait()
+
+        context_parts = []
+        if req.context:
+            context_parts.append(req.context)
+        if req.chainChapters:
+            previous = [summaries[i] for i in range(chapter_idx) if i in summaries]
+            if previous:
+                context_parts.append("前文章节摘要：" + "；".join(previous))
+        context_parts.append(f"所属章节：{chapter.get('title', '')}")
+        if chapter.get("chapterGuide"):
+            context_parts.append(f"章节引导：{chapter['chapterGuide']}")
+        if sibling_titles:
+            context_parts.append("本章其他小节：" + "、".join(sibling_titles))
+
+        async with semaphore:
+            await events.put(sse_event("section_start", {"nodeId": node_id}))
+            parts = []
+            try:
+                # 构建 prompt 也可能失败（如必需内容超出预算 413），同样只记为本节失败
+                messages = build_chunk_prompt(
+                    section.get("title", ""),
+                    "\n".join(context_parts),
+                    req.style,
+                    section.get("writingPoints", []),
+                    materials=materials,
+                )
+                async for chunk in coalesce(call_llm_stream(CHAT_MODEL, messages, priority=PRIORITY_BATCH)):
+                    parts.append(chunk)
+                    await events.put(sse_event("delta", {"nodeId": node_id, "text": chunk}))
+            except Exception as e:
+                await events.put(sse_event("section_error", {"nodeId": node_id, "error": str(e)}))
+                return ""
+        content = "".join(parts)
+        await events.put(sse_event("section_done", {"nodeId": node_id, "content": content}))
+        return content
+
+    async def run_chapter(chapter_idx: int, chapter: dict, sections: list):
+        titles_in_chapter = [s.get("title", "") for s in sections]
+        try:
+            # 某一节意外出错也不能中断本章其他小节和摘要、完成标记的记录
+            results = await asyncio.gather(*[
+                run_section(
+                    chapter_idx,
+                    chapter,
+                    section,
+                    [t for t in titles_in_chapter if t != section.get("title", "")],
+                )
+                for section in sections
+            ], return_exceptions=True)
+            summaries[chapter_idx] = "；".join(
+                summarize_section(s.get("title", ""), c)
+                for s, c in zip(sections, results) if isinstance(c, str) and c
+            )
+        finally:
+            chapter_done[chapter_idx].set()
 
+    async def event_generator():
+        tasks = [
+            asyncio.ensure_future(run_chapter(i, chapter, sections))
+            for i, (chapter, sections) in enumerate(chapters)
+        ]
+        all_done = asyncio.ensure_future(asyncio.gather(*tasks, return_exceptions=True))
+        all_done.add_done_callback(lambda _f: events.put_nowait(None))
+        total = sum(len(sections) for _, sections in chapters)
+        try:
+            yield sse_event("start", {"sections": total, "parallel": parallel})
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            yield sse_event("done", {"sections": total})
+        finally:
+            # 客户端断开时停止所有未完成的小节
+            all_done.cancel()
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(guard_stream(event_generator()), media_type="text/event-stream")
+
+
+def build_outline_from_materials_prompt(req: OutlineFromMaterialsRequest) -> list:
+    constraints = f"必须包含一级标题：{req.expertLevel1Titles}" if req.expertLevel1Titles else ""
+    materials = materials_store.resolve(req.materialsSummary, req.materialsId)
+    query = "\n".join([req.topic, req.concept, *req.expertLevel1Titles])
+    fitted = fit_parts(REASONING_MODEL, "/outline/from-materials", [
+        Part("topic", req.topic, required=True),
+        Part("constraints", constraints, required=True),
+        Part("concept", req.concept, priority=0),
+        materials_part(materials, query),
+    ])
+    return render_prompt(
+        "outline_from_materials",
+        custom=req.customPromptTemplate,
+        TOPIC=fitted["topic"],
+        CONCEPT=fitted["concept"],
+        MATERIALS=fitted["materials"],
+        CONSTRAINTS=fitted["constraints"],
+    )
 
 @router.post("/outline/from-materials")
-async def outline_from_materials(req: OutlineFromMaterialsRequest):
+async def outline_from_materials(req: OutlineFromMaterialsRequest, cache: bool = Depends(use_cache)):
     """写作大纲"""
-    prompt = f"""
-    基于以下材料生成详细的写作大纲（JSON数组格式）。
-    
-    主题：{req.topic}
-    核心构想：{req.concept}
-    参考材料摘要：{req.materialsSummary[:2000]}
-    {f"必须包含一级标题：{req.expertLevel1Titles}" if req.expertLevel1Titles else ""}
-    
-    要求格式示例（不要包含Markdown标记）：
-    [
-      {{
-        "title": "第一章...",
-        "writingPoints": [ {{ "text": "本章核心目标：阐述..." }} ], 
-        "children": [
-           {{ "title": "1.1...", "writingPoints": [{{ "text": "要点1" }}] }}
-        ]
-      }}
-    ]
-    """
+    messages = build_outline_from_materials_prompt(req)
     
     # 2. 调用 LLM
-    raw_result = await call_llm(REASONING_MODEL, [{"role": "user", "content": prompt}])
+    raw_result = await call_llm(REASONING_MODEL, messages, cache=cache, schema=structured.OUTLINE)
     
     # 3. 清洗 JSON (得到嵌套的 list/dict)
     cleaned_data = clean_and_parse_json(raw_result, default_value=[])
@@ -584,96 +1049,293 @@ async def outline_from_materials(req: OutlineFromMaterialsRequest):
     final_structure = process_llm_outline_to_frontend_structure(cleaned_data)
     
     # 5. 返回
-    print(f"[DEBUG] Generated {len(final_structure)} nodes") # Debug日志
     return {"result": final_structure}
 
+@router.post("/outline/from-materials/stream")
+async def outline_from_materials_stream(req: OutlineFromMaterialsRequest):
+    """流式写作大纲，事件格式同 /outline/stream"""
+    return await stream_outline_response(build_outline_from_materials_prompt(req))
+
 @router.post("/generate/template")
 async def generate_template(req: TemplateRequest):
-    prompt = f"为章节'{req.title}'生成写作模板，要点：{str(req.points)}"
-    result = await call_llm(CHAT_MODEL, [{"role": "user", "content": prompt}])
+    messages = render_prompt("template", TITLE=req.title, POINTS=str(req.points))
+    result = await call_llm(CHAT_MODEL, messages)
     return {"result": result}
 
+def build_rewrite_guidance_values(req: RewriteGuidanceRequest) -> dict:
+    writing_points = doc_sessions.resolve_field(req.writingPoints, req.docSessionId, req.nodeId, "writingPoints")
+    points_str = "\n".join(
+        p.get("text", "") if isinstance(p, dict) else str(p) for p in writing_points
+    )
+    # 原文和指导必须完整发送，参考资料只用剩余预算，按指导与写作要点检索
+    fitted = fit_parts(REASONING_MODEL, "/rewrite/guidance", [
+        Part("content", session_content(req, req.currentContent), required=True),
+        Part("guidance", req.guidance, required=True),
+        materials_part(
+            materials_store.resolve(req.materials, req.materialsId),
+            f"{req.guidance}\n{points_str}",
+        ),
+    ])
+    return {"CONTENT": fitted["content"], "GUIDANCE": fitted["guidance"], "MATERIALS": fitted["materials"]}
+
+def build_rewrite_guidance_prompt(req: RewriteGuidanceRequest) -> list:
+    return render_prompt("rewrite_guidance", **build_rewrite_guidance_values(req))
+
 @router.post("/rewrite/guidance")
 async def rewrite_guidance(req: RewriteGuidanceRequest):
-    prompt = f"根据指导重写：\n内容：{req.currentContent}\n指导：{req.guidance}"
-    result = await call_llm(REASONING_MODEL, [{"role": "user", "content": prompt}])
+    if req.editScript:
+        # 原文是必选部分，完整发送，替换可以直接应用在原文上
+        content = session_content(req, req.currentContent)
+        return await edit_or_rewrite(REASONING_MODEL, "rewrite_guidance", content, **build_rewrite_guidance_values(req))
+    messages = build_rewrite_guidance_prompt(req)
+    result = await call_llm(REASONING_MODEL, messages)
     return {"result": result}
 
 @router.post("/partial-merge")
 async def partial_merge(req: PartialMergeRequest):
-    chat_txt = "\n".join([f"{m.role}:{m.text}" for m in req.chatMessages])
-    prompt = f"根据对话融合片段：\n对话：{chat_txt}\n片段：{req.originalText}"
+    chat_txt = "\n".join([f"{m.role}:{m.text}" for m in session_chat(req, req.chatMessages)])
+    ensure_fits(REASONING_MODEL, "/partial-merge", chat_txt, req.originalText)
+    if req.editScript:
+        return await edit_or_rewrite(
+            REASONING_MODEL, "partial_merge", req.originalText, CHAT=chat_txt, CONTENT=req.originalText
+        )
+    messages = render_prompt("partial_merge", CHAT=chat_txt, CONTENT=req.originalText)
    
-    return create_stream_response(REASONING_MODEL, prompt)
+    return await create_stream_response(REASONING_MODEL, messages)
 
 @router.post("/selection-ref")
 async def selection_ref(req: SelectionRefRequest):
-    chat_txt = "\n".join([f"{m.role}:{m.text}" for m in req.chatMessages])
-    prompt = f"指令：{req.instruction}\n对话：{chat_txt}\n原文：{req.originalText}"
+    chat_txt = "\n".join([f"{m.role}:{m.text}" for m in session_chat(req, req.chatMessages)])
+    ensure_fits(REASONING_MODEL, "/selection-ref", req.instruction, chat_txt, req.originalText)
+    if req.editScript:
+        return await edit_or_rewrite(
+            REASONING_MODEL, "selection_ref", req.originalText,
+            INSTRUCTION=req.instruction, CHAT=chat_txt, CONTENT=req.originalText,
+        )
+    messages = render_prompt(
+        "selection_ref", INSTRUCTION=req.instruction, CHAT=chat_txt, CONTENT=req.originalText
+    )
   
-    return create_stream_response(REASONING_MODEL, prompt)
+    return await create_stream_response(REASONING_MODEL, messages)
 
 
-@router.post("/review/chunk")
-async def review_chunk(req: ReviewChunkRequest):
-    prompt = f"评审章节'{req.sectionTitle}'：\n{req.content}\n请返回JSON：{{score, summary, todos}}"
-    raw_result = await call_llm(REASONING_MODEL, [{"role": "user", "content": prompt}])
-    
+def build_review_chunk_prompt(section_title: str, content: str) -> list:
+    return render_prompt("review_chunk", TITLE=section_title, CONTENT=content)
+
+def resolve_review_section(section: ReviewChunkRequest, doc_session_id: Optional[str] = None) -> ReviewChunkRequest:
+    """小节标题和正文未传时从文档会话的节点补全"""
+    session_id = section.docSessionId or doc_session_id
+    if not session_id or not section.nodeId:
+        return section
+    return section.model_copy(update={
+        "sectionTitle": doc_sessions.resolve_field(section.sectionTitle, session_id, section.nodeId, "title"),
+        "content": doc_sessions.resolve_content(section.content, session_id, section.nodeId),
+    })
+
+async def review_section(title: str, content: str, memo: bool = True, call=None) -> tuple:
+    """
+    单节评审，清洗后的结果按 (标题, 正文哈希) 记忆
+    返回 (结果, 是否解析成功, 是否来自记忆)；上游异常向上抛出
+    """
+    key = review_memo.key(REASONING_MODEL, "review_chunk", title, content)
+    if memo:
+        hit = review_memo.get(key)
+        if hit is not None:
+            return hit, True, True
+    messages = build_review_chunk_prompt(title, content)
+    raw_result = await (call or call_llm)(REASONING_MODEL, messages, schema=structured.REVIEW)
     parsed = clean_and_parse_json(raw_result, default_value={})
-    
+    ok = isinstance(parsed, dict) and bool(parsed)
     # ✅ 应用清洗
-    final_data = normalize_review_data(parsed)
-    
-    return {"result": final_data}
+    result = normalize_review_data(parsed)
+    if ok:
+        review_memo.set(key, result)
+    return result, ok, False
+
+@router.post("/review/chunk")
+async def review_chunk(req: ReviewChunkRequest, cache: bool = Depends(use_cache)):
+    req = resolve_review_section(req)
+    ensure_fits(REASONING_MODEL, "/review/chunk", req.sectionTitle, req.content)
+    final_data, _, cached = await review_section(req.sectionTitle, req.content, memo=cache)
+    return {"result": final_data, "cached": cached}
+
+@router.post("/review/batch")
+async def review_batch(req: BatchReviewRequest, cache: bool = Depends(use_cache)):
+    """
+    一次提交全部小节并发评审，SSE 事件：
+    section (单节结果，附 index/ok/cached)，最后 summary (全文汇总分，以及重新评审 / 复用的节数)
+    单节失败或 JSON 无法解析只影响该节，不影响整批；内容未变的小节直接复用上次结果，不占并发名额
+    """
+    parallel = max(1, min(req.parallel, REVIEW_BATCH_MAX_PARALLEL))
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def limited_call(model: str, messages: list, schema=None) -> str:
+        async with semaphore:
+            return await call_llm(model, messages, schema=schema)
+
+    async def review_one(index: int, section: ReviewChunkRequest):
+        try:
+            section = resolve_review_section(section, req.docSessionId)
+            result, ok, cached = await review_section(
+                section.sectionTitle, section.content, memo=cache, call=limited_call
+            )
+        except Exception as e:
+            return index, {"sectionTitle": section.sectionTitle, "ok": False, "cached": False,
+                           "error": str(e), "result": normalize_review_data(None)}
+        return index, {"sectionTitle": section.sectionTitle, "ok": ok, "cached": cached, "result": result}
+
+    async def event_generator():
+        tasks = [asyncio.ensure_future(review_one(i, s)) for i, s in enumerate(req.sections)]
+        results = [None] * len(tasks)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, item = await next_done
+                results[index] = item
+                yield sse_event("section", {"index": index, **item})
+
+            scored = [r for r in results if r["ok"]]
+            summary = {
+                "score": round(sum(r["result"]["score"] for r in scored) / len(scored)) if scored else 0,
+                "sections": len(results),
+                "succeeded": len(scored),
+                "failed": len(results) - len(scored),
+                "cached": sum(1 for r in results if r["cached"]),
+                "fresh": sum(1 for r in results if r["ok"] and not r["cached"]),
+                "lowest": sorted(
+                    ({"index": i, "sectionTitle": r["sectionTitle"], "score": r["result"]["score"]}
+                     for i, r in enumerate(results) if r["ok"]),
+                    key=lambda x: x["score"],
+                )[:3],
+            }
+            yield sse_event("summary", summary)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(guard_stream(event_generator()), media_type="text/event-stream")
 
 @router.post("/review/full")
 async def review_full(req: FullReviewRequest):
-    prompt = "全文评审..." 
-    result = await call_llm(REASONING_MODEL, [{"role": "user", "content": prompt}])
+    # 目前的全文评审 prompt 不引用大纲，这里只校验会话存在，避免静默使用过期的会话
+    doc_sessions.resolve_outline(req.outline, req.docSessionId)
+    messages = render_prompt("review_full")
+    result = await call_llm(REASONING_MODEL, messages)
     return {"result": result}
 
+def build_apply_segments(req: ApplySuggestionsRequest) -> Optional[tuple]:
+    """长文返回 (各段原文, 各段 prompt)；短文返回 None，由调用方整篇处理"""
+    content = session_content(req, req.content)
+    if not is_long(content, LONG_DOC_THRESHOLD_TOKENS, req.longDoc):
+        return None
+    # 每段只处理相关建议
+    segments = split_document(content, LONG_DOC_SEGMENT_TOKENS)
+    suggestions = str(req.suggestions)
+    return segments, [
+        render_prompt("review_apply_segment", SUGGESTIONS=suggestions, CONTENT=segment) for segment in segments
+    ]
+
+def build_apply_prompt(req: ApplySuggestionsRequest) -> list:
+    content = session_content(req, req.content)
+    ensure_fits(REASONING_MODEL, "/review/apply", str(req.suggestions), content)
+    return render_prompt("review_apply", SUGGESTIONS=str(req.suggestions), CONTENT=content)
+
+def merge_applied(segments: list, outcomes: list) -> list:
+    # 失败或空白的段保留原文，保证拼回的全文完整
+    return [r if ok and r.strip() else seg for seg, (ok, r) in zip(segments, outcomes)]
+
+async def apply_suggestions_edits(req: ApplySuggestionsRequest) -> dict:
+    """
+    编辑脚本模式：短文整篇一次；长文按段各自生成替换列表，某段脚本不可用时只有该段整段重写，
+    调用失败的段保留原文。edits 的偏移相对于所在段 (segment)
+    """
+    suggestions = str(req.suggestions)
+    content = session_content(req, req.content)
+    long_doc = build_apply_segments(req)
+    if not long_doc:
+        ensure_fits(REASONING_MODEL, "/review/apply", suggestions, content)
+        return await edit_or_rewrite(REASONING_MODEL, "review_apply", content, SUGGESTIONS=suggestions, CONTENT=content)
+
+    segments, _ = long_doc
+
+    async def edit_segment(i: int, segment: str):
+        return await edit_or_rewrite(
+            REASONING_MODEL, "review_apply_segment", segment, SUGGESTIONS=suggestions, CONTENT=segment
+        )
+
+    outcomes = await map_segments(segments, edit_segment, LONG_DOC_MAX_PARALLEL)
+    texts = merge_applied(segments, [(ok, r["result"] if ok else r) for ok, r in outcomes])
+    original, result = "\n\n".join(segments), "\n\n".join(texts)
+    edits = [
+        {**edit, "segment": i}
+        for i, (ok, r) in enumerate(outcomes) if ok
+        for edit in r["edits"] or []
+    ]
+    fallbacks = [r["fallback"] if ok else "error" for ok, r in outcomes]
+    return {
+        "result": result,
+        "mode": "edits" if not any(fallbacks) else "mixed",
+        "fallback": None,
+        "segments": [{"mode": r["mode"] if ok else "error", "fallback": f} for (ok, r), f in zip(outcomes, fallbacks)],
+        "edits": edits,
+        "diff": edit_script.unified_diff(original, result),
+    }
+
 @router.post("/review/apply")
 async def apply_suggestions(req: ApplySuggestionsRequest):
-    prompt = f"根据建议修改：\n建议：{req.suggestions}\n原文：{req.content}"
-    result = await call_llm(REASONING_MODEL, [{"role": "user", "content": prompt}])
+    if req.editScript:
+        return await apply_suggestions_edits(req)
+    long_doc = build_apply_segments(req)
+    if long_doc:
+        segments, prompts = long_doc
+
+        async def apply_segment(i: int, segment: str):
+            return await collect_stream(call_llm_stream(REASONING_MODEL, prompts[i], priority=PRIORITY_JSON))
+
+        outcomes = await map_segments(segments, apply_segment, LONG_DOC_MAX_PARALLEL)
+        return {"result": "\n\n".join(merge_applied(segments, outcomes))}
+
+    messages = build_apply_prompt(req)
+    result = await call_llm(REASONING_MODEL, messages)
     return {"result": result}
 
 @router.post("/guide/global")
-async def global_guide(req: GlobalGuideRequest):
+async def global_guide(req: GlobalGuideRequest, cache: bool = Depends(use_cache)):
     """全文写作引导"""
-    prompt = f"""
-    请生成《全文写作指导》和《分章节指导》。
-    主题：{req.topic}
-    概念：{req.concept}
-    大纲结构：{str(req.outline)[:1000]}
-    
-    请返回 JSON 对象：
-    {{
-      "globalOverview": "...",
-      "chapterGuides": {{ "章节名": "..." }}
-    }}
-    """
-    raw_result = await call_llm(CHAT_MODEL, [{"role": "user", "content": prompt}])
+    outline = doc_sessions.resolve_outline(req.outline, req.docSessionId)
+    if req.docSessionId and not req.outline:
+        # 大纲只需要结构，不把各节正文带进 prompt
+        outline = [{k: v for k, v in n.items() if k != "content"} for n in outline]
+    fitted = fit_parts(CHAT_MODEL, "/guide/global", [
+        Part("topic", doc_sessions.resolve_meta(req.topic, req.docSessionId, "topic"), required=True),
+        Part("concept", doc_sessions.resolve_meta(req.concept, req.docSessionId, "concept"), priority=0),
+        Part("outline", str(outline), priority=1),
+    ])
+    messages = render_prompt(
+        "guide_global",
+        TOPIC=fitted["topic"],
+        CONCEPT=fitted["concept"],
+        OUTLINE=fitted["outline"],
+    )
+    raw_result = await call_llm(CHAT_MODEL, messages, cache=cache, schema=structured.GLOBAL_GUIDE)
     default = {"globalOverview": "AI未能生成指导", "chapterGuides": {}}
-    print(raw_result)
     return {"result": clean_and_parse_json(raw_result, default_value=default)}
 
 @router.post("/guide/contextual")
-async def contextual_guide(req: ContextualGuidanceRequest):
+async def contextual_guide(req: ContextualGuidanceRequest, cache: bool = Depends(use_cache)):
     # ✅ [已修复] 更新 Prompt 要求 JSON 并增加解析
-    prompt = f"""
-    为章节'{req.title}'生成简短改写引导和推荐资料。
-    请返回 JSON 格式：
-    {{ "guidance": "...", "materials": "..." }}
-    """
-    raw_result = await call_llm(CHAT_MODEL, [{"role": "user", "content": prompt}])
+    title = doc_sessions.resolve_field(req.title, req.docSessionId, req.nodeId, "title")
+    messages = render_prompt("guide_contextual", TITLE=title)
+    raw_result = await call_llm(CHAT_MODEL, messages, cache=cache, schema=structured.CONTEXTUAL_GUIDE)
     default = {"guidance": "无建议", "materials": ""}
     return {"result": clean_and_parse_json(raw_result, default_value=default)}
 
+def build_points_prompt(req: PointsRequest) -> list:
+    return render_prompt("points", TITLE=req.title)
+
 @router.post("/points")
-async def generate_points(req: PointsRequest):
-    prompt = f"为'{req.title}'生成3个写作要点，返回JSON数组。"
-    raw_result = await call_llm(CHAT_MODEL, [{"role": "user", "content": prompt}])
+async def generate_points(req: PointsRequest, cache: bool = Depends(use_cache)):
+    messages = build_points_prompt(req)
+    raw_result = await call_llm(CHAT_MODEL, messages, cache=cache, schema=structured.POINTS)
     
     cleaned_data = clean_and_parse_json(raw_result, default_value=[])
     
@@ -682,15 +1344,217 @@ async def generate_points(req: PointsRequest):
     
     return {"result": final_data}
 
+@router.post("/points/stream")
+async def generate_points_stream(req: PointsRequest):
+    """流式写作要点：每个要点闭合后以 point 事件推送（已带 ID）"""
+    base_id = int(time.time() * 1000)
+
+    def on_value(path, value):
+        yield "point", build_writing_point(value, path[0], base_id)
+
+    def on_done(full_text):
+        return process_writing_points(clean_and_parse_json(full_text, default_value=[]), base_id)
+
+    return await create_json_stream_response(
+        CHAT_MODEL,
+        build_points_prompt(req),
+        watch=lambda path: len(path) == 1,
+        on_value=on_value,
+        on_done=on_done,
+        schema=structured.POINTS,
+    )
+
 @router.post("/points/more")
 async def more_points(req: MorePointsRequest):
-    prompt = "建议下一个写作要点。"
-    result = await call_llm(CHAT_MODEL, [{"role": "user", "content": prompt}])
+    messages = render_prompt("points_more")
+    result = await call_llm(CHAT_MODEL, messages)
     return {"result": result}
 
 @router.post("/related-queries")
-async def related_queries(req: RelatedQueriesRequest):
+async def related_queries(req: RelatedQueriesRequest, cache: bool = Depends(use_cache)):
     # ✅ [已存在，保持]
-    prompt = "生成3个搜索关键词，JSON数组。"
-    raw_result = await call_llm(CHAT_MODEL, [{"role": "user", "content": prompt}])
-    return {"result": clean_and_parse_json(raw_result, default_value=[])}
\ No newline at end of file
+    messages = render_prompt("related_queries")
+    raw_result = await call_llm(CHAT_MODEL, messages, cache=cache, schema=structured.STRING_LIST)
+    return {"result": clean_and_parse_json(raw_result, default_value=[])}
+
+
+# ================= 参考资料检索 =================
+
+@router.post("/materials")
+async def ingest_materials(req: MaterialsIngestRequest):
+    """上传参考资料并建立检索索引，之后各接口可只传 materialsId"""
+    materials_id, index = await materials_store.ingest_async(req.text)
+    return {
+        "result": {
+            "materialsId": materials_id,
+            "chunks": len(index.chunks),
+            "tokens": index.total_tokens,
+            "buildMs": round(index.build_ms, 1),
+        }
+    }
+
+@router.post("/materials/search")
+async def search_materials(req: MaterialsSearchRequest):
+    """按查询返回最相关的资料片段，便于调试检索效果"""
+    index = materials_store.get(req.materialsId)
+    hits = index.search(req.query, max(1, min(req.k, 50)))
+    return {"result": [{"chunk": idx, "score": score, "text": text} for idx, score, text in hits]}
+
+
+# ================= 文档会话 =================
+
+@router.post("/doc-sessions")
+async def create_doc_session(req: DocSessionCreateRequest):
+    """创建文档会话，可带初始补丁（通常是一次 setOutline）"""
+    session = doc_sessions.create(req.ops)
+    return {"result": {"docSessionId": session.id, "version": session.version}}
+
+@router.patch("/doc-sessions/{doc_session_id}")
+async def patch_doc_session(doc_session_id: str, req: DocSessionPatchRequest):
+    """应用增量补丁，返回新版本号；baseVersion 不一致时返回 409"""
+    session = doc_sessions.patch(doc_session_id, req.ops, req.baseVersion)
+    return {"result": {"docSessionId": session.id, "version": session.version}}
+
+@router.get("/doc-sessions/{doc_session_id}")
+async def get_doc_session(doc_session_id: str):
+    """取回完整状态，用于 409 之后重新同步或页面刷新后恢复"""
+    return {"result": doc_sessions.get(doc_session_id).snapshot()}
+
+@router.delete("/doc-sessions/{doc_session_id}")
+async def delete_doc_session(doc_session_id: str):
+    doc_sessions.delete(doc_session_id)
+    return {"result": "ok"}
+
+
+# ================= 异步任务 =================
+# 提交时就把 prompt 构建好落库（文档会话、资料索引都只在内存里），重启后按原样重新生成
+
+async def submit_job(kind: str, model: str, calls: list, originals: list = None) -> dict:
+    params = {"model": model, "calls": calls, "originals": originals}
+    return {"result": await job_queue.submit(kind, params, current_client.get())}
+
+async def run_job(kind: str, params: dict, job: JobContext) -> str:
+    """
+    单次调用：流式生成，增量即部分输出
+    分段调用（长文按建议修改）：各段并发，前面的段都完成后按顺序追加到部分输出，失败的段保留原文；
+    有段失败时任务记为失败，部分输出里仍是拼好的全文（失败段为原文），error 列出失败的段
+    上游调用走 job 优先级：只排队不拒绝，交互请求空闲时才执行
+    """
+    model, calls, originals = params["model"], params["calls"], params["originals"]
+    if not originals:
+        parts = []
+        async for chunk in call_llm_stream(model, calls[0], priority=PRIORITY_JOB):
+            parts.append(chunk)
+            job.append(chunk)
+        return "".join(parts)
+
+    finished = {}
+    failed = []
+    emitted = 0
+
+    async def apply_segment(i: int, segment: str):
+        nonlocal emitted
+        try:
+            result = await collect_stream(call_llm_stream(model, calls[i], priority=PRIORITY_JOB))
+            finished[i] = result if result.strip() else segment
+            return result
+        except Exception:
+            finished[i] = segment
+            failed.append(i)
+            raise
+        finally:
+            job.progress(len(finished), len(originals), len(failed))
+            while emitted in finished:
+                job.append(("\n\n" if emitted else "") + finished[emitted])
+                emitted += 1
+
+    outcomes = await map_segments(originals, apply_segment, LONG_DOC_MAX_PARALLEL)
+    if failed:
+        errors = {str(r) for ok, r in outcomes if not ok}
+        raise RuntimeError(
+            f"{len(failed)}/{len(originals)} 段修改失败（第 {', '.join(str(i + 1) for i in sorted(failed))} 段，"
+            f"输出中保留原文）：{'; '.join(sorted(errors))[:200]}"
+        )
+    return "\n\n".join(merge_applied(originals, outcomes))
+
+@router.post("/jobs/generate")
+async def submit_generate_job(req: ArticleRequest):
+    """后台生成长文；返回的 jobId 用于轮询 GET /jobs/{jobId} 或订阅 /jobs/{jobId}/events"""
+    return await submit_job("generate", CHAT_MODEL, [build_article_prompt(req)])
+
+@router.post("/jobs/review-apply")
+async def submit_apply_job(req: ApplySuggestionsRequest):
+    long_doc = build_apply_segments(req)
+    if long_doc:
+        segments, prompts = long_doc
+        return await submit_job("review_apply", REASONING_MODEL, prompts, segments)
+    return await submit_job("review_apply", REASONING_MODEL, [build_apply_prompt(req)])
+
+@router.post("/jobs/rewrite-guidance")
+async def submit_rewrite_guidance_job(req: RewriteGuidanceRequest):
+    return await submit_job("rewrite_guidance", REASONING_MODEL, [build_rewrite_guidance_prompt(req)])
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, offset: int = 0):
+    """任务状态与部分输出；offset 为已取到的字符数，只返回其后的新输出"""
+    return {"result": job_queue.get(job_id, offset)}
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, offset: int = 0):
+    """
+    SSE 订阅：output (新增文本及累计字符数)、progress (分段任务的完成段数)，
+    最后以 succeeded / failed / cancelled 事件携带任务详情结束；断线后带 offset 重新订阅
+    """
+    job_queue.get(job_id)
+
+    async def event_generator():
+        position = offset
+        async for event, data in job_queue.subscribe(job_id, offset):
+            if event == "keepalive":
+                yield ": keepalive\n\n"
+            elif event == "output":
+                position += len(data)
+                yield sse_event("output", {"text": data, "offset": position})
+            else:
+                yield sse_event(event, data)
+
+    return StreamingResponse(coalesce(event_generator()), media_type="text/event-stream")
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    return {"result": await job_queue.cancel(job_id)}
+
+
+# ================= 运维 =================
+
+@router.get("/llm/stats")
+async def llm_stats():
+    """上游 LLM 调用延迟摘要，用于对比连接池开启前后的效果"""
+    return {
+        "result": {
+            **get_latency_stats(),
+            "cache": get_cache_stats(),
+            "singleflight": get_singleflight_stats(),
+            "scheduler": scheduler.get_stats(),
+            "context": get_budget_stats(),
+            "long_doc": get_long_doc_stats(),
+            "streams": get_stream_stats(),
+            "resumable": resumable_store.get_stats(),
+            "batching": get_batching_stats(),
+            "structured": get_structured_stats(),
+            "edit_script": get_edit_script_stats(),
+            "doc_sessions": doc_sessions.get_stats(),
+            "review_memo": review_memo.get_stats(),
+            "upstreams": upstream_pool.get_stats(),
+            "resilience": get_resilience_stats(),
+            "routing": model_router.get_stats(),
+            "retrieval": materials_store.get_stats(),
+            "jobs": job_queue.get_stats(),
+            "channel": get_channel_stats(),
+        }
+    }
+
+@router.get("/prompts")
+async def prompt_templates():
+    """已注册的 prompt 模板，customPromptTemplate 可直接传模板名"""
+    return {"result": list_templates()}
@@ -1,6 +1,22 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from typing import Optional
-from typing import List, Any, Optional
+from typing import List, Any, Optional, Dict, ClassVar, Tuple
+
+# 文档会话引用：已创建文档会话 (/doc-sessions) 时，正文、大纲、对话等字段可以不传，
+# 由服务端按 docSessionId + nodeId 补全；两者都传时以请求里的内容为准
+class DocSessionRef(BaseModel):
+    docSessionId: Optional[str] = None
+    nodeId: Optional[str] = None
+    # 可由文档会话补全的字段：不带 docSessionId 时仍然必填，缺少时返回 422
+    sessionFields: ClassVar[Tuple[str, ...]] = ()
+
+    @model_validator(mode="after")
+    def require_session_fields(self):
+        if self.docSessionId is None:
+            missing = [name for name in self.sessionFields if name not in self.model_fields_set]
+            if missing:
+                raise ValueError(f"未传 docSessionId 时必须提供：{', '.join(missing)}")
+        return self
 
 # 基础请求模型
 class OutlineRequest(BaseModel):
@@ -11,17 +27,26 @@ class ArticleRequest(BaseModel):
     outline: str
     requirements: str
 
-class PolishRequest(BaseModel):
-    content: str
+class PolishRequest(DocSessionRef):
+    sessionFields = ("content",)
+    content: str = ""
+    # 长文档分段并发处理；不传时按长度自动判断
+    longDoc: Optional[bool] = None
 
 # === 新增的模型 (对应新接口) ===
 
-class RewriteRequest(BaseModel):
-    content: str
+class RewriteRequest(DocSessionRef):
+    sessionFields = ("content",)
+    content: str = ""
     requirements: str
+    # 长文档分段并发处理；不传时按长度自动判断
+    longDoc: Optional[bool] = None
 
-class ReviewRequest(BaseModel):
-    content: str
+class ReviewRequest(DocSessionRef):
+    sessionFields = ("content",)
+    content: str = ""
+    # 长文档分段并发处理；不传时按长度自动判断
+    longDoc: Optional[bool] = None
 
 class ChatRequest(BaseModel):
     query: str
@@ -35,9 +60,12 @@ class SmartEditRequest(BaseModel):
     instruction: str
     type: str  # 'rewrite' 或 'continue'
 
-class TodoFixRequest(BaseModel):
+class TodoFixRequest(DocSessionRef):
+    sessionFields = ("content",)
     todo: str
-    content: str
+    content: str = ""
+    # 只返回替换列表，由服务端应用到原文（见 edit_script.py）
+    editScript: bool = False
 
 class DetailedInfoRequest(BaseModel):
     topic: str
@@ -71,6 +99,8 @@ class OutlineFromMaterialsRequest(BaseModel):
     materialsSummary: str
     expertLevel1Titles: List[str] = []
     customPromptTemplate: Optional[str] = None
+    # 已通过 /materials 上传的资料，可代替原文传递
+    materialsId: Optional[str] = None
 
 class ChunkGenerateRequest(BaseModel):
     sectionTitle: str
@@ -78,17 +108,25 @@ class ChunkGenerateRequest(BaseModel):
     style: str = "professional"
     writingPoints: List[Any] = []
     customPromptTemplate: Optional[str] = None
+    # 参考资料超出预算时按本节标题与要点检索相关片段
+    materials: str = ""
+    materialsId: Optional[str] = None
 
 class TemplateRequest(BaseModel):
     title: str
     points: List[Any]
 
 # 编辑润色
-class RewriteGuidanceRequest(BaseModel):
-    currentContent: str
+class RewriteGuidanceRequest(DocSessionRef):
+    sessionFields = ("currentContent",)
+    currentContent: str = ""
     guidance: str
     materials: str
     writingPoints: List[Any] = []
+    # 已通过 /materials 上传的资料，可代替原文传递
+    materialsId: Optional[str] = None
+    # 只返回替换列表，由服务端应用到原文（见 edit_script.py）
+    editScript: bool = False
 
 class ContinueRequest(BaseModel):
     sectionTitle: Optional[str] = ""
@@ -98,38 +136,58 @@ class MergePolishRequest(BaseModel):
     currentContent: str
     chatMessages: List[ChatMessageModel]
 
-class PartialMergeRequest(BaseModel):
+class PartialMergeRequest(DocSessionRef):
+    sessionFields = ("chatMessages",)
     originalText: str
-    chatMessages: List[ChatMessageModel]
-
-class SelectionRefRequest(BaseModel):
+    chatMessages: List[ChatMessageModel] = []
+    # 使用文档会话中的对话记录时的键，默认为 nodeId
+    chatKey: Optional[str] = None
+    # 只返回替换列表，由服务端应用到原文（见 edit_script.py）
+    editScript: bool = False
+
+class SelectionRefRequest(DocSessionRef):
+    sessionFields = ("chatMessages",)
     originalText: str
-    chatMessages: List[ChatMessageModel]
+    chatMessages: List[ChatMessageModel] = []
     instruction: str
+    # 使用文档会话中的对话记录时的键，默认为 nodeId
+    chatKey: Optional[str] = None
+    # 只返回替换列表，由服务端应用到原文（见 edit_script.py）
+    editScript: bool = False
 
 # 评审
-class ReviewChunkRequest(BaseModel):
-    sectionTitle: str
-    content: str
+class ReviewChunkRequest(DocSessionRef):
+    sessionFields = ("sectionTitle", "content")
+    sectionTitle: str = ""
+    content: str = ""
     writingPoints: List[Any] = []
 
-class FullReviewRequest(BaseModel):
-    outline: List[Any]
+class FullReviewRequest(DocSessionRef):
+    sessionFields = ("outline",)
+    outline: List[Any] = []
 
-class ApplySuggestionsRequest(BaseModel):
-    content: str
+class ApplySuggestionsRequest(DocSessionRef):
+    sessionFields = ("content",)
+    content: str = ""
     suggestions: List[str]
+    # 长文档分段并发处理；不传时按长度自动判断
+    longDoc: Optional[bool] = None
+    # 只返回替换列表，由服务端应用到原文（见 edit_script.py）
+    editScript: bool = False
 
 # 指导
-class GlobalGuideRequest(BaseModel):
-    topic: str
-    concept: str
-    materials: str
-    outline: List[Any]
+class GlobalGuideRequest(DocSessionRef):
+    sessionFields = ("topic", "concept", "materials", "outline")
+    # 未传时取文档会话 meta 中的同名字段
+    topic: str = ""
+    concept: str = ""
+    materials: str = ""
+    outline: List[Any] = []
 
-class ContextualGuidanceRequest(BaseModel):
-    title: str
-    content: str
+class ContextualGuidanceRequest(DocSessionRef):
+    sessionFields = ("title", "content")
+    title: str = ""
+    content: str = ""
 
 # 辅助
 class PointsRequest(BaseModel):
@@ -153,11 +211,121 @@ class AutoWriteQuestionsRequest(BaseModel):
     sectionTitle: str
     writingPoints: List[Any] = []
     materials: str = ""
+    # 已通过 /materials 上传的资料，可代替原文传递
+    materialsId: Optional[str] = None
 
 
-class AutoWriteNextQuestionRequest(BaseModel):
+class AutoWriteNextQuestionRequest(DocSessionRef):
     sectionTitle: str
     writingPoints: List[Any] = []
     materials: str = ""
+    # 已通过 /materials 上传的资料，可代替原文传递
+    materialsId: Optional[str] = None
     history: List[ChatMessageModel] = []
+    # 使用文档会话中的访谈记录时的键，默认为 nodeId
+    chatKey: Optional[str] = None
+
+
+# 全文并行生成：outline 为 /outline 系列接口返回的扁平 OutlineNode 列表
+class DocumentGenerateRequest(BaseModel):
+    outline: List[Any]
+    style: str = "professional"
+    context: str = ""
+    parallel: int = 4
+    chainChapters: bool = False
+    # 各小节按自己的标题与要点从资料中检索相关片段
+    materials: str = ""
+    materialsId: Optional[str] = None
+
+
+# 批量评审：一次提交全部小节
+class BatchReviewRequest(BaseModel):
+    sections: List[ReviewChunkRequest]
+    parallel: int = 4
+    # 各节未单独指定 docSessionId 时使用
+    docSessionId: Optional[str] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def inherit_doc_session(cls, data: Any) -> Any:
+        # 先把整批的 docSessionId 下发到各节，各节的必填校验才能按会话放宽
+        if isinstance(data, dict) and data.get("docSessionId") and isinstance(data.get("sections"), list):
+            data = {**data, "sections": [
+                {**section, "docSessionId": data["docSessionId"]}
+                if isinstance(section, dict) and not section.get("docSessionId") else section
+                for section in data["sections"]
+            ]}
+        return data
+
+
+# 参考资料检索：上传后按 materialsId 引用
+class MaterialsIngestRequest(BaseModel):
+    text: str
+
+
+class MaterialsSearchRequest(BaseModel):
+    materialsId: str
+    query: str
+    k: int = 5
+
+
+# 文档会话：创建时可带初始补丁，之后只发送增量
+# ops 中每一项形如 {"op": "setContent", "nodeId": ..., "content": ...}，
+# 支持 setOutline / upsertNode / removeNode / setContent / spliceContent / appendChat / setChat / setMeta
+class DocSessionCreateRequest(BaseModel):
+    ops: List[Dict[str, Any]] = []
+
+
+class DocSessionPatchRequest(BaseModel):
+    ops: List[Dict[str, Any]]
+    # 补丁基于的版本，与服务端不一致时返回 409；不传则不检查
+    baseVersion: Optional[int] = None
+
+
+# ================= 结构化输出：模型应返回的 JSON 结构 =================
+# 由 services/structured.py 转成 JSON Schema，作为约束解码参数发给上游
+
+class WritingPointOutput(BaseModel):
+    text: str
+    subPoints: List[str] = []
+
+
+class OutlineSectionOutput(BaseModel):
+    title: str
+    writingPoints: List[WritingPointOutput] = []
+
+
+class OutlineChapterOutput(BaseModel):
+    title: str
+    writingPoints: List[WritingPointOutput] = []
+    children: List[OutlineSectionOutput] = []
+
+
+class ReviewOutput(BaseModel):
+    score: int
+    summary: str
+    todos: List[str]
+
+
+class SuggestionsOutput(BaseModel):
+    userQuestions: List[str]
+    aiInfo: List[str]
+
+
+class GlobalGuideOutput(BaseModel):
+    globalOverview: str
+    chapterGuides: Dict[str, str]
+
+
+class ContextualGuideOutput(BaseModel):
+    guidance: str
+    materials: str
+
+
+class EditOutput(BaseModel):
+    find: str
+    replace: str
+
 
+class EditScriptOutput(BaseModel):
+    edits: List[EditOutput]
@@ -0,0 +1,204 @@
+# channel.py
+"""
+编辑器交互调用的 WebSocket 多路复用通道
+- 一条连接上并发多个逻辑操作，每帧带操作 id；请求体沿用各 HTTP 接口的请求模型，结果与 HTTP 响应体一致
+- 流式接口的增量按操作打标签逐条下发；SSE 接口的事件拆成 event 帧
+- cancel 帧取消对应操作的任务：流式输出经 guard_stream 关闭上游，推理服务停止解码；连接关闭时取消全部操作
+- 写出串行化（同一连接同一时刻只有一个 send），慢客户端的背压传回各操作的上游读取
+
+帧格式（JSON 文本帧；二进制帧回复 400 错误帧，连接保持）：
+  客户端 → 服务端
+    {"type": "start", "id": "1", "route": "/continue", "body": {...}, "cache": true}
+    {"type": "cancel", "id": "1"}
+    {"type": "ping"}
+  服务端 → 客户端
+    {"type": "delta", "id": "1", "data": "文本片段"}             纯文本流式接口的增量
+    {"type": "event", "id": "1", "event": "item", "data": {...}} SSE 接口的事件
+    {"type": "result", "id": "1", "data": {...}}                 非流式接口的响应体
+    {"type": "done", "id": "1"}                                  流式操作正常结束
+    {"type": "error", "id": "1", "status": 422, "detail": ...}
+    {"type": "cancelled", "id": "1"}
+    {"type": "pong"}
+"""
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import CHANNEL_MAX_OPS
+from app.services import metrics
+
+# dispatch(route, body, cache) 返回 ("result", 响应体) / ("text", 文本片段流) / ("sse", SSE 文本流)
+Dispatch = Callable[[str, Dict[str, Any], bool], Awaitable[Tuple[str, Any]]]
+
+_stats = {
+    "connections": 0,
+    "open": 0,
+    "ops": 0,
+    "completed": 0,
+    "errors": 0,
+    "cancelled": 0,
+    "frames_sent": 0,
+    "frames_received": 0,
+}
+
+
+class ChannelError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def _sse_frames(buffer: str) -> Tuple[list, str]:
+    """从缓冲中切出完整的 SSE 事件，返回 ([(event, data)], 剩余部分)"""
+    events = []
+    while "\n\n" in buffer:
+        block, buffer = buffer.split("\n\n", 1)
+        event, data = "message", []
+        for line in block.split("\n"):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].strip())
+        if data:
+            text = "\n".join(data)
+            try:
+                events.append((event, json.loads(text)))
+            except ValueError:
+                events.append((event, text))
+    return events, buffer
+
+
+class Channel:
+    """一条 WebSocket 连接：send_text 为连接的写出函数，dispatch 把操作交给对应接口"""
+
+    def __init__(self, send_text: Callable[[str], Awaitable[None]], dispatch: Dispatch, bind: Callable[[str], None]):
+        self._send_text = send_text
+        self._dispatch = dispatch
+        # 在操作任务内调用，设置客户端、路由等上下文
+        self._bind = bind
+        self._lock = asyncio.Lock()
+        self._ops: Dict[str, asyncio.Task] = {}
+        self._cancelled: set = set()
+        self.closed = False
+        _stats["connections"] += 1
+        _stats["open"] += 1
+
+    async def send(self, frame: Dict[str, Any]):
+        if self.closed:
+            return
+        async with self._lock:
+            try:
+                await self._send_text(json.dumps(frame, ensure_ascii=False))
+            except Exception:
+                # 连接已断开：之后的帧直接丢弃，当前操作随异常结束
+                self.closed = True
+                raise
+        _stats["frames_sent"] += 1
+
+    async def handle(self, text: Optional[str]):
+        """text 为空表示收到的是二进制帧"""
+        _stats["frames_received"] += 1
+        if text is None:
+            await self.send({"type": "error", "id": None, "status": 400, "detail": "只接受 JSON 文本帧"})
+            return
+        try:
+            frame = json.loads(text)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            await self.send({"type": "error", "id": None, "status": 400, "detail": "帧不是 JSON 对象"})
+            return
+        kind, op_id = frame.get("type"), frame.get("id")
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "cancel":
+            self.cancel(op_id)
+        elif kind == "start":
+            await self.start(op_id, frame.get("route"), frame.get("body") or {}, frame.get("cache", True) is not False)
+        else:
+            await self.send({"type": "error", "id": op_id, "status": 400, "detail": f"未知的帧类型：{kind}"})
+
+    async def start(self, op_id: Any, route: Optional[str], body: Dict[str, Any], cache: bool):
+        if op_id is None or not isinstance(route, str):
+            await self.send({"type": "error", "id": op_id, "status": 400, "detail": "start 帧需要 id 与 route"})
+            return
+        op_id = str(op_id)
+        if op_id in self._ops:
+            await self.send({"type": "error", "id": op_id, "status": 409, "detail": "该 id 的操作仍在进行"})
+            return
+        if len(self._ops) >= CHANNEL_MAX_OPS:
+            await self.send({"type": "error", "id": op_id, "status": 429, "detail": "连接上进行中的操作过多"})
+            return
+        _stats["ops"] += 1
+        self._ops[op_id] = asyncio.ensure_future(self._run(op_id, route, body, cache))
+
+    def cancel(self, op_id: Any):
+        task = self._ops.get(str(op_id))
+        if task is not None and not task.done():
+            self._cancelled.add(str(op_id))
+            task.cancel()
+
+    async def close(self):
+        """连接断开：取消全部操作并等待其清理完毕（关闭上游流、释放调度名额）"""
+        self.closed = True
+        _stats["open"] -= 1
+        tasks = list(self._ops.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, op_id: str, route: str, body: Dict[str, Any], cache: bool):
+        start = time.perf_counter()
+        status = "200"
+        try:
+            self._bind(route)
+            kind, value = await self._dispatch(route, body, cache)
+            if kind == "result":
+                await self.send({"type": "result", "id": op_id, "data": value})
+            else:
+                await self._forward(op_id, kind, value)
+                await self.send({"type": "done", "id": op_id})
+            _stats["completed"] += 1
+        except asyncio.CancelledError:
+            status = "499"
+            _stats["cancelled"] += 1
+            if op_id in self._cancelled:
+                # 客户端主动取消：确认后结束，不向连接的接收循环传播
+                await self.send({"type": "cancelled", "id": op_id})
+            else:
+                raise
+        except Exception as e:
+            code = getattr(e, "status_code", 500)
+            status = str(code)
+            _stats["errors"] += 1
+            detail = getattr(e, "detail", None) or getattr(e, "message", None) or str(e) or type(e).__name__
+            await self.send({"type": "error", "id": op_id, "status": code, "detail": detail})
+        finally:
+            self._ops.pop(op_id, None)
+            self._cancelled.discard(op_id)
+            # 与 HTTP 请求共用耗时指标，method 记为 WS，便于按接口对比两种传输
+            metrics.http_request_seconds.observe(time.perf_counter() - start, metrics.current_route.get(), "WS", status)
+
+    async def _forward(self, op_id: str, kind: str, stream: AsyncIterator):
+        buffer = ""
+        try:
+            async for chunk in stream:
+                if isinstance(chunk, bytes):
+                    chunk = chunk.decode("utf-8")
+                if kind == "text":
+                    await self.send({"type": "delta", "id": op_id, "data": chunk})
+                    continue
+                events, buffer = _sse_frames(buffer + chunk)
+                for event, data in events:
+                    await self.send({"type": "event", "id": op_id, "event": event, "data": data})
+        finally:
+            # 取消可能发生在 send 期间（生成器停在 yield 处），显式关闭才能及时释放上游
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+def get_channel_stats() -> Dict[str, Any]:
+    return dict(_stats)
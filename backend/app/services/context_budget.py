@@ -0,0 +1,214 @@
+# context_budget.py
+"""
+按 token 预算裁剪 prompt 的可变内容，替代各路由里固定的字符切片
+- 估算器：默认按字符类别快速估算（CJK 约 1 token/字，ASCII 约 4 字符/token），
+  配置 LLM_TOKENIZER_PATH 且安装了 tokenizers 时使用真实分词器；
+  结果按文本缓存：短文本以原文为键，长文本（如反复提交的全文）以摘要为键，不在缓存里保留原文，
+  缓存按键的总字节数而不是条数限制 (TOKEN_CACHE_MAX_BYTES)
+- 预算：min(路由预算, 模型上下文窗口 - 预留输出长度)
+- 必需内容（标题、问题、修改意见等）超出预算时直接拒绝 (413)，不再把超长 prompt 发给上游
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from app.config import (
+    LLM_CONTEXT_WINDOWS,
+    LLM_DEFAULT_CONTEXT_WINDOW,
+    LLM_COMPLETION_RESERVE,
+    LLM_TOKENIZER_PATH,
+    ROUTE_INPUT_BUDGETS,
+    TOKEN_CACHE_MAX_BYTES,
+)
+
+# 低于该长度的截断片段没有意义，直接丢弃
+MIN_PART_TOKENS = 32
+# 超过该长度（字符）的文本以摘要为键
+DIGEST_OVER_CHARS = 256
+# 每条缓存除键以外的大致开销（字典槽、计数值）
+ENTRY_OVERHEAD = 100
+
+
+class ContextTooLargeError(Exception):
+    status_code = 413
+
+    def __init__(self, message: str, tokens: int, budget: int):
+        super().__init__(message)
+        self.message = message
+        self.tokens = tokens
+        self.budget = budget
+
+
+def _load_tokenizer():
+    if not LLM_TOKENIZER_PATH:
+        return None
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        print("[Context Budget Warn] 未安装 tokenizers，使用字符估算")
+        return None
+    try:
+        path = LLM_TOKENIZER_PATH
+        if not path.endswith(".json"):
+            path = path.rstrip("/") + "/tokenizer.json"
+        return Tokenizer.from_file(path)
+    except Exception as e:
+        print(f"[Context Budget Warn] 分词器加载失败，使用字符估算: {e}")
+        return None
+
+
+_tokenizer = _load_tokenizer()
+_stats = {"truncated": 0, "selected": 0, "dropped": 0, "rejected": 0}
+
+
+def _count(text: str) -> int:
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text, add_special_tokens=False).ids)
+    ascii_len = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_len) + (ascii_len + 3) // 4
+
+
+def estimate_tokens(text: str) -> int:
+    """不经缓存的计数：用于只会计一次的文本（如流式输出的片段），避免挤掉缓存里反复出现的内容"""
+    return _count(text)
+
+
+_count_cache: "OrderedDict[object, int]" = OrderedDict()
+_cache_bytes = 0
+_cache_stats = {"hits": 0, "misses": 0}
+# 资料索引在线程池里构建时也会计数：缓存的读写都在锁内，分词本身在锁外
+_cache_lock = threading.Lock()
+
+
+def _cache_key(text: str) -> object:
+    if len(text) <= DIGEST_OVER_CHARS:
+        return text
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _key_bytes(key: object) -> int:
+    return (len(key) * 4 if isinstance(key, str) else len(key)) + ENTRY_OVERHEAD
+
+
+def count_tokens(text: str) -> int:
+    """同一段文本只计算一次；按最近使用淘汰，缓存总大小不超过 TOKEN_CACHE_MAX_BYTES；可在任意线程调用"""
+    global _cache_bytes
+    key = _cache_key(text)
+    with _cache_lock:
+        tokens = _count_cache.get(key)
+        if tokens is not None:
+            _count_cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return tokens
+        _cache_stats["misses"] += 1
+    tokens = _count(text)
+    with _cache_lock:
+        if key not in _count_cache:
+            _cache_bytes += _key_bytes(key)
+        _count_cache[key] = tokens
+        while _cache_bytes > TOKEN_CACHE_MAX_BYTES and _count_cache:
+            old, _ = _count_cache.popitem(last=False)
+            _cache_bytes -= _key_bytes(old)
+    return tokens
+
+
+def message_tokens(messages: List[Dict[str, str]]) -> int:
+    # 每条消息额外计入少量 chat template 开销
+    return sum(count_tokens(m.get("content", "")) + 4 for m in messages)
+
+
+def route_budget(model: str, route: str) -> int:
+    window = LLM_CONTEXT_WINDOWS.get(model, LLM_DEFAULT_CONTEXT_WINDOW)
+    limit = window - LLM_COMPLETION_RESERVE
+    return min(ROUTE_INPUT_BUDGETS.get(route, limit), limit)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """
+    截断到 max_tokens 以内；keep="head" 保留开头，keep="tail" 保留结尾（最靠近光标的前文）
+    """
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    n = max(1, int(len(text) * max_tokens / total))
+    while n > 0:
+        piece = text[-n:] if keep == "tail" else text[:n]
+        if _count(piece) <= max_tokens:
+            return piece
+        n = int(n * 0.9)
+    return ""
+
+
+class Part:
+    """
+    prompt 中的一段可变内容
+    priority 越小越重要；required=True 的内容不会被裁剪，放不下就拒绝请求
+    select(text, max_tokens) 可替代默认的首尾截断（如按相关度选取参考资料）
+    """
+
+    def __init__(self, name: str, text: str, priority: int = 1, keep: str = "head",
+                 required: bool = False,
+                 select: Optional[Callable[[str, int], str]] = None):
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.keep = keep
+        self.required = required
+        self.select = select
+
+
+def fit_parts(model: str, route: str, parts: List[Part], budget: Optional[int] = None) -> Dict[str, str]:
+    """
+    把各段内容装入预算：先放必需内容，其余按优先级依次放入，放不下的截断或丢弃
+    """
+    if budget is None:
+        budget = route_budget(model, route)
+
+    required_tokens = sum(count_tokens(p.text) for p in parts if p.required)
+    if required_tokens > budget:
+        _stats["rejected"] += 1
+        raise ContextTooLargeError(
+            f"输入过长：约 {required_tokens} tokens，超过 {route} 的上限 {budget} tokens，请缩短后重试",
+            required_tokens,
+            budget,
+        )
+
+    remaining = budget - required_tokens
+    fitted = {p.name: p.text for p in parts if p.required}
+    for part in sorted((p for p in parts if not p.required), key=lambda p: p.priority):
+        tokens = count_tokens(part.text)
+        if tokens <= remaining:
+            fitted[part.name] = part.text
+            remaining -= tokens
+        elif remaining >= MIN_PART_TOKENS:
+            if part.select is not None:
+                selected = part.select(part.text, remaining)
+                fitted[part.name] = truncate_to_tokens(selected, remaining, part.keep)
+                _stats["selected"] += 1
+            else:
+                fitted[part.name] = truncate_to_tokens(part.text, remaining, part.keep)
+                _stats["truncated"] += 1
+            remaining = 0
+        else:
+            fitted[part.name] = ""
+            _stats["dropped"] += 1
+    return fitted
+
+
+def ensure_fits(model: str, route: str, *texts: str):
+    """整段内容必须完整发送的路由（润色、重写、评审等）：超出预算直接拒绝"""
+    fit_parts(model, route, [Part(f"text{i}", t, required=True) for i, t in enumerate(texts)])
+
+
+def get_budget_stats() -> Dict[str, int]:
+    return {
+        **_stats,
+        "tokenizer": "tokenizers" if _tokenizer is not None else "estimate",
+        "count_cache_hits": _cache_stats["hits"],
+        "count_cache_misses": _cache_stats["misses"],
+        "count_cache_entries": len(_count_cache),
+        "count_cache_bytes": _cache_bytes,
+    }
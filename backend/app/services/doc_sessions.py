@@ -0,0 +1,289 @@
+# doc_sessions.py
+"""
+服务端文档会话：大纲（含各节正文）、对话记录和少量元信息保存在后端
+- 前端创建会话后只发送增量补丁（改一节正文、在正文里替换一段、追加一条对话……），带版本号做乐观并发控制
+- 润色、评审等接口只需传 docSessionId + nodeId，不必每次上传整节正文 / 整个大纲 / 全部对话
+- 一个补丁里的多个操作要么全部生效要么全部不生效；修改时只复制被改动的节点，不整体深拷贝
+- 会话数量有上限（LRU），闲置超过 DOC_SESSION_TTL 秒过期
+"""
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.config import DOC_SESSIONS_MAX, DOC_SESSION_TTL, DOC_SESSION_MAX_CHARS
+
+# 不带 nodeId 取全文时各节之间的分隔
+SECTION_SEPARATOR = "\n\n"
+
+
+class DocumentSessionError(Exception):
+    status_code = 400
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class DocumentSessionNotFound(DocumentSessionError):
+    status_code = 404
+
+
+class DocumentSessionConflict(DocumentSessionError):
+    """补丁的 baseVersion 与服务端不一致，前端应取回最新状态后重发"""
+
+    status_code = 409
+
+
+class InvalidPatch(DocumentSessionError):
+    status_code = 422
+
+
+def _chat_messages(value: Any) -> List[Dict[str, str]]:
+    if not isinstance(value, list):
+        raise InvalidPatch("messages 必须是数组")
+    result = []
+    for m in value:
+        if not isinstance(m, dict) or not isinstance(m.get("text"), str):
+            raise InvalidPatch("对话消息格式应为 {role, text}")
+        result.append({"role": str(m.get("role", "user")), "text": m["text"]})
+    return result
+
+
+class DocumentSession:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.version = 0
+        self.nodes: List[Dict[str, Any]] = []
+        self.chats: Dict[str, List[Dict[str, str]]] = {}
+        self.meta: Dict[str, Any] = {}
+        self.touched = time.monotonic()
+
+    # ================= 读取 =================
+
+    def node(self, node_id: str) -> Dict[str, Any]:
+        for node in self.nodes:
+            if node.get("id") == node_id:
+                return node
+        raise DocumentSessionNotFound(f"文档会话中不存在节点 {node_id}")
+
+    def content(self, node_id: Optional[str] = None) -> str:
+        """nodeId 对应的正文；不传 nodeId 时按大纲顺序拼接全文（带标题）"""
+        if node_id:
+            return self.node(node_id).get("content") or ""
+        parts = []
+        for node in self.nodes:
+            heading = "#" * max(1, int(node.get("level") or 1)) + " " + str(node.get("title", ""))
+            body = node.get("content") or ""
+            parts.append(f"{heading}\n{body}".strip())
+        return SECTION_SEPARATOR.join(parts)
+
+    def chat(self, key: str) -> List[Dict[str, str]]:
+        return self.chats.get(key, [])
+
+    @property
+    def chars(self) -> int:
+        return sum(len(n.get("content") or "") for n in self.nodes) + sum(
+            len(m["text"]) for messages in self.chats.values() for m in messages
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "docSessionId": self.id,
+            "version": self.version,
+            "outline": self.nodes,
+            "chats": self.chats,
+            "meta": self.meta,
+        }
+
+    # ================= 补丁 =================
+
+    def apply(self, ops: List[Dict[str, Any]]):
+        """
+        依次应用补丁操作，任一操作不合法时整个补丁不生效
+        列表和被修改的节点按写时复制处理，未改动的节点与原会话共享
+        """
+        nodes = list(self.nodes)
+        chats = dict(self.chats)
+        meta = dict(self.meta)
+        positions = {n.get("id"): i for i, n in enumerate(nodes)}
+
+        def locate(op) -> int:
+            node_id = op.get("nodeId")
+            if node_id not in positions:
+                raise InvalidPatch(f"节点不存在：{node_id}")
+            return positions[node_id]
+
+        for op in ops:
+            kind = op.get("op")
+            if kind == "setOutline":
+                outline = op.get("outline")
+                if not isinstance(outline, list) or not all(
+                    isinstance(n, dict) and n.get("id") for n in outline
+                ):
+                    raise InvalidPatch("outline 必须是带 id 的节点数组")
+                nodes = [dict(n) for n in outline]
+                positions = {n["id"]: i for i, n in enumerate(nodes)}
+            elif kind == "upsertNode":
+                node = op.get("node")
+                if not isinstance(node, dict) or not node.get("id"):
+                    raise InvalidPatch("node 必须带 id")
+                if node["id"] in positions:
+                    i = positions[node["id"]]
+                    nodes[i] = {**nodes[i], **node}
+                else:
+                    # 插入到 after 指定的节点之后，未指定时追加到末尾
+                    after = op.get("after")
+                    i = positions[after] + 1 if after in positions else len(nodes)
+                    nodes.insert(i, dict(node))
+                    positions = {n.get("id"): j for j, n in enumerate(nodes)}
+            elif kind == "removeNode":
+                nodes.pop(locate(op))
+                positions = {n.get("id"): j for j, n in enumerate(nodes)}
+            elif kind == "setContent":
+                i = locate(op)
+                content = op.get("content")
+                if not isinstance(content, str):
+                    raise InvalidPatch("content 必须是字符串")
+                nodes[i] = {**nodes[i], "content": content}
+            elif kind == "spliceContent":
+                # 把正文 [start, end) 替换为 text，偏移按 Unicode 字符计
+                i = locate(op)
+                content = nodes[i].get("content") or ""
+                start, end, text = op.get("start"), op.get("end", op.get("start")), op.get("text", "")
+                if not (isinstance(start, int) and isinstance(end, int) and isinstance(text, str)) or not (
+                    0 <= start <= end <= len(content)
+                ):
+                    raise InvalidPatch(f"spliceContent 范围无效：[{start}, {end})，正文长度 {len(content)}")
+                nodes[i] = {**nodes[i], "content": content[:start] + text + content[end:]}
+            elif kind == "appendChat":
+                key = str(op.get("key", ""))
+                chats[key] = chats.get(key, []) + _chat_messages(op.get("messages"))
+            elif kind == "setChat":
+                key = str(op.get("key", ""))
+                messages = _chat_messages(op.get("messages", []))
+                if messages:
+                    chats[key] = messages
+                else:
+                    chats.pop(key, None)
+            elif kind == "setMeta":
+                values = op.get("values")
+                if not isinstance(values, dict):
+                    raise InvalidPatch("values 必须是对象")
+                meta.update(values)
+            else:
+                raise InvalidPatch(f"未知的补丁操作：{kind}")
+
+        previous = self.nodes, self.chats, self.meta
+        self.nodes, self.chats, self.meta = nodes, chats, meta
+        if self.chars > DOC_SESSION_MAX_CHARS:
+            self.nodes, self.chats, self.meta = previous
+            raise InvalidPatch(f"文档会话超过 {DOC_SESSION_MAX_CHARS} 字符上限")
+        self.version += 1
+
+
+class DocumentSessionStore:
+    def __init__(self, max_sessions: int, ttl: float):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, DocumentSession]" = OrderedDict()
+        self.stats = {
+            "created": 0,
+            "patches": 0,
+            "ops": 0,
+            "conflicts": 0,
+            "rejected": 0,
+            "resolved": 0,
+            # 由会话补全、客户端无需上传的字符数
+            "resolved_chars": 0,
+            "expired": 0,
+            "evicted": 0,
+        }
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [sid for sid, s in self._sessions.items() if now - s.touched > self.ttl]
+        for sid in expired:
+            del self._sessions[sid]
+            self.stats["expired"] += 1
+
+    def create(self, ops: List[Dict[str, Any]]) -> DocumentSession:
+        self._purge()
+        session = DocumentSession(uuid.uuid4().hex)
+        if ops:
+            session.apply(ops)
+        self._sessions[session.id] = session
+        self.stats["created"] += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.stats["evicted"] += 1
+        return session
+
+    def get(self, session_id: str) -> DocumentSession:
+        session = self._sessions.get(session_id)
+        if session is None or time.monotonic() - session.touched > self.ttl:
+            self._sessions.pop(session_id, None)
+            raise DocumentSessionNotFound("文档会话不存在或已过期，请重新创建")
+        session.touched = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def patch(self, session_id: str, ops: List[Dict[str, Any]], base_version: Optional[int] = None) -> DocumentSession:
+        session = self.get(session_id)
+        if base_version is not None and base_version != session.version:
+            self.stats["conflicts"] += 1
+            raise DocumentSessionConflict(
+                f"文档会话版本冲突：服务端为 {session.version}，补丁基于 {base_version}"
+            )
+        try:
+            session.apply(ops)
+        except InvalidPatch:
+            self.stats["rejected"] += 1
+            raise
+        self.stats["patches"] += 1
+        self.stats["ops"] += len(ops)
+        return session
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    # ================= 供接口补全请求字段 =================
+
+    def _resolved(self, value):
+        self.stats["resolved"] += 1
+        self.stats["resolved_chars"] += len(value) if isinstance(value, str) else 0
+        return value
+
+    def resolve_content(self, text: str, session_id: Optional[str], node_id: Optional[str]) -> str:
+        """请求里带了原文就用原文；否则取会话中 nodeId 的正文，不传 nodeId 时为全文"""
+        if text or not session_id:
+            return text
+        return self._resolved(self.get(session_id).content(node_id))
+
+    def resolve_field(self, value: Any, session_id: Optional[str], node_id: Optional[str], field: str) -> Any:
+        """节点上的其他字段（标题、写作要点等）"""
+        if value or not session_id or not node_id:
+            return value
+        return self._resolved(self.get(session_id).node(node_id).get(field, value))
+
+    def resolve_outline(self, outline: List[Any], session_id: Optional[str]) -> List[Any]:
+        if outline or not session_id:
+            return outline
+        return self._resolved(self.get(session_id).nodes)
+
+    def resolve_chat(self, messages: List[Any], session_id: Optional[str], key: Optional[str]) -> List[Any]:
+        """返回 {role, text} 字典列表；请求里带了消息时原样返回"""
+        if messages or not session_id:
+            return messages
+        return self._resolved(self.get(session_id).chat(key or ""))
+
+    def resolve_meta(self, value: Any, session_id: Optional[str], field: str) -> Any:
+        if value or not session_id:
+            return value
+        return self._resolved(self.get(session_id).meta.get(field, value))
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "sessions": len(self._sessions)}
+
+
+doc_sessions = DocumentSessionStore(DOC_SESSIONS_MAX, DOC_SESSION_TTL)
@@ -0,0 +1,142 @@
+# edit_script.py
+"""
+编辑脚本：修改类接口让模型只输出 {"edits": [{"find", "replace"}]}，由服务端应用到原文
+- 小范围修改的输出从整段原文缩短到几条替换，解码时间随改动量而不是文档长度增长
+- find 必须在原文中唯一出现；逐字匹配不到时按忽略空白的方式再匹配一次 (EDIT_SCRIPT_FUZZY)
+- 解析失败、找不到、不唯一、相互重叠或条数超过上限时整体作废，由调用方回退为整段重新生成
+- 返回带原文偏移的替换列表和 unified diff，前端可以直接按偏移高亮或逐条接受
+"""
+import difflib
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import EDIT_SCRIPT_FUZZY, EDIT_SCRIPT_MAX_EDITS
+from app.services import metrics
+
+FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+class EditScriptError(Exception):
+    """编辑脚本不可用；reason 用于统计回退原因"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+_stats = {
+    "scripts": 0,
+    "applied": 0,
+    "edits": 0,
+    "fuzzy_matches": 0,
+    "fallbacks": {},
+    # 已应用的脚本：模型输出字符数与对应原文字符数，比值近似整段重写时节省的输出量
+    "output_chars": 0,
+    "original_chars": 0,
+}
+
+
+def parse_edits(raw: str) -> List[Dict[str, str]]:
+    try:
+        data = json.loads(FENCE_RE.sub("", raw))
+    except ValueError:
+        raise EditScriptError("unparsable", "编辑脚本不是合法的 JSON")
+    edits = data.get("edits") if isinstance(data, dict) else data
+    if not isinstance(edits, list):
+        raise EditScriptError("unparsable", "编辑脚本缺少 edits 列表")
+    result = []
+    for edit in edits:
+        if not isinstance(edit, dict) or not isinstance(edit.get("find"), str):
+            raise EditScriptError("unparsable", "替换项缺少 find")
+        replace = edit.get("replace")
+        result.append({"find": edit["find"], "replace": replace if isinstance(replace, str) else ""})
+    if len(result) > EDIT_SCRIPT_MAX_EDITS:
+        raise EditScriptError("too_many", f"替换条数 {len(result)} 超过上限 {EDIT_SCRIPT_MAX_EDITS}")
+    return result
+
+
+def _fuzzy_pattern(find: str) -> Optional[re.Pattern]:
+    chars = [re.escape(ch) for ch in find if not ch.isspace()]
+    return re.compile(r"\s*".join(chars)) if chars else None
+
+
+def locate(text: str, find: str) -> Tuple[int, int]:
+    """返回 find 在原文中唯一出现的 [start, end)；找不到或不唯一时抛出 EditScriptError"""
+    if not find:
+        raise EditScriptError("empty_find", "find 为空")
+    start = text.find(find)
+    if start >= 0:
+        if text.find(find, start + 1) >= 0:
+            raise EditScriptError("ambiguous", f"find 在原文中出现多次：{find[:30]}")
+        return start, start + len(find)
+    pattern = _fuzzy_pattern(find) if EDIT_SCRIPT_FUZZY else None
+    if pattern is not None:
+        matches = []
+        for match in pattern.finditer(text):
+            matches.append(match.span())
+            if len(matches) > 1:
+                raise EditScriptError("ambiguous", f"find 在原文中出现多次：{find[:30]}")
+        if matches:
+            _stats["fuzzy_matches"] += 1
+            return matches[0]
+    raise EditScriptError("not_found", f"find 不在原文中：{find[:30]}")
+
+
+def apply_edits(original: str, edits: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """全部替换都能唯一定位且互不重叠时一次性应用；返回 (新文本, 按位置排序的替换及其在原文中的偏移)"""
+    located = []
+    for edit in edits:
+        if edit["find"] == edit["replace"]:
+            continue
+        start, end = locate(original, edit["find"])
+        located.append({"start": start, "end": end, "find": original[start:end], "replace": edit["replace"]})
+    located.sort(key=lambda e: e["start"])
+    for prev, cur in zip(located, located[1:]):
+        if cur["start"] < prev["end"]:
+            raise EditScriptError("overlap", "替换片段相互重叠")
+    parts, cursor = [], 0
+    for edit in located:
+        parts.append(original[cursor:edit["start"]])
+        parts.append(edit["replace"])
+        cursor = edit["end"]
+    parts.append(original[cursor:])
+    return "".join(parts), located
+
+
+def apply(original: str, raw: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """解析并应用模型输出的编辑脚本；失败时记录回退原因后抛出 EditScriptError"""
+    _stats["scripts"] += 1
+    route = metrics.current_route.get()
+    try:
+        patched, edits = apply_edits(original, parse_edits(raw))
+    except EditScriptError as e:
+        _stats["fallbacks"][e.reason] = _stats["fallbacks"].get(e.reason, 0) + 1
+        metrics.edit_script_total.inc(route, e.reason)
+        raise
+    _stats["applied"] += 1
+    _stats["edits"] += len(edits)
+    _stats["output_chars"] += len(raw)
+    _stats["original_chars"] += len(original)
+    metrics.edit_script_total.inc(route, "applied")
+    return patched, edits
+
+
+def unified_diff(original: str, patched: str) -> str:
+    return "\n".join(difflib.unified_diff(
+        original.splitlines(),
+        patched.splitlines(),
+        "original",
+        "patched",
+        lineterm="",
+    ))
+
+
+def get_edit_script_stats() -> Dict[str, Any]:
+    ratio = _stats["output_chars"] / _stats["original_chars"] if _stats["original_chars"] else None
+    return {
+        **_stats,
+        "fallbacks": dict(_stats["fallbacks"]),
+        "output_ratio": round(ratio, 4) if ratio is not None else None,
+    }
@@ -0,0 +1,348 @@
+# jobs.py
+"""
+长耗时生成的异步任务队列
+- 提交后立即返回 jobId，生成在进程内的工作协程里进行，与 HTTP 请求的超时解耦
+- 任务、已生成的部分输出和最终结果保存在本地 SQLite；进程重启后未完成的任务重新排队
+- 运行中的输出先累积在内存，每 JOBS_FLUSH_SECONDS 秒写回一次；订阅者直接读内存，不等写回
+- 写库都在专用的单线程里按提交顺序执行，不阻塞事件循环；查询走事件循环里的只读连接（WAL 下读写互不阻塞）
+- 同时运行的任务数不超过 JOBS_MAX_WORKERS，上游调用走调度器最低的 job 优先级（只排队、不拒绝不超时），让出交互请求
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config import (
+    JOBS_DB_PATH,
+    JOBS_MAX_WORKERS,
+    JOBS_FLUSH_SECONDS,
+    JOBS_MAX_ATTEMPTS,
+    JOBS_RETENTION,
+)
+from app.services.metrics import current_route
+from app.services.scheduler import current_client
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    client TEXT NOT NULL,
+    params TEXT NOT NULL,
+    output TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    progress TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+
+class JobNotFound(Exception):
+    status_code = 404
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class JobContext:
+    """交给执行函数的句柄：追加部分输出、上报进度"""
+
+    def __init__(self, queue: "JobQueue", job_id: str, params: Dict[str, Any]):
+        self.queue = queue
+        self.id = job_id
+        self.params = params
+
+    def append(self, text: str):
+        if text:
+            self.queue._output[self.id].append(text)
+            self.queue._changed(self.id)
+
+    def progress(self, done: int, total: int, failed: int = 0):
+        self.queue._progress[self.id] = {"done": done, "total": total, "failed": failed}
+        self.queue._changed(self.id)
+
+
+Runner = Callable[[str, Dict[str, Any], JobContext], Awaitable[str]]
+
+
+class JobQueue:
+    def __init__(self, path: str, workers: int):
+        self.path = path
+        self.workers = workers
+        # 读连接在事件循环里用；写连接只在写线程里用
+        self._db: Optional[sqlite3.Connection] = None
+        self._writer_db: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._runner: Optional[Runner] = None
+        self._queue: Optional["asyncio.Queue[str]"] = None
+        self._workers: List[asyncio.Task] = []
+        self._stopping = False
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # 已取消但仍在内存队列里的任务：取消的写库尚未完成时工作协程可能读到旧状态
+        self._cancelled: set = set()
+        # 运行中任务的输出片段与进度（尚未写回的部分也在这里）
+        self._output: Dict[str, List[str]] = {}
+        self._progress: Dict[str, Dict[str, int]] = {}
+        # 每个任务一个 Event，状态或输出变化时置位并换新，订阅者据此唤醒
+        self._events: Dict[str, asyncio.Event] = {}
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "recovered": 0}
+
+    # ================= 存储 =================
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(_SCHEMA)
+        return db
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = self._open()
+        return self._db
+
+    def _execute(self, sql: str, params: tuple):
+        # 只在写线程里调用
+        if self._writer_db is None:
+            self._writer_db = self._open()
+        self._writer_db.execute(sql, params)
+
+    async def _write(self, sql: str, params: tuple = ()):
+        """交给写线程执行；单线程保证同一任务的写入按调用顺序落库，返回时已提交，随后的查询能读到"""
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-db")
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._execute, sql, params)
+
+    async def _update(self, job_id: str, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        await self._write(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _row(self, job_id: str) -> sqlite3.Row:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFound("任务不存在或已清理")
+        return row
+
+    def _view(self, row: sqlite3.Row, offset: int = 0) -> Dict[str, Any]:
+        job_id = row["id"]
+        output = "".join(self._output[job_id]) if job_id in self._output else row["output"]
+        progress = self._progress.get(job_id) or (json.loads(row["progress"]) if row["progress"] else None)
+        return {
+            "jobId": job_id,
+            "kind": row["kind"],
+            "status": row["status"],
+            "output": output[offset:],
+            "outputChars": len(output),
+            "result": row["result"],
+            "error": row["error"],
+            "progress": progress,
+            "attempts": row["attempts"],
+            "created": row["created"],
+            "updated": row["updated"],
+        }
+
+    # ================= 生命周期 =================
+
+    async def start(self, runner: Runner):
+        """恢复上次未完成的任务并启动工作协程"""
+        self._runner = runner
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        await self._write(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated < ?",
+            (*FINISHED, time.time() - JOBS_RETENTION),
+        )
+        for row in self._connect().execute(
+            "SELECT id, status, attempts FROM jobs WHERE status IN (?, ?) ORDER BY created",
+            (QUEUED, RUNNING),
+        ).fetchall():
+            if row["status"] == RUNNING:
+                # 进程退出时正在运行：已生成的部分无法续写，从头重新生成
+                if row["attempts"] >= JOBS_MAX_ATTEMPTS:
+                    await self._update(row["id"], status=FAILED, error="任务多次因进程退出中断")
+                    continue
+                await self._update(row["id"], status=QUEUED, output="", progress=None)
+                self.stats["recovered"] += 1
+            self._queue.put_nowait(row["id"])
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """停止工作协程；运行中的任务保持 running 状态，下次启动时重新排队"""
+        self._stopping = True
+        running = list(self._tasks.values())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, *running, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        for job_id in list(self._output):
+            await self._flush(job_id)
+        if self._writer is not None:
+            await asyncio.get_running_loop().run_in_executor(self._writer, self._close_writer)
+            self._writer.shutdown()
+            self._writer = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _close_writer(self):
+        if self._writer_db is not None:
+            self._writer_db.close()
+            self._writer_db = None
+
+    # ================= 提交与查询 =================
+
+    async def submit(self, kind: str, params: Dict[str, Any], client: str) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        await self._write(
+            "INSERT INTO jobs (id, kind, status, client, params, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, client, json.dumps(params, ensure_ascii=False), now, now),
+        )
+        # 尚未启动时只落库，启动时统一排队
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+        self.stats["submitted"] += 1
+        return self.get(job_id)
+
+    def get(self, job_id: str, offset: int = 0) -> Dict[str, Any]:
+        return self._view(self._row(job_id), offset)
+
+    async def cancel(self, job_id: str) -> Dict[str, Any]:
+        row = self._row(job_id)
+        if row["status"] == QUEUED:
+            self._cancelled.add(job_id)
+            await self._update(job_id, status=CANCELLED)
+            self.stats["cancelled"] += 1
+            self._changed(job_id)
+        elif row["status"] == RUNNING and job_id in self._tasks:
+            self._tasks[job_id].cancel()
+        return self.get(job_id)
+
+    async def subscribe(self, job_id: str, offset: int = 0, keepalive: float = 15.0) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        产出 ("output", 新增文本) / ("progress", {...}) / ("keepalive", None)，
+        任务结束时以 (最终状态, 任务详情) 结束；offset 为已收到的输出字符数，断线重连时从这里继续
+        """
+        progress = None
+        while True:
+            event = self._events.setdefault(job_id, asyncio.Event())
+            job = self.get(job_id, offset)
+            if job["output"]:
+                offset += len(job["output"])
+                yield "output", job["output"]
+            if job["progress"] and job["progress"] != progress:
+                progress = job["progress"]
+                yield "progress", progress
+            if job["status"] in FINISHED:
+                yield job["status"], {**job, "output": None}
+                return
+            try:
+                await asyncio.wait_for(event.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield "keepalive", None
+
+    def _changed(self, job_id: str):
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    # ================= 执行 =================
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            if job_id in self._cancelled:
+                self._cancelled.discard(job_id)
+                continue
+            try:
+                row = self._row(job_id)
+            except JobNotFound:
+                continue
+            if row["status"] != QUEUED:
+                continue
+            task = asyncio.ensure_future(self._run(row))
+            self._tasks[job_id] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    # 工作协程本身被停止（进程退出）：连同任务一起取消，状态留给下次启动恢复
+                    task.cancel()
+                    raise
+            finally:
+                self._tasks.pop(job_id, None)
+
+    async def _run(self, row: sqlite3.Row):
+        job_id = row["id"]
+        self._output[job_id] = []
+        current_client.set(row["client"])
+        current_route.set(f"job:{row['kind']}")
+        context = JobContext(self, job_id, json.loads(row["params"]))
+        flusher = None
+        status = None
+        try:
+            await self._update(job_id, status=RUNNING, attempts=row["attempts"] + 1, output="", error=None)
+            self._changed(job_id)
+            flusher = asyncio.ensure_future(self._flush_loop(job_id))
+            result = await self._runner(row["kind"], context.params, context)
+            status, fields = SUCCEEDED, {"result": result}
+        except asyncio.CancelledError:
+            if self._stopping:
+                raise
+            status, fields = CANCELLED, {}
+        except Exception as e:
+            status, fields = FAILED, {"error": getattr(e, "message", None) or str(e) or type(e).__name__}
+        finally:
+            if flusher is not None:
+                flusher.cancel()
+            if status is not None:
+                await self._flush(job_id, status=status, **fields)
+                self.stats[status] += 1
+                self._output.pop(job_id, None)
+                self._progress.pop(job_id, None)
+            self._changed(job_id)
+
+    async def _flush_loop(self, job_id: str):
+        while True:
+            await asyncio.sleep(JOBS_FLUSH_SECONDS)
+            await self._flush(job_id)
+
+    async def _flush(self, job_id: str, **fields):
+        if job_id in self._output:
+            fields["output"] = "".join(self._output[job_id])
+        if job_id in self._progress:
+            fields["progress"] = json.dumps(self._progress[job_id])
+        if fields:
+            await self._update(job_id, **fields)
+
+    def get_stats(self) -> Dict[str, Any]:
+        counts = {}
+        if self._db is not None:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            **self.stats,
+            "running": len(self._tasks),
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "workers": self.workers,
+            "by_status": counts,
+        }
+
+
+job_queue = JobQueue(JOBS_DB_PATH, JOBS_MAX_WORKERS)
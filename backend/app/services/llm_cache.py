@@ -0,0 +1,153 @@
+# llm_cache.py
+"""
+非流式 LLM 响应缓存：内存 LRU (TTL + 字节上限) + 可选 SQLite 磁盘层
+键为 (model, messages, temperature) 的内容哈希，同样的 prompt 不再重复打到 GPU
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_DB_PATH,
+)
+
+
+def make_cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    schema: Optional[str] = None,
+) -> str:
+    # schema 为约束解码的结构名：同样的 prompt 带不带约束，输出可能不同
+    request = {"model": model, "messages": messages, "temperature": temperature}
+    if schema is not None:
+        request["schema"] = schema
+    payload = json.dumps(
+        request,
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """按最近使用顺序淘汰，同时受 TTL 和总字节数约束"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._data: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value, _ = item
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        nbytes = len(value.encode("utf-8"))
+        if nbytes > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (time.time() + self.ttl, value, nbytes)
+        self.size += nbytes
+        while self.size > self.max_bytes and self._data:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+
+    def _remove(self, key: str):
+        _, _, nbytes = self._data.pop(key)
+        self.size -= nbytes
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """SQLite 持久层，进程重启后仍可命中"""
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        # 连接在线程池中复用，需要串行化访问
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0]
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl),
+            )
+            self._conn.commit()
+
+
+_memory = MemoryLRU(LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL)
+_disk: Optional[DiskCache] = DiskCache(LLM_CACHE_DB_PATH, LLM_CACHE_TTL) if LLM_CACHE_DB_PATH else None
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+
+async def cache_get(key: str) -> Optional[str]:
+    if not LLM_CACHE_ENABLED:
+        return None
+    value = _memory.get(key)
+    if value is not None:
+        _stats["hits"] += 1
+        return value
+    if _disk is not None:
+        value = await asyncio.to_thread(_disk.get, key)
+        if value is not None:
+            _stats["disk_hits"] += 1
+            _memory.set(key, value)
+            return value
+    _stats["misses"] += 1
+    return None
+
+
+async def cache_set(key: str, value: str):
+    if not LLM_CACHE_ENABLED:
+        return
+    _memory.set(key, value)
+    if _disk is not None:
+        await asyncio.to_thread(_disk.set, key, value)
+
+
+def get_cache_stats() -> Dict[str, int]:
+    return {
+        **_stats,
+        "entries": len(_memory),
+        "bytes": _memory.size,
+        "disk": _disk is not None,
+    }
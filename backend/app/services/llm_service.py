@@ -1,77 +1,492 @@
 # llm_service.py
+import asyncio
+import contextvars
 import httpx
 import json  # 👈 必须导入 json
-from typing import List, Dict, AsyncGenerator
-from app.config import BASE_URL, DEEPSEEK_API_KEY
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import List, Dict, AsyncGenerator, Optional
+from app.config import (
+    DEEPSEEK_API_KEY,
+    LLM_CLIENT_POOLING,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_HTTP2,
+    LLM_SINGLEFLIGHT_ENABLED,
+    LLM_SEND_SESSION_HINTS,
+    LLM_FAILOVER_RETRIES,
+    LLM_STREAM_FAST_PARSE,
+    LLM_STREAM_INCLUDE_USAGE,
+)
+from app.services.llm_cache import make_cache_key, cache_get, cache_set
+from app.services.singleflight import SingleFlight
+from app.services.scheduler import scheduler, PRIORITY_INTERACTIVE, PRIORITY_JSON
+from app.services.context_budget import message_tokens, count_tokens
+from app.services import metrics
+from app.services import structured
+from app.services import resilience
+from app.services.model_router import model_router
+from app.services.structured import OutputSchema
+from app.services.upstreams import upstream_pool, Endpoint
 
 HEADERS = {
     "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
     "Content-Type": "application/json",
 }
 
-async def call_llm(model: str, messages: List[Dict[str, str]]) -> str:
-    # 确保 URL 拼接正确，防止出现 //v1/v1 的情况
-    api_url = f"{BASE_URL.rstrip('/')}/v1/chat/completions"
-    
-    async with httpx.AsyncClient(timeout=60) as client:
+
+def _headers(endpoint: Endpoint) -> Dict[str, str]:
+    if not endpoint.api_key:
+        return HEADERS
+    return {**HEADERS, "Authorization": f"Bearer {endpoint.api_key}"}
+
+
+def _failed_endpoint(exc: httpx.HTTPStatusError, default: Endpoint) -> Endpoint:
+    """按出错请求的 URL 找回节点：对冲时失败的可能是另一份请求的目标"""
+    url = str(exc.request.url)
+    return next((e for e in upstream_pool.endpoints if e.chat_url == url), default)
+
+
+def _should_failover(exc: Exception, model: str, endpoint: Endpoint, tried: set) -> bool:
+    """
+    连接失败、超时和 5xx 记为节点故障并计入熔断；4xx 是请求本身的问题，不换节点
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        if exc.response.status_code < 500:
+            return False
+    elif not isinstance(exc, httpx.TransportError):
+        return False
+    upstream_pool.failure(endpoint)
+    if len(tried) > LLM_FAILOVER_RETRIES or not upstream_pool.has_alternative(model, tried):
+        return False
+    upstream_pool.stats["retries"] += 1
+    return True
+
+
+_CONTENT_KEY = '"content":'
+_REASONING_KEY = '"reasoning_content":'
+_USAGE_KEY = '"usage":'
+_scanstring = json.decoder.scanstring
+
+
+def _delta_content(data: str) -> str:
+    """
+    取出一行流式 chunk 中的 choices[0].delta.content
+    普通文本增量直接定位 delta 之后的 "content" 字段，用 scanstring 只解码这一个字符串；
+    字段缺失、为 null 以外的非字符串或结构不符合预期时退回整行 json.loads
+    """
+    if LLM_STREAM_FAST_PARSE:
+        delta = data.find('"delta"')
+        if delta >= 0:
+            key = data.find(_CONTENT_KEY, delta)
+            if key < 0:
+                # 只有 role / finish_reason 的片段
+                return ""
+            i = key + len(_CONTENT_KEY)
+            while data.startswith(" ", i):
+                i += 1
+            if data.startswith('"', i):
+                try:
+                    return _scanstring(data, i + 1)[0]
+                except ValueError:
+                    pass
+            elif data.startswith("null", i):
+                return ""
+    chunk = json.loads(data)
+    choices = chunk.get("choices")
+    if not choices:
+        # include_usage 时最后一个 chunk 只有 usage
+        return ""
+    # OpenAI 格式的标准提取路径：choices[0].delta.content
+    return choices[0].get("delta", {}).get("content") or ""
+
+
+# 前端编辑会话 ID，由路由层写入；开启 LLM_SEND_SESSION_HINTS 时透传给上游
+current_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_session", default=None
+)
+
+
+def _with_session_hint(payload: Dict) -> Dict:
+    session_id = current_session.get()
+    if LLM_SEND_SESSION_HINTS and session_id:
+        # OpenAI 兼容的 user 字段，支持会话亲和的服务端据此复用前缀缓存
+        payload["user"] = session_id
+    return payload
+
+
+# ================= 进程级连接池 =================
+# 由 main.py 的 lifespan 负责创建和关闭，所有请求共享同一组 keep-alive 连接
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("[LLM Pool Warn] LLM_HTTP2=1 但未安装 h2，退回 HTTP/1.1")
+        return False
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(limits=limits, http2=_http2_available())
+
+
+async def init_client():
+    """应用启动时创建共享连接池"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def close_client():
+    """应用关闭时释放所有连接"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+@asynccontextmanager
+async def _get_client():
+    """
+    取得上游 client：开启连接池时复用共享 client，否则沿用旧的每请求新建方式
+    """
+    if not LLM_CLIENT_POOLING:
+        async with httpx.AsyncClient() as client:
+            yield client
+        return
+
+    if _client is None:
+        # 脚本或测试场景下未经过 lifespan，懒加载一次
+        await init_client()
+    yield _client
+
+
+# 并发的相同请求只向上游发一次
+_singleflight = SingleFlight()
+
+
+def get_singleflight_stats() -> Dict[str, int]:
+    return _singleflight.get_stats()
+
+
+# ================= 延迟统计 =================
+# 只保留最近 N 次请求，足够观察 p50/p95 的变化
+_LATENCY_WINDOW = 500
+_latency = {
+    "call_llm": deque(maxlen=_LATENCY_WINDOW),
+    "call_llm_stream_ttft": deque(maxlen=_LATENCY_WINDOW),
+    "call_llm_stream_total": deque(maxlen=_LATENCY_WINDOW),
+}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def get_latency_stats() -> Dict[str, Dict[str, float]]:
+    """
+    返回各类上游调用的延迟摘要（单位：毫秒）
+    """
+    stats = {}
+    for name, values in _latency.items():
+        ordered = sorted(values)
+        stats[name] = {
+            "count": len(ordered),
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1) if ordered else 0.0,
+            "p50_ms": round(_percentile(ordered, 50) * 1000, 1),
+            "p95_ms": round(_percentile(ordered, 95) * 1000, 1),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+        }
+    stats["pooling"] = LLM_CLIENT_POOLING
+    return stats
+
+
+async def call_llm(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float = 0.7,
+    cache: bool = False,
+    priority: int = PRIORITY_JSON,
+    schema: Optional[OutputSchema] = None,
+) -> str:
+    """
+    非流式调用；cache=True 时按 (model, messages, temperature) 命中缓存直接返回，
+    并发的相同请求会合并为一次上游调用，真正发往上游前需经过调度器排队
+    schema 为期望的 JSON 结构，按 LLM_STRUCTURED_OUTPUT 作为约束解码参数发给上游
+    model 为默认模型，配置了模型分层的接口按 MODEL_ROUTES 选择实际模型
+    """
+    model = model_router.resolve(model, messages)
+    key = make_cache_key(model, messages, temperature, schema.name if schema else None)
+    if cache:
+        cached = await cache_get(key)
+        if cached is not None:
+            return cached
+
+    if LLM_SINGLEFLIGHT_ENABLED:
+        # 只合并同一优先级的请求：交互请求不应排在合并进来的批量请求后面
+        content = await _singleflight.do(
+            f"{key}:{priority}", lambda: _post_completion(model, messages, temperature, priority, schema)
+        )
+    else:
+        content = await _post_completion(model, messages, temperature, priority, schema)
+
+    if cache:
+        await cache_set(key, content)
+    return content
+
+
+async def _post_once(
+    client: httpx.AsyncClient,
+    endpoint: Endpoint,
+    payload: Dict,
+    timeout: httpx.Timeout,
+) -> Dict:
+    async with upstream_pool.use(endpoint):
         resp = await client.post(
-            api_url,
-            headers=HEADERS,
-            json={
-                "model": model,
-                "messages": messages,
-                "temperature": 0.7,
-                "stream": False # 显式关闭流
-            },
+            endpoint.chat_url,
+            headers=_headers(endpoint),
+            json=payload,
+            timeout=timeout,
         )
         resp.raise_for_status()
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
+        return resp.json()
+
+
+async def _post_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    priority: int,
+    schema: Optional[OutputSchema] = None,
+) -> str:
+    route = metrics.current_route.get()
+    payload = _with_session_hint({
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": False # 显式关闭流
+    })
+    policy = resilience.policy_for(route)
+    timeout = policy.http_timeout(stream=False)
+    tried = set()
+    retries = 0
+    # 上游拒绝约束解码参数后，本次调用不再携带；去掉参数后成功时把拒绝的节点记为不支持
+    drop_schema = False
+    rejected_by: Optional[Endpoint] = None
+    # 换节点、退避重试和对冲都沿用同一个调度名额
+    async with model_router.track(model), scheduler.slot(priority), _get_client() as client:
+        while True:
+            endpoint = upstream_pool.pick(model, tried)
+            tried.add(endpoint)
+            params = {} if drop_schema else structured.request_params(schema, endpoint.url)
+            body = {**payload, **params}
+            start = time.perf_counter()
+            try:
+                if policy.hedge:
+                    data, endpoint = await resilience.hedged(
+                        route,
+                        lambda target: _post_once(client, target, body, timeout),
+                        endpoint,
+                        lambda: _hedge_target(model, endpoint),
+                    )
+                else:
+                    data = await _post_once(client, endpoint, body, timeout)
+            except Exception as e:
+                metrics.llm_errors_total.inc(route, model, "call")
+                if structured.rejected(e, params):
+                    drop_schema = True
+                    rejected_by = _failed_endpoint(e, endpoint)
+                    tried.discard(rejected_by)
+                    continue
+                if _should_failover(e, model, endpoint, tried):
+                    continue
+                if retries >= policy.retries or not resilience.retryable(e):
+                    raise
+                # 各节点都已试过：退避后重新从全部节点中选
+                retries += 1
+                resilience.record_retry(route, e)
+                await asyncio.sleep(resilience.backoff(retries))
+                tried.clear()
+                continue
+            break
+    if rejected_by is not None:
+        structured.mark_unsupported(rejected_by.url)
+    elapsed = time.perf_counter() - start
+    upstream_pool.success(endpoint, elapsed)
+    resilience.observe(route, elapsed)
+    _latency["call_llm"].append(elapsed)
+    content = data["choices"][0]["message"]["content"]
+
+    # 优先使用上游返回的 usage，缺失时按本地估算
+    usage = data.get("usage") or {}
+    metrics.llm_generation_seconds.observe(elapsed, route, model, "call")
+    metrics.llm_prompt_tokens.observe(
+        usage.get("prompt_tokens") or message_tokens(messages), route, model
+    )
+    metrics.llm_completion_tokens.observe(
+        usage.get("completion_tokens") or count_tokens(content), route, model
+    )
+    return content
+
+
+def _hedge_target(model: str, primary: Endpoint) -> Endpoint:
+    """对冲请求优先发往另一个节点；只有一个可用节点时发往同一节点"""
+    if upstream_pool.has_alternative(model, {primary}):
+        return upstream_pool.pick(model, {primary})
+    return primary
 
 
 async def call_llm_stream(
     model: str,
     messages: List[Dict[str, str]],
+    priority: int = PRIORITY_INTERACTIVE,
+    schema: Optional[OutputSchema] = None,
 ) -> AsyncGenerator[str, None]:
-    
-    api_url = f"{BASE_URL.rstrip('/')}/v1/chat/completions"
-
-    async with httpx.AsyncClient(timeout=120) as client: # 流式建议超时设长一点
-        async with client.stream(
-            "POST",
-            api_url,
-            headers=HEADERS,
-            json={
-                "model": model,
-                "messages": messages,
-                "stream": True, # 开启流
-                "temperature": 0.7, 
-            },
-        ) as response:
-            async for line in response.aiter_lines():
-                if not line:
-                    continue
-                
-                # 1. 去除 data: 前缀
-                if line.startswith("data:"):
-                    line = line[5:].strip() # 去掉 'data:' (5个字符)
-                
-                # 2. 检查结束标记
-                if line == "[DONE]":
-                    break
-                
-                # 3. 解析 JSON 并提取文字
-                try:
-                    chunk = json.loads(line)
-                    # OpenAI 格式的标准提取路径：choices[0].delta.content
-                    delta = chunk["choices"][0].get("delta", {})
-                    content = delta.get("content", "")
-                    
-                    if content:
-                        yield content  # 👈 关键：只 yield 纯文本！
-                        
-                except json.JSONDecodeError:
+    """
+    流式调用；并发的相同请求共享一路上游流，后加入者会先收到已生成的前缀。
+    整个流式过程都占用一个调度名额
+    """
+    model = model_router.resolve(model, messages)
+    if not LLM_SINGLEFLIGHT_ENABLED:
+        async for chunk in _stream_completion(model, messages, priority, schema):
+            yield chunk
+        return
+
+    # 约束解码的结构和优先级不同的请求不合并（批量流不应与交互流共用一路上游）
+    key = make_cache_key(model, messages, 0.7, schema.name if schema else None)
+    async for chunk in _singleflight.stream(
+        f"{key}:{priority}", lambda: _stream_completion(model, messages, priority, schema)
+    ):
+        yield chunk
+
+
+async def _stream_completion(
+    model: str,
+    messages: List[Dict[str, str]],
+    priority: int,
+    schema: Optional[OutputSchema] = None,
+) -> AsyncGenerator[str, None]:
+    route = metrics.current_route.get()
+    payload = _with_session_hint({
+        "model": model,
+        "messages": messages,
+        "stream": True, # 开启流
+        "temperature": 0.7,
+        **({"stream_options": {"include_usage": True}} if LLM_STREAM_INCLUDE_USAGE else {}),
+    })
+    first_token_at = None
+    # 逐片段只做计数和追加，其余指标在流结束时一次记录，不拖慢 token 下发
+    chunks = 0
+    pieces = []
+    usage = {}
+    tried = set()
+    drop_schema = False
+    rejected_by: Optional[Endpoint] = None
+    policy = resilience.policy_for(route)
+    timeout = policy.http_timeout(stream=True)
+    async with model_router.track(model), scheduler.slot(priority), _get_client() as client:
+        while True:
+            endpoint = upstream_pool.pick(model, tried)
+            tried.add(endpoint)
+            params = {} if drop_schema else structured.request_params(schema, endpoint.url)
+            start = time.perf_counter()
+            timer = resilience.StreamTimer(policy.first_token)
+            try:
+                async with upstream_pool.use(endpoint), AsyncExitStack() as stack:
+                    async with timer.scope():
+                        response = await stack.enter_async_context(client.stream(
+                            "POST",
+                            endpoint.chat_url,
+                            headers=_headers(endpoint),
+                            json={**payload, **params},
+                            timeout=timeout,
+                        ))
+                    response.raise_for_status()
+                    lines = response.aiter_lines()
+                    while True:
+                        try:
+                            line = await timer.read(lines)
+                        except StopAsyncIteration:
+                            break
+                        if not line:
+                            continue
+
+                        # 1. 去除 data: 前缀
+                        if line.startswith("data:"):
+                            line = line[5:].strip() # 去掉 'data:' (5个字符)
+
+                        # 2. 检查结束标记
+                        if line == "[DONE]":
+                            break
+
+                        # 3. 解析 JSON 并提取文字
+                        try:
+                            content = _delta_content(line)
+
+                            if content:
+                                chunks += 1
+                                pieces.append(content)
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                    _latency["call_llm_stream_ttft"].append(first_token_at - start)
+                                    model_router.observe_ttft(model, first_token_at - start)
+                                yield content  # 👈 关键：只 yield 纯文本！
+                                timer.resume(policy.idle)
+                            elif _REASONING_KEY in line:
+                                # 推理模型的思考内容不下发，但说明上游仍在生成
+                                timer.resume(policy.idle)
+                            elif _USAGE_KEY in line:
+                                # include_usage 时最后一个 chunk 的 choices 为空，只带 usage
+                                usage = json.loads(line).get("usage") or usage
+
+                        except json.JSONDecodeError:
+                            continue
+                        except Exception as e:
+                            # print(f"解析错误: {e}")
+                            continue
+            except Exception as e:
+                metrics.llm_errors_total.inc(route, model, "stream")
+                if isinstance(e, TimeoutError):
+                    e = resilience.stream_timeout(timer)
+                if not chunks and structured.rejected(e, params):
+                    drop_schema = True
+                    rejected_by = endpoint
+                    tried.discard(endpoint)
                     continue
-                except Exception as e:
-                    # print(f"解析错误: {e}") 
-                    continue
\ No newline at end of file
+                # 已经输出过内容就不能透明重试，只有首个 token 之前的失败才换节点
+                if chunks or not _should_failover(e, model, endpoint, tried):
+                    raise e
+                continue
+            break
+    if rejected_by is not None:
+        structured.mark_unsupported(rejected_by.url)
+    finished = time.perf_counter()
+    # 流式按首 token 时间衡量节点负载，避免输出长度影响选点
+    upstream_pool.success(endpoint, (first_token_at or finished) - start)
+    _latency["call_llm_stream_total"].append(finished - start)
+    metrics.llm_generation_seconds.observe(finished - start, route, model, "stream")
+    # 片段数不等于 token 数（上游可能一次下发多个 token）：优先用上游的 usage，缺失时按生成文本估算
+    completion_tokens = usage.get("completion_tokens") or count_tokens("".join(pieces))
+    metrics.llm_prompt_tokens.observe(usage.get("prompt_tokens") or message_tokens(messages), route, model)
+    metrics.llm_completion_tokens.observe(completion_tokens, route, model)
+    if first_token_at is not None:
+        metrics.llm_ttft_seconds.observe(first_token_at - start, route, model)
+        if completion_tokens > 1 and finished > first_token_at:
+            metrics.llm_tokens_per_second.observe(
+                (completion_tokens - 1) / (finished - first_token_at), route, model
+            )
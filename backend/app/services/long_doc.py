@@ -0,0 +1,217 @@
+# long_doc.py
+"""
+长文档 map-reduce 处理
+- 按 Markdown 标题切分，单节仍过长时再按段落、最后按 token 硬切
+- 各段并发调用上游，输出按原顺序拼接；第一段边生成边下发，后续段在后台提前生成并缓冲
+- 评审结果按段长度加权合并为一个 score / summary / todos
+总耗时取决于单段长度与并发度，而不是整篇文档长度
+"""
+import asyncio
+import re
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.context_budget import count_tokens, truncate_to_tokens
+
+HEADING_RE = re.compile(r"^#{1,6}\s", re.MULTILINE)
+HEADING_LINE_RE = re.compile(r"^#{1,6}\s+(.+)$", re.MULTILINE)
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+SEGMENT_SEPARATOR = "\n\n"
+MAX_REDUCED_TODOS = 8
+
+_stats = {"documents": 0, "segments": 0, "segment_errors": 0}
+
+
+def _split_headings(text: str) -> List[str]:
+    starts = [m.start() for m in HEADING_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(text))
+    return [text[a:b].strip() for a, b in zip(starts, starts[1:]) if text[a:b].strip()]
+
+
+def _hard_split(text: str, max_tokens: int) -> List[str]:
+    pieces = []
+    while text:
+        piece = truncate_to_tokens(text, max_tokens, "head") or text[:1]
+        pieces.append(piece)
+        text = text[len(piece):]
+    return pieces
+
+
+def _pack(blocks: List[str], max_tokens: int) -> List[str]:
+    """相邻的小块合并到接近 max_tokens，减少段数"""
+    segments: List[str] = []
+    current: List[str] = []
+    size = 0
+    for block in blocks:
+        tokens = count_tokens(block)
+        if current and size + tokens > max_tokens:
+            segments.append(SEGMENT_SEPARATOR.join(current))
+            current, size = [], 0
+        current.append(block)
+        size += tokens
+    if current:
+        segments.append(SEGMENT_SEPARATOR.join(current))
+    return segments
+
+
+def split_document(text: str, max_tokens: int) -> List[str]:
+    """切分为不超过 max_tokens 的段，段间以空行分隔，拼回后结构不变"""
+    blocks: List[str] = []
+    for section in _split_headings(text):
+        if count_tokens(section) <= max_tokens:
+            blocks.append(section)
+            continue
+        heading = ""
+        for para in PARAGRAPH_RE.split(section):
+            para = para.strip()
+            if not para:
+                continue
+            if HEADING_RE.match(para) and "\n" not in para:
+                # 单独成段的标题行与其后的第一段正文放在一起，避免标题与正文分属两段
+                heading = para
+                continue
+            if heading:
+                para, heading = heading + SEGMENT_SEPARATOR + para, ""
+            if count_tokens(para) <= max_tokens:
+                blocks.append(para)
+            else:
+                blocks.extend(_hard_split(para, max_tokens))
+        if heading:
+            blocks.append(heading)
+    return _pack(blocks, max_tokens)
+
+
+def segment_titles(segments: List[str]) -> List[str]:
+    """以段首标题命名；不以标题开头的段沿用前文最近的小节标题"""
+    titles = []
+    current = ""
+    for i, segment in enumerate(segments):
+        headings = HEADING_LINE_RE.findall(segment)
+        if segment.lstrip().startswith("#") and headings:
+            titles.append(headings[0].strip())
+        else:
+            titles.append(f"{current}（续）" if current else f"第 {i + 1} 段")
+        if headings:
+            current = headings[-1].strip()
+    return titles
+
+
+def is_long(text: str, threshold: int, requested: Optional[bool]) -> bool:
+    """requested 为 None 时按长度自动判断"""
+    if requested is not None:
+        return requested
+    return count_tokens(text) > threshold
+
+
+async def stream_segments(
+    segments: List[str],
+    make_stream: Callable[[int, str], AsyncGenerator[str, None]],
+    parallel: int,
+) -> AsyncGenerator[str, None]:
+    """
+    并发生成各段并按顺序输出
+    某段失败时在该段位置输出错误提示并继续后面的段，不让整篇结果中断
+    """
+    _stats["documents"] += 1
+    _stats["segments"] += len(segments)
+    sem = asyncio.Semaphore(max(1, parallel))
+    queues: List[asyncio.Queue] = [asyncio.Queue() for _ in segments]
+
+    async def pump(i: int, segment: str):
+        try:
+            async with sem:
+                async for chunk in make_stream(i, segment):
+                    queues[i].put_nowait(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["segment_errors"] += 1
+            queues[i].put_nowait(e)
+        finally:
+            queues[i].put_nowait(None)
+
+    tasks = [asyncio.ensure_future(pump(i, s)) for i, s in enumerate(segments)]
+    try:
+        for i, queue in enumerate(queues):
+            if i:
+                yield SEGMENT_SEPARATOR
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    if i == 0:
+                        # 第一段就失败（如排队被拒）按普通错误抛出，路由可返回对应的 HTTP 状态码
+                        raise item
+                    yield f"[第 {i + 1} 段处理失败: {item}]"
+                    continue
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def map_segments(
+    segments: List[str],
+    fn: Callable[[int, str], Awaitable[Any]],
+    parallel: int,
+) -> List[Tuple[bool, Any]]:
+    """非流式版本：并发处理各段，按原顺序返回 (是否成功, 结果或异常)"""
+    _stats["documents"] += 1
+    _stats["segments"] += len(segments)
+    sem = asyncio.Semaphore(max(1, parallel))
+
+    async def run(i: int, segment: str):
+        async with sem:
+            try:
+                return True, await fn(i, segment)
+            except Exception as e:
+                _stats["segment_errors"] += 1
+                return False, e
+
+    return await asyncio.gather(*(run(i, s) for i, s in enumerate(segments)))
+
+
+def reduce_reviews(segments: List[str], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    分段评审结果合并：score 按段 token 数加权平均；
+    summary 逐段列出；todos 去重后按所在段得分从低到高排列（问题多的段落优先）
+    """
+    titles = segment_titles(segments)
+    weighted = 0.0
+    total = 0
+    summaries = []
+    ranked_todos = []
+    for i, (segment, result) in enumerate(zip(segments, results)):
+        if not result:
+            continue
+        weight = count_tokens(segment)
+        try:
+            score = float(result.get("score", 0))
+        except (TypeError, ValueError):
+            score = 0.0
+        weighted += score * weight
+        total += weight
+        title = titles[i]
+        if result.get("summary"):
+            summaries.append(f"【{title}】{result['summary']}")
+        for todo in result.get("todos") or []:
+            ranked_todos.append((score, i, f"【{title}】{todo}"))
+
+    seen = set()
+    todos = []
+    for _, _, todo in sorted(ranked_todos, key=lambda t: (t[0], t[1])):
+        if todo not in seen:
+            seen.add(todo)
+            todos.append(todo)
+
+    return {
+        "score": round(weighted / total) if total else 0,
+        "summary": "\n".join(summaries) if summaries else "解析失败",
+        "todos": todos[:MAX_REDUCED_TODOS],
+    }
+
+
+def get_long_doc_stats() -> Dict[str, int]:
+    return dict(_stats)
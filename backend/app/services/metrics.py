@@ -0,0 +1,228 @@
+# metrics.py
+"""
+Prometheus 文本格式的进程内指标，GET /metrics 导出
+- 不依赖 prometheus_client：单进程 asyncio 下直接累加整数，observe 只是一次二分查找
+- 流式路径上不逐片段记录，只在流结束时记一次 TTFT / 总耗时 / 速率
+- 标签只用路由模板和模型名，基数固定
+"""
+import bisect
+import contextvars
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from app.config import METRICS_ENABLED
+
+# 由路由层依赖注入写入（路由模板路径），上游调用的指标据此按路由拆分
+current_route: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_route", default="unknown"
+)
+# 路由模板的公共前缀；按路由配置的设置一律以去掉前缀后的路径为键（如 "/continue"）
+ROUTE_PREFIX = "/api/writing"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 40, 60, 80, 120, 200)
+PARSE_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 0.001, 0.005, 0.01, 0.05)
+
+LabelValues = Tuple[str, ...]
+
+
+def route_key(path: str) -> str:
+    """按路由配置的查找键：去掉 /api/writing 前缀；后台任务 (job:<kind>) 等原样返回"""
+    return path[len(ROUTE_PREFIX):] if path.startswith(ROUTE_PREFIX + "/") else path
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str]):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        if METRICS_ENABLED:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [各桶计数（非累积，最后一格为 +Inf）, sum, count]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        if not METRICS_ENABLED:
+            return
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, values, f'le="{bound:g}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            plain = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{plain} {total:.6f}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+http_request_seconds = Histogram(
+    "writing_http_request_seconds",
+    "HTTP 请求耗时（流式响应计到最后一个字节）",
+    ("route", "method", "status"),
+    LATENCY_BUCKETS,
+)
+llm_ttft_seconds = Histogram(
+    "writing_llm_ttft_seconds",
+    "上游首个 token 延迟（不含调度排队，排队见 /llm/stats）",
+    ("route", "model"),
+    LATENCY_BUCKETS,
+)
+llm_generation_seconds = Histogram(
+    "writing_llm_generation_seconds",
+    "上游调用总耗时（不含调度排队）",
+    ("route", "model", "mode"),
+    LATENCY_BUCKETS,
+)
+llm_tokens_per_second = Histogram(
+    "writing_llm_stream_tokens_per_second",
+    "流式生成速率（首个 token 之后）",
+    ("route", "model"),
+    RATE_BUCKETS,
+)
+llm_prompt_tokens = Histogram(
+    "writing_llm_prompt_tokens",
+    "prompt 大小 (tokens)",
+    ("route", "model"),
+    TOKEN_BUCKETS,
+)
+llm_completion_tokens = Histogram(
+    "writing_llm_completion_tokens",
+    "生成长度 (tokens)",
+    ("route", "model"),
+    TOKEN_BUCKETS,
+)
+llm_errors_total = Counter(
+    "writing_llm_errors_total",
+    "上游调用失败次数",
+    ("route", "model", "mode"),
+)
+llm_retries_total = Counter(
+    "writing_llm_retries_total",
+    "非流式调用退避重试次数，reason 为状态码或异常类型",
+    ("route", "reason"),
+)
+llm_hedges_total = Counter(
+    "writing_llm_hedges_total",
+    "对冲请求：sent 为发出的第二份请求，won 为第二份先返回",
+    ("route", "outcome"),
+)
+model_route_total = Counter(
+    "writing_model_route_total",
+    "模型分层路由决策：reason 为 fast / heavy / heavy_only / downgrade_* / fast_window",
+    ("route", "model", "reason"),
+)
+edit_script_total = Counter(
+    "writing_edit_script_total",
+    "编辑脚本结果：applied 为已应用，其余为回退原因（unparsable / not_found / ambiguous / overlap / too_many / empty_find）",
+    ("route", "outcome"),
+)
+json_parse_total = Counter(
+    "writing_json_parse_total",
+    "clean_and_parse_json 结果：strict（合法 JSON 直接解析）/ ok（repair_json 修复）/ "
+    "fallback（代码块兜底）/ default（返回默认值）/ error",
+    ("route", "outcome"),
+)
+json_parse_seconds = Histogram(
+    "writing_json_parse_seconds",
+    "clean_and_parse_json 耗时，按结果区分",
+    ("route", "outcome"),
+    PARSE_BUCKETS,
+)
+
+_registry = (
+    http_request_seconds,
+    llm_ttft_seconds,
+    llm_generation_seconds,
+    llm_tokens_per_second,
+    llm_prompt_tokens,
+    llm_completion_tokens,
+    llm_errors_total,
+    llm_retries_total,
+    llm_hedges_total,
+    model_route_total,
+    edit_script_total,
+    json_parse_total,
+    json_parse_seconds,
+)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：只包装 send 以记录响应结束时间，不缓冲、不改写响应体，
+    对逐片段下发的流式响应没有额外开销（不使用 BaseHTTPMiddleware）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 路由匹配后 scope 中带有 route，未匹配的请求归为一类，避免标签基数膨胀
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            http_request_seconds.observe(
+                time.perf_counter() - start, path, scope.get("method", ""), status
+            )
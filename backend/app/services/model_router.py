@@ -0,0 +1,136 @@
+# model_router.py
+"""
+按任务把请求分到快速小模型或大模型
+- MODEL_ROUTES 把接口映射到层级：fast / heavy / heavy_only，层级再由 MODEL_TIERS 映射到模型名
+- heavy 接口在大模型繁忙时降级到 fast：大模型在途（含排队）请求数或流式首 token 延迟的滑动平均超过阈值，
+  触发后保持 MODEL_DOWNGRADE_HOLD 秒；heavy_only（长文生成、大纲、评审）从不降级
+- 小模型上下文窗口放不下本次 prompt 时仍用大模型
+- 每次决策按 (接口, 模型, 原因) 计数，最近的降级记录保留在 /llm/stats 中
+"""
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from app.config import (
+    MODEL_ROUTING_ENABLED,
+    MODEL_TIERS,
+    MODEL_ROUTES,
+    MODEL_ROUTES_OVERRIDES,
+    MODEL_DOWNGRADE_INFLIGHT,
+    MODEL_DOWNGRADE_TTFT,
+    MODEL_DOWNGRADE_HOLD,
+    LLM_CONTEXT_WINDOWS,
+    LLM_DEFAULT_CONTEXT_WINDOW,
+    LLM_COMPLETION_RESERVE,
+)
+from app.services import metrics
+from app.services.context_budget import message_tokens
+
+TTFT_ALPHA = 0.2
+
+
+class ModelRouter:
+    def __init__(self, tiers: Dict[str, str], routes: Dict[str, str]):
+        self.tiers = tiers
+        self.routes = routes
+        self.inflight: Dict[str, int] = {}
+        # 各模型流式首 token 延迟的滑动平均，以及最近一次采样时间
+        self.ttft: Dict[str, float] = {}
+        self.ttft_at: Dict[str, float] = {}
+        self.downgraded_until = 0.0
+        self.decisions: Dict[str, int] = {}
+        self.recent: deque = deque(maxlen=50)
+
+    def tier_of(self, route: str) -> Optional[str]:
+        return self.routes.get(metrics.route_key(route))
+
+    # ================= 负载信号 =================
+
+    @asynccontextmanager
+    async def track(self, model: str):
+        """一次上游调用从进入调度队列到结束都计入该模型的在途数"""
+        self.inflight[model] = self.inflight.get(model, 0) + 1
+        try:
+            yield
+        finally:
+            self.inflight[model] -= 1
+
+    def observe_ttft(self, model: str, seconds: float):
+        previous = self.ttft.get(model)
+        self.ttft[model] = seconds if previous is None else previous + TTFT_ALPHA * (seconds - previous)
+        self.ttft_at[model] = time.monotonic()
+
+    def _overload(self, model: str) -> Optional[str]:
+        now = time.monotonic()
+        if self.inflight.get(model, 0) >= MODEL_DOWNGRADE_INFLIGHT:
+            self.downgraded_until = now + MODEL_DOWNGRADE_HOLD
+            return "downgrade_queue"
+        # 首 token 延迟只看最近的采样，降级期间大模型流量变少，过旧的均值不再作数
+        if (
+            self.ttft.get(model, 0.0) >= MODEL_DOWNGRADE_TTFT
+            and now - self.ttft_at.get(model, 0.0) < MODEL_DOWNGRADE_HOLD
+        ):
+            self.downgraded_until = now + MODEL_DOWNGRADE_HOLD
+            return "downgrade_latency"
+        if now < self.downgraded_until:
+            return "downgrade_hold"
+        return None
+
+    # ================= 选模型 =================
+
+    def _fits(self, model: str, fallback: str, messages: List[Dict[str, str]]) -> bool:
+        window = LLM_CONTEXT_WINDOWS.get(model, LLM_DEFAULT_CONTEXT_WINDOW)
+        # 小模型窗口不小于原模型时无需计数
+        if window >= LLM_CONTEXT_WINDOWS.get(fallback, LLM_DEFAULT_CONTEXT_WINDOW):
+            return True
+        return message_tokens(messages) + LLM_COMPLETION_RESERVE <= window
+
+    def resolve(self, model: str, messages: List[Dict[str, str]]) -> str:
+        """返回本次调用实际使用的模型；未配置层级的接口原样使用调用方指定的模型"""
+        if not MODEL_ROUTING_ENABLED:
+            return model
+        route = metrics.current_route.get()
+        tier = self.tier_of(route)
+        if tier is None:
+            return model
+        heavy, fast = self.tiers["heavy"], self.tiers["fast"]
+        reason = tier
+        chosen = fast if tier == "fast" else heavy
+        # 两层指向同一模型时降级没有意义
+        if tier == "heavy" and fast != heavy:
+            overload = self._overload(heavy)
+            if overload:
+                reason, chosen = overload, fast
+        if chosen == fast and fast != heavy and not self._fits(fast, heavy, messages):
+            reason, chosen = "fast_window", heavy
+        self._record(route, chosen, reason)
+        if reason.startswith("downgrade"):
+            self.recent.append({
+                "time": round(time.time(), 3),
+                "route": route,
+                "reason": reason,
+                "inflight": self.inflight.get(heavy, 0),
+                "ttft_ms": round(self.ttft.get(heavy, 0.0) * 1000, 1),
+            })
+        return chosen
+
+    def _record(self, route: str, model: str, reason: str):
+        key = f"{route} -> {model} ({reason})"
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        metrics.model_route_total.inc(route, model, reason)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": MODEL_ROUTING_ENABLED,
+            "tiers": self.tiers,
+            "inflight": dict(self.inflight),
+            "ttft_ewma_ms": {m: round(v * 1000, 1) for m, v in self.ttft.items()},
+            "downgraded": time.monotonic() < self.downgraded_until,
+            "decisions": dict(self.decisions),
+            "recent_downgrades": list(self.recent),
+        }
+
+
+model_router = ModelRouter(MODEL_TIERS, {**MODEL_ROUTES, **json.loads(MODEL_ROUTES_OVERRIDES or "{}")})
@@ -0,0 +1,427 @@
+# prompts.py
+"""
+Prompt 模板注册表
+所有路由的 prompt 都从这里的命名模板渲染，占位符统一为 {{KEY}}（与前端 DEFAULT_PROMPTS 一致）
+
+两种渲染布局：
+- 前缀稳定 (默认)：模板里的固定指令放在最前面的 system 消息，占位符替换为【标签】引用；
+  可变内容按模板顺序放在最后的 user 消息。同一模板的所有请求共享完全相同的前缀，
+  vLLM / SGLang 等服务端的前缀缓存 (KV cache) 可以直接复用
+- 内联：占位符原地替换，整段作为一条 user 消息（旧行为，用于对比）
+"""
+import re
+from typing import Dict, List, Optional
+
+from app.config import LLM_PREFIX_STABLE_PROMPTS
+
+PLACEHOLDER_RE = re.compile(r"\{\{([A-Z_]+)\}\}")
+# 一整行只有 "标签 + 单个占位符" 的字段行
+FIELD_LINE_RE = re.compile(r"^([^{}]{0,30}?)\{\{([A-Z_]+)\}\}\s*$")
+
+# 占位符在前缀稳定布局中显示的标签
+LABELS = {
+    "TOPIC": "主题",
+    "CONCEPT": "核心构想",
+    "MATERIALS": "参考材料",
+    "CONSTRAINTS": "附加约束",
+    "TITLE": "章节标题",
+    "CONTEXT": "上下文",
+    "STYLE": "写作风格",
+    "POINTS": "写作要点",
+    "CONTENT": "原文",
+    "GUIDANCE": "修改引导",
+    "REQUIREMENTS": "要求",
+    "OUTLINE": "大纲",
+    "QUERY": "用户问题",
+    "TODO": "修改意见",
+    "INSTRUCTION": "用户指令",
+    "CHAT": "对话记录",
+    "SUGGESTIONS": "修改建议",
+    "ROUND": "当前轮次",
+    "DIALOG": "当前对话",
+}
+# 值为空时在前缀稳定布局中整行省略（不渲染为"（无）"）的占位符，对应旧 prompt 里按条件拼接的行
+OPTIONAL_KEYS = {"CONSTRAINTS"}
+
+
+class PromptTemplate:
+    def __init__(self, name: str, text: str, system: Optional[str] = None):
+        self.name = name
+        self.text = text.strip()
+        # 额外的固定系统提示，始终位于最前
+        self.system = system
+
+    @property
+    def keys(self) -> List[str]:
+        seen = []
+        for key in PLACEHOLDER_RE.findall(self.text):
+            if key not in seen:
+                seen.append(key)
+        return seen
+
+    def render(self, values: Dict[str, str], stable: Optional[bool] = None) -> List[Dict[str, str]]:
+        if stable is None:
+            stable = LLM_PREFIX_STABLE_PROMPTS
+        if not self.keys:
+            return self._messages(self.text, None)
+
+        if not stable:
+            text = PLACEHOLDER_RE.sub(lambda m: str(values.get(m.group(1), "")), self.text)
+            return self._messages(None, text)
+
+        # 形如 "主题：{{TOPIC}}" 的整行字段移到末尾的 user 消息，沿用行首文字作标签；
+        # 嵌在句子中的占位符替换为【标签】引用，对应内容同样放到末尾
+        static_lines = []
+        blocks: Dict[str, str] = {}
+        for line in self.text.split("\n"):
+            field = FIELD_LINE_RE.match(line)
+            if field:
+                prefix, key = field.group(1).strip(), field.group(2)
+                blocks.setdefault(key, prefix or f"【{LABELS.get(key, key)}】：")
+                continue
+            for key in PLACEHOLDER_RE.findall(line):
+                blocks.setdefault(key, f"【{LABELS.get(key, key)}】：")
+            static_lines.append(
+                PLACEHOLDER_RE.sub(lambda m: f"【{LABELS.get(m.group(1), m.group(1))}】", line)
+            )
+        static = "\n".join(static_lines).strip()
+
+        variable = []
+        for key, label in blocks.items():
+            value = str(values.get(key, "")).strip()
+            if not value and key in OPTIONAL_KEYS:
+                continue
+            value = value or "（无）"
+            sep = "\n" if "\n" in value else ""
+            variable.append(f"{label}{sep}{value}")
+        return self._messages(static, "\n".join(variable))
+
+    def _messages(self, static: Optional[str], variable: Optional[str]) -> List[Dict[str, str]]:
+        messages = []
+        system_parts = [p for p in (self.system, static) if p]
+        if system_parts and variable is not None:
+            messages.append({"role": "system", "content": "\n\n".join(system_parts)})
+            messages.append({"role": "user", "content": variable})
+        elif variable is not None:
+            messages.append({"role": "user", "content": variable})
+        else:
+            # 没有可变内容：固定指令本身就是用户消息
+            if self.system:
+                messages.append({"role": "system", "content": self.system})
+            messages.append({"role": "user", "content": static})
+        return messages
+
+
+AUTO_WRITE_SYSTEM_PROMPT = """# 基于事实锚定的动态访谈与写作专家 
+## 1. 核心原则
+你是一位严谨的商业分析师。你的工作是基于用户的输入指令进行**启发式访谈**，并依据访谈收集到的**真实信息**撰写文档。
+**【最高指令 - 防幻觉机制】：**
+*   **严禁捏造数据：** 正文中出现的任何数据（百分比、金额、时间参数等）、具体企业名称、引用语，必须严格来源于用户在 5 轮访谈中的回答。
+*   **定性代替定量：** 如果用户只提供了定性描述（如“效率很低”），你在正文中只能写“效率显著低下”，**绝对不能**自动补全为“效率下降了 30%”。
+*   **事实一致性：** 你的输出必须是用户回答的忠实映射，加上专业的逻辑润色，而非创造性的虚构。
+
+## 2. 工作流程 
+
+### 阶段一：指令解析与提问规划 (Parsing)
+当用户输入一段包含 **[章节标题]**、**[二级要点]** 和 **[行动引导 Action Guide]** 的文本时：
+1.  分析“行动引导”中的 Steps，确定需要从用户那里获取哪些**具体素材**（如：场景、痛点细节、具体数据证据、机会点）。
+2.  规划 5 个问题，确保问题能覆盖所有 Steps 的要求。
+
+### 阶段二：动态启发式访谈 
+开启 5 轮对话。**严禁一次性问完。**
+
+*   **提问策略：**
+    *   **Q1-Q5 动态生成：** 根据用户输入的 Action Guide 逐步提问。
+    *   **数据索取（关键）：** 如果 Action Guide 中包含“验证”、“数据报告”等要求，你必须在提问中显式询问用户：*“您手头是否有具体的统计数据（如百分比、金额）来支持这一观点？如果没有，我们将使用定性描述。”*
+    *   **启发式引导：** 继续使用 A/B 选项或场景例子帮助用户思考，但引导语中涉及的数据必须声明为“例如”。
+
+### 阶段三：正文撰写 
+当用户回答完 Q5 后，基于收集到的信息撰写正文。
+
+*   **写作规范：**
+    *   **结构：** 使用用户输入的标题。
+    *   **内容：** 将用户的回答串联成逻辑严密的商业分析。
+    *   **数据处理：**
+        *   若用户提供了数据（如“错误率50%”），请引用。
+        *   若用户未提供数据，使用“据调研观察”、“行业普遍反馈”、“显著存在”等定性词汇，**严禁**编造“78%”、“TOP 5”等细节。
+
+---
+
+## 3. 示例：
+
+**用户输入指令：**
+> 行动引导：Step 3 开展普遍性验证，用户可选渠道：行业数据报告...
+
+**AI 提问 (Q4)：**
+> “根据引导，我们需要验证痛点的普遍性。请问您是否有具体的行业数据或调研样本数据来佐证这一点？（例如：具体的错误率数值、成本占比等）。**如果您暂时没有具体数字，请告知我，我将在文档中侧重于描述现象的普遍性而非具体量化指标。**”
+
+**用户回答 (Q4)：**
+
+> “具体数据没有，但是跟几个仓库经理聊，大家都说这个问题很严重，主要是这就导致了很多人离职。”
+
+**AI 错误写法 (禁止)：**
+> “调研显示，75% 的仓库面临严重问题，导致离职率上升 20%。” *(错误：编造数据)*
+
+**AI 正确写法 (允许)：**
+> “调研访谈显示，这一问题在行业内具有显著的普遍性。多位仓库管理人员反馈，该痛点不仅影响作业效率，更成为一线人员高流失率的关键诱因。” *(正确：忠实反映用户提供的“严重”和“导致离职”)*
+
+---
+
+## 4. 关键约束 
+1.  你的知识库仅用于优化语言表达和逻辑连接，**不可用于补充具体的行业数据**（除非用户明确要求你使用你的内部知识库进行估算，并标记为“估算值”）。
+2.   用户的回答是正文内容的唯一素材来源。
+3. 每次只问一个问题。"""
+
+
+
+PROMPTS: Dict[str, PromptTemplate] = {}
+
+
+def register(name: str, text: str, system: Optional[str] = None) -> PromptTemplate:
+    PROMPTS[name] = PromptTemplate(name, text, system)
+    return PROMPTS[name]
+
+
+# ================= 一键代写访谈 =================
+
+register("auto_write_questions", """
+你正在为一键代写收集素材，需要规划 5 条按顺序展开的访谈提问。严格遵循系统提示中的访谈规范，确保每个问题都围绕行动引导逐步索取关键信息。输出 JSON 数组：元素是按顺序的中文问题字符串，可附带 1-2 行引导示例（使用“例如：”或项目符号），不要编号或额外解释。
+
+上下文信息：{{CONTEXT}}
+""", system=AUTO_WRITE_SYSTEM_PROMPT)
+
+register("auto_write_next_question", """
+请按照访谈专家的工作流程继续进行 5 轮启发式对话，每次只提出 1 个核心追问。结合上下文与已收集的问答，生成下一条能推进素材收集的追问，避免重复或宽泛。如果行动引导或历史回答提示需要数据验证，请显式询问用户是否有百分比/金额等具体数据，若没有则说明将以定性描述。输出格式：直接给出中文问题文本，如需引导可在后续追加 1-3 行示例/选项（使用“例如：”或项目符号），不要编号或其它解释。
+
+上下文：{{CONTEXT}}
+当前对话：{{DIALOG}}
+当前轮次（共 5 轮）：{{ROUND}}
+""", system=AUTO_WRITE_SYSTEM_PROMPT)
+
+# ================= 核心生成 =================
+
+register("outline", """
+请为以下主题生成一个详细写作大纲（JSON数组，包含嵌套children）。
+主题：{{TOPIC}}
+写作要求：{{REQUIREMENTS}}
+""")
+
+register("outline_from_materials", """
+基于以下材料生成详细的写作大纲（JSON数组格式）。
+
+要求格式示例（不要包含Markdown标记）：
+[
+  {
+    "title": "第一章...",
+    "writingPoints": [ { "text": "本章核心目标：阐述..." } ],
+    "children": [
+       { "title": "1.1...", "writingPoints": [{ "text": "要点1" }] }
+    ]
+  }
+]
+
+主题：{{TOPIC}}
+核心构想：{{CONCEPT}}
+参考材料摘要：{{MATERIALS}}
+{{CONSTRAINTS}}
+""")
+
+register("article", """
+根据以下大纲撰写完整文章：
+大纲：
+{{OUTLINE}}
+要求：
+{{REQUIREMENTS}}
+""")
+
+register("chunk", """
+请撰写文章的一个小节，直接返回 Markdown 格式的正文内容。
+【章节标题】：{{TITLE}}
+【写作风格】：{{STYLE}}
+【本小节核心写作要点】：{{POINTS}}
+【上下文/前文摘要】：{{CONTEXT}}
+""")
+
+register("template", """
+为章节生成写作模板。
+章节：{{TITLE}}
+要点：{{POINTS}}
+""")
+
+# ================= 编辑与润色 =================
+
+register("polish", """
+请对以下内容进行全文润色，使语言更专业流畅，保持原意不变：
+{{CONTENT}}
+""")
+
+register("rewrite", """
+请根据以下特定要求重写这段文本：
+【重写要求】：{{REQUIREMENTS}}
+【原文】：{{CONTENT}}
+""")
+
+register("smart_edit_rewrite", """
+你是一个智能写作助手。请根据用户指令对选中的文本进行重写，直接输出重写后的结果。
+【用户指令】：{{INSTRUCTION}}
+【选中文本】：{{CONTENT}}
+""")
+
+register("smart_edit_continue", """
+你是一个智能写作助手。请根据用户指令对选中的文本进行续写，直接输出续写后的结果。
+【用户指令】：{{INSTRUCTION}}
+【选中文本】：{{CONTENT}}
+""")
+
+register("continue", """
+请根据上文内容，自然地续写接下来的2-3个句子。
+【上文】：{{CONTEXT}}
+""")
+
+register("fix_todo", """
+文章中有一处需要修改，请根据修改意见重写该段落。
+【修改意见】：{{TODO}}
+【原段落上下文】：{{CONTENT}}
+""")
+
+register("rewrite_guidance", """
+根据指导重写内容，可参考材料中的事实，不要编造材料以外的数据。
+指导：{{GUIDANCE}}
+参考材料：{{MATERIALS}}
+内容：{{CONTENT}}
+""")
+
+register("partial_merge", """
+根据对话融合片段。
+对话：{{CHAT}}
+片段：{{CONTENT}}
+""")
+
+register("selection_ref", """
+根据指令和参考对话修改原文。
+指令：{{INSTRUCTION}}
+对话：{{CHAT}}
+原文：{{CONTENT}}
+""")
+
+# ================= 评审与助手 =================
+
+register("review", """
+请作为专业编辑对以下文章进行评审。
+请严格返回合法的 JSON 格式，包含以下字段：
+1. score (0-100的整数评分)
+2. summary (简短的评审摘要)
+3. todos (包含3-5条具体的修改建议数组，字符串列表)
+
+【文章内容】：{{CONTENT}}
+""")
+
+register("review_chunk", """
+评审以下章节，请返回JSON：{score, summary, todos}
+章节标题：{{TITLE}}
+{{CONTENT}}
+""")
+
+register("review_full", "全文评审...")
+
+register("review_apply", """
+根据建议修改原文。
+建议：{{SUGGESTIONS}}
+原文：{{CONTENT}}
+""")
+
+register("review_apply_segment", """
+根据建议修改原文。原文是一篇长文档中的一段，只处理与本段相关的建议；
+没有相关建议时原样输出本段，不要输出任何解释。
+建议：{{SUGGESTIONS}}
+原文：{{CONTENT}}
+""")
+
+register("chat", """
+请根据提供的上下文回答用户的问题。
+【上下文】：{{CONTEXT}}
+【用户问题】：{{QUERY}}
+""")
+
+register("detailed_info", """
+请针对给定主题提供详细的背景信息和解释，输出一段详细、专业的说明文字。
+主题：{{TOPIC}}
+【相关上下文】：{{CONTEXT}}
+""")
+
+register("suggestions", """
+猜测用户想问的3个问题及2个关键信息点。返回JSON：{userQuestions:[], aiInfo:[]}
+主题：{{TOPIC}}
+""")
+
+# ================= 指导与辅助 =================
+
+register("guide_global", """
+请生成《全文写作指导》和《分章节指导》。
+请返回 JSON 对象：
+{
+  "globalOverview": "...",
+  "chapterGuides": { "章节名": "..." }
+}
+
+主题：{{TOPIC}}
+概念：{{CONCEPT}}
+大纲结构：{{OUTLINE}}
+""")
+
+register("guide_contextual", """
+为章节生成简短改写引导和推荐资料。
+请返回 JSON 格式：
+{ "guidance": "...", "materials": "..." }
+章节：{{TITLE}}
+""")
+
+register("points", """
+为章节生成3个写作要点，返回JSON数组。
+章节：{{TITLE}}
+""")
+
+register("points_more", "建议下一个写作要点。")
+
+register("related_queries", "生成3个搜索关键词，JSON数组。")
+
+
+# ================= 编辑脚本 =================
+# 修改类模板的 <name>_edits 变体：只输出替换列表，服务端定位后应用到原文（edit_script.py）
+
+EDIT_SCRIPT_RULES = """
+不要输出修改后的全文，只输出需要改动的地方，返回 JSON：{"edits": [{"find": "原文片段", "replace": "替换为"}]}
+- find 必须逐字复制原文中连续的一段（含标点），且在原文中只出现一次；尽量短，但要足以唯一定位
+- 删除时 replace 为空字符串；插入时把插入点前后相邻的原文一并写进 find 和 replace
+- 各条 find 互不重叠；没有需要修改的地方时返回 {"edits": []}
+"""
+
+EDIT_SCRIPT_TEMPLATES = ("fix_todo", "rewrite_guidance", "partial_merge", "selection_ref",
+                         "review_apply", "review_apply_segment")
+
+for _name in EDIT_SCRIPT_TEMPLATES:
+    register(f"{_name}_edits", PROMPTS[_name].text + "\n" + EDIT_SCRIPT_RULES, PROMPTS[_name].system)
+
+
+def get_template(name: str, custom: Optional[str] = None) -> PromptTemplate:
+    """
+    取得模板：custom 为注册表中的名称时使用该模板；
+    为其它非空文本时视为前端传来的自定义模板 ({{KEY}} 占位符)
+    """
+    if custom and custom.strip():
+        if custom.strip() in PROMPTS:
+            return PROMPTS[custom.strip()]
+        return PromptTemplate(f"{name}:custom", custom, PROMPTS[name].system)
+    return PROMPTS[name]
+
+
+def render_prompt(name: str, custom: Optional[str] = None, **values: str) -> List[Dict[str, str]]:
+    """按名称渲染出 messages 列表"""
+    return get_template(name, custom).render(values)
+
+
+def list_templates() -> List[Dict[str, object]]:
+    return [
+        {"name": t.name, "keys": t.keys, "text": t.text, "hasSystem": bool(t.system)}
+        for t in PROMPTS.values()
+    ]
@@ -0,0 +1,213 @@
+# resilience.py
+"""
+上游调用的超时、重试与对冲请求
+- 超时分三段：建立连接、首个 token（非流式为整个响应）、流式相邻 token 之间的空闲
+- 按路由配置延迟目标 (LLM_ROUTE_POLICIES)，未配置的路由使用全局默认值
+- 非流式调用是幂等的：超时、连接失败、429 / 502 / 503 / 504 时按全抖动指数退避重试
+- 对冲：开启对冲的短 JSON 路由等待超过该路由最近的 p95 仍未返回时，再发一份相同请求
+  （优先发往另一节点），先成功的返回，另一份取消
+- 按路由记录最近的调用耗时，既用于对冲延迟，也在 /llm/stats 中给出 p50 / p95 / p99
+"""
+import asyncio
+import contextlib
+import json
+import random
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from app.config import (
+    LLM_CONNECT_TIMEOUT,
+    LLM_CALL_TIMEOUT,
+    LLM_FIRST_TOKEN_TIMEOUT,
+    LLM_IDLE_TIMEOUT,
+    LLM_RETRIES,
+    LLM_RETRY_BACKOFF,
+    LLM_RETRY_BACKOFF_MAX,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_ROUTES,
+    LLM_HEDGE_DEFAULT_DELAY,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_ROUTE_POLICIES,
+)
+from app.services import metrics
+
+RETRY_STATUS = (429, 502, 503, 504)
+# 对冲延迟的下限，避免冷启动或极快的路由几乎每次都发两份
+MIN_HEDGE_DELAY = 0.05
+_WINDOW = 500
+
+
+class StreamTimeout(httpx.ReadTimeout):
+    """首 token 或 token 间空闲超时；继承 httpx 的超时异常，按节点故障参与换节点与熔断"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class RoutePolicy:
+    def __init__(self, route: str, overrides: Dict[str, Any]):
+        self.timeout = float(overrides.get("timeout", LLM_CALL_TIMEOUT))
+        self.first_token = float(overrides.get("firstToken", LLM_FIRST_TOKEN_TIMEOUT))
+        self.idle = float(overrides.get("idle", LLM_IDLE_TIMEOUT))
+        self.retries = int(overrides.get("retries", LLM_RETRIES))
+        self.hedge = LLM_HEDGE_ENABLED and bool(overrides.get("hedge", route in LLM_HEDGE_ROUTES))
+
+    def http_timeout(self, stream: bool) -> httpx.Timeout:
+        # 流式的首 token / 空闲超时由 StreamTimer 精确控制，httpx 的读超时只作兜底
+        read = max(self.first_token, self.idle) if stream else self.timeout
+        return httpx.Timeout(read, connect=LLM_CONNECT_TIMEOUT)
+
+
+_overrides: Dict[str, Dict[str, Any]] = json.loads(LLM_ROUTE_POLICIES or "{}")
+_policies: Dict[str, RoutePolicy] = {}
+_latency: Dict[str, Deque[float]] = {}
+_stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "first_token_timeouts": 0, "idle_timeouts": 0}
+
+
+def policy_for(route: str) -> RoutePolicy:
+    policy = _policies.get(route)
+    if policy is None:
+        key = metrics.route_key(route)
+        policy = _policies[route] = RoutePolicy(key, _overrides.get(key, {}))
+    return policy
+
+
+# ================= 流式超时 =================
+
+class StreamTimer:
+    """
+    首个 token 之前是 first_token 的总时限，之后每收到一个 token 重置为 idle
+    超时作用域只包住单次读取，不跨越 yield：流式生成器每次可能由不同的任务恢复（取消守护、合并下发），
+    跨 yield 的 asyncio.timeout 绑定在第一个任务上，之后不会生效
+    向下游 yield 期间不在任何读取里，不计时，下游消费慢不会被误判为上游空闲
+    """
+
+    def __init__(self, first_token: float):
+        self._loop = asyncio.get_running_loop()
+        self._deadline = self._loop.time() + first_token
+        self.started = False
+
+    def resume(self, seconds: float):
+        self.started = True
+        self._deadline = self._loop.time() + seconds
+
+    def scope(self):
+        """在截止时间到达时超时的作用域，用于建立流（等待响应头）"""
+        if hasattr(asyncio, "timeout_at"):
+            return asyncio.timeout_at(self._deadline)
+        return contextlib.nullcontext()
+
+    async def read(self, lines: AsyncIterator[str]) -> str:
+        """读取下一行；超过截止时间抛出 TimeoutError，读完抛出 StopAsyncIteration"""
+        if hasattr(asyncio, "timeout_at"):
+            async with asyncio.timeout_at(self._deadline):
+                return await lines.__anext__()
+        # Python 3.11 之前：每次读取包一个 wait_for
+        try:
+            return await asyncio.wait_for(lines.__anext__(), max(0.0, self._deadline - self._loop.time()))
+        except asyncio.TimeoutError:
+            raise TimeoutError()
+
+
+def stream_timeout(timer: StreamTimer) -> StreamTimeout:
+    if timer.started:
+        _stats["idle_timeouts"] += 1
+        return StreamTimeout("上游流式输出空闲超时")
+    _stats["first_token_timeouts"] += 1
+    return StreamTimeout("上游首个 token 超时")
+
+
+# ================= 重试 =================
+
+def retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUS
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff(attempt: int) -> float:
+    """全抖动指数退避：[0, min(上限, 基数 × 2^attempt)) 内均匀取值，避免重试同时涌向上游"""
+    return random.uniform(0, min(LLM_RETRY_BACKOFF_MAX, LLM_RETRY_BACKOFF * (2 ** attempt)))
+
+
+def record_retry(route: str, exc: Exception):
+    _stats["retries"] += 1
+    reason = str(exc.response.status_code) if isinstance(exc, httpx.HTTPStatusError) else type(exc).__name__
+    metrics.llm_retries_total.inc(route, reason)
+
+
+# ================= 对冲 =================
+
+def observe(route: str, seconds: float):
+    window = _latency.get(route)
+    if window is None:
+        window = _latency[route] = deque(maxlen=_WINDOW)
+    window.append(seconds)
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * (len(ordered) - 1) + 0.5))] if ordered else 0.0
+
+
+def hedge_delay(route: str) -> float:
+    window = _latency.get(route)
+    if not window or len(window) < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return max(MIN_HEDGE_DELAY, _percentile(window, 95))
+
+
+async def hedged(
+    route: str,
+    send: Callable[[Any], Awaitable[Any]],
+    primary: Any,
+    backup: Callable[[], Any],
+) -> Tuple[Any, Any]:
+    """
+    先向 primary 发送；超过对冲延迟仍未返回时向 backup() 选出的目标再发一份
+    返回 (先成功的结果, 对应目标)；两份都失败时抛出后失败的异常
+    """
+    first = asyncio.ensure_future(send(primary))
+    targets = {first: primary}
+    try:
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay(route))
+        if done:
+            return first.result(), primary
+        target = backup()
+        second = asyncio.ensure_future(send(target))
+        targets[second] = target
+        _stats["hedges"] += 1
+        metrics.llm_hedges_total.inc(route, "sent")
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    if task is second:
+                        _stats["hedge_wins"] += 1
+                        metrics.llm_hedges_total.inc(route, "won")
+                    return task.result(), targets[task]
+        raise error
+    finally:
+        # 落后的一份直接取消，释放上游连接和节点的在途名额
+        for task in targets:
+            if not task.done():
+                task.cancel()
+
+
+def get_resilience_stats() -> Dict[str, Any]:
+    routes = {}
+    for route, window in _latency.items():
+        routes[route] = {
+            "count": len(window),
+            "p50_ms": round(_percentile(window, 50) * 1000, 1),
+            "p95_ms": round(_percentile(window, 95) * 1000, 1),
+            "p99_ms": round(_percentile(window, 99) * 1000, 1),
+            "hedge": policy_for(route).hedge,
+        }
+    return {**_stats, "routes": routes}
@@ -0,0 +1,253 @@
+# resumable.py
+"""
+可续传的流式生成
+- 生成在后台任务中进行，片段写入服务端缓冲，HTTP 响应只是缓冲的一个订阅者
+- 连接中断后客户端凭 stream id 续传：SSE 按 Last-Event-ID，纯文本按已收到的字节数；
+  生成仍在进行时直接接上，不再重新请求上游
+- 最后一个订阅者离开后保留 grace 秒（默认 RESUMABLE_GRACE，可按流指定），期间无人重连才取消上游
+  （沿用断开即停止解码的策略）
+- 缓冲有总量上限，生成结束后保留 RESUMABLE_TTL 秒；超限时只淘汰已结束或无人读取的流，
+  仍有人在读的流只丢弃所有订阅者都已读过的早期片段，不取消其上游
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from app.config import (
+    RESUMABLE_GRACE,
+    RESUMABLE_TTL,
+    RESUMABLE_MAX_STREAMS,
+    RESUMABLE_MAX_BYTES,
+)
+
+
+class StreamGone(Exception):
+    """stream id 不存在、已过期，或生成在无人连接时被取消"""
+
+    status_code = 410
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class _Buffer:
+    def __init__(self):
+        self.chunks: List[str] = []
+        # 已丢弃的早期片段数：chunks[i] 的序号是 base + i
+        self.base = 0
+        # offsets[i] 为序号 base + i 的片段之前的累计 UTF-8 字节数，用于按字节偏移续传
+        self.offsets: List[int] = [0]
+        # 每个订阅者下一个要读的片段序号，丢弃早期片段时不越过其中最小的一个
+        self.cursors: Dict[object, int] = {}
+        self.done = False
+        self.cancelled = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.grace: Optional[asyncio.TimerHandle] = None
+        # 无人连接时等待重连的秒数
+        self.grace_seconds = 0.0
+        # 与 singleflight 相同：每次有新数据就替换 Event，订阅者只等待当前这一个
+        self.changed = asyncio.Event()
+
+    @property
+    def size(self) -> int:
+        """缓冲中实际保留的字节数"""
+        return self.offsets[-1] - self.offsets[0]
+
+    @property
+    def end(self) -> int:
+        """下一个片段的序号"""
+        return self.base + len(self.chunks)
+
+    def notify(self):
+        event, self.changed = self.changed, asyncio.Event()
+        event.set()
+
+
+class ResumableStore:
+    def __init__(self, max_streams: int, max_bytes: int, ttl: float, grace: float):
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.grace = grace
+        self._buffers: "OrderedDict[str, _Buffer]" = OrderedDict()
+        self._bytes = 0
+        self.stats = {
+            "started": 0,
+            "resumed": 0,
+            "replayed_chunks": 0,
+            "cancelled_idle": 0,
+            "evicted": 0,
+            "expired": 0,
+            "trimmed_chunks": 0,
+        }
+
+    def start(self, stream: AsyncGenerator[str, None], grace: Optional[float] = None) -> str:
+        """在后台开始消费上游流，返回 stream id；grace 为空时用默认的重连等待时间"""
+        self._purge()
+        self._evict(incoming=1)
+        stream_id = uuid.uuid4().hex
+        buffer = _Buffer()
+        buffer.grace_seconds = self.grace if grace is None else grace
+        self._buffers[stream_id] = buffer
+        buffer.task = asyncio.ensure_future(self._pump(buffer, stream))
+        self.stats["started"] += 1
+        return stream_id
+
+    async def _pump(self, buffer: _Buffer, stream: AsyncGenerator[str, None]):
+        try:
+            async for chunk in stream:
+                buffer.chunks.append(chunk)
+                size = len(chunk.encode("utf-8"))
+                buffer.offsets.append(buffer.offsets[-1] + size)
+                self._bytes += size
+                buffer.notify()
+                if self._bytes > self.max_bytes:
+                    self._evict()
+        except asyncio.CancelledError:
+            buffer.cancelled = True
+        except Exception as e:
+            buffer.error = e
+        finally:
+            buffer.done = True
+            buffer.finished_at = time.monotonic()
+            buffer.notify()
+
+    def _drop(self, stream_id: str):
+        buffer = self._buffers.pop(stream_id)
+        self._bytes -= buffer.size
+        if buffer.grace is not None:
+            buffer.grace.cancel()
+        if not buffer.done:
+            buffer.task.cancel()
+        buffer.notify()
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [
+            sid for sid, b in self._buffers.items()
+            if b.done and b.subscribers == 0 and now - b.finished_at > self.ttl
+        ]
+        for sid in expired:
+            self._drop(sid)
+            self.stats["expired"] += 1
+
+    def _evict(self, incoming: int = 0):
+        # 先淘汰已结束且无人读取的，再淘汰正在等待重连的；有人在读的流不淘汰
+        def over() -> bool:
+            return len(self._buffers) + incoming > self.max_streams or self._bytes > self.max_bytes
+
+        for idle_only_done in (True, False):
+            victims = [
+                sid for sid, b in self._buffers.items()
+                if b.subscribers == 0 and (b.done or not idle_only_done)
+            ]
+            for sid in victims:
+                if not over():
+                    return
+                self._drop(sid)
+                self.stats["evicted"] += 1
+        if self._bytes > self.max_bytes:
+            self._trim()
+
+    def _trim(self):
+        # 剩下的都有人在读：从占用最多的开始，丢弃所有订阅者都已读过的片段，
+        # 之后从这些位置续传会收到 410；未读的片段保留，总量可能暂时超出上限
+        for buffer in sorted(self._buffers.values(), key=lambda b: b.size, reverse=True):
+            if self._bytes <= self.max_bytes:
+                break
+            keep_from = min(buffer.cursors.values(), default=buffer.end)
+            drop = keep_from - buffer.base
+            if drop <= 0:
+                continue
+            self._bytes -= buffer.offsets[drop] - buffer.offsets[0]
+            del buffer.chunks[:drop]
+            del buffer.offsets[:drop]
+            buffer.base = keep_from
+            self.stats["trimmed_chunks"] += drop
+
+    def _get(self, stream_id: str) -> _Buffer:
+        buffer = self._buffers.get(stream_id)
+        if buffer is None:
+            raise StreamGone("流已过期或不存在，请重新生成")
+        if buffer.cancelled:
+            raise StreamGone("生成已在连接断开后取消，请重新生成")
+        return buffer
+
+    def index_for_bytes(self, stream_id: str, offset: int) -> Tuple[int, int]:
+        """把字节偏移换算为 (片段下标, 该片段内需跳过的字节数)"""
+        buffer = self._get(stream_id)
+        offsets = buffer.offsets
+        offset = max(0, min(offset, offsets[-1]))
+        if offset < offsets[0]:
+            raise StreamGone("续传位置之前的内容已从缓冲中丢弃，请重新生成")
+        idx = 0
+        # offsets 单调递增，片段数有限，线性查找足够
+        while idx + 1 < len(offsets) and offsets[idx + 1] <= offset:
+            idx += 1
+        return buffer.base + idx, offset - offsets[idx]
+
+    async def subscribe(
+        self, stream_id: str, start: int = 0, resumed: bool = False
+    ) -> AsyncGenerator[Tuple[int, str], None]:
+        """从第 start 个片段开始产出 (序号, 片段)，生成仍在进行时持续跟随"""
+        buffer = self._get(stream_id)
+        if start < buffer.base:
+            raise StreamGone("续传位置之前的内容已从缓冲中丢弃，请重新生成")
+        if resumed:
+            self.stats["resumed"] += 1
+            self.stats["replayed_chunks"] += max(0, buffer.end - start)
+        buffer.subscribers += 1
+        if buffer.grace is not None:
+            buffer.grace.cancel()
+            buffer.grace = None
+        cursor = object()
+        idx = start
+        try:
+            while True:
+                changed = buffer.changed
+                while idx < buffer.end:
+                    buffer.cursors[cursor] = idx
+                    yield idx, buffer.chunks[idx - buffer.base]
+                    idx += 1
+                buffer.cursors[cursor] = idx
+                if buffer.done:
+                    break
+                await changed.wait()
+                if self._buffers.get(stream_id) is not buffer:
+                    raise StreamGone("流已被淘汰，请重新生成")
+            if buffer.error is not None:
+                raise buffer.error
+            if buffer.cancelled:
+                raise StreamGone("生成已被取消，请重新生成")
+        finally:
+            buffer.cursors.pop(cursor, None)
+            buffer.subscribers -= 1
+            if buffer.subscribers == 0 and not buffer.done:
+                buffer.grace = asyncio.get_running_loop().call_later(
+                    buffer.grace_seconds, self._cancel_idle, stream_id, buffer
+                )
+
+    def _cancel_idle(self, stream_id: str, buffer: _Buffer):
+        buffer.grace = None
+        if buffer.subscribers == 0 and not buffer.done and self._buffers.get(stream_id) is buffer:
+            buffer.task.cancel()
+            self.stats["cancelled_idle"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **self.stats,
+            "streams": len(self._buffers),
+            "running": sum(1 for b in self._buffers.values() if not b.done),
+            "bytes": self._bytes,
+        }
+
+
+resumable_store = ResumableStore(
+    RESUMABLE_MAX_STREAMS, RESUMABLE_MAX_BYTES, RESUMABLE_TTL, RESUMABLE_GRACE
+)
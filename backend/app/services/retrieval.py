@@ -0,0 +1,245 @@
+# retrieval.py
+"""
+参考资料的本地检索，替代只保留开头的截断
+- 切块：按句子边界聚合到 RETRIEVAL_CHUNK_TOKENS 左右
+- 索引：BM25；中文按相邻二字 (bigram) 切词，英文和数字按单词，不需要分词器、网络或 GPU
+- 索引按资料内容哈希缓存（LRU），同一份资料在多次请求间只构建一次；
+  也可以先通过 /materials 上传，之后只传 materialsId
+- 选取：按与查询（章节标题 + 写作要点等）的相关度装入预算，输出时恢复原文顺序
+- 裁剪 prompt 时遇到尚未建索引的大段资料，不在事件循环里同步构建：本次按开头截断，
+  索引在线程池里后台构建，之后引用同一份资料的请求按相关度选取
+"""
+import asyncio
+import hashlib
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import RETRIEVAL_CHUNK_TOKENS, RETRIEVAL_MAX_INDEXES
+from app.services.context_budget import count_tokens, truncate_to_tokens
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+SNIPPET_SEPARATOR = "\n……\n"
+# 不超过该长度（字符）的资料建索引只要几毫秒，选取时直接同步构建
+INLINE_BUILD_CHARS = 20000
+
+_TERM_RE = re.compile(r"[\u3400-\u9fff]+|[a-z0-9]+")
+# 句子边界（零宽切分，保留原文的全部字符）：中文句末标点、英文句号加空格、换行
+_SENTENCE_RE = re.compile(r"(?<=[。！？；!?;\n])|(?<=\. )")
+
+
+class MaterialsNotFound(Exception):
+    status_code = 404
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+def terms(text: str) -> List[str]:
+    result = []
+    for match in _TERM_RE.finditer(text.lower()):
+        run = match.group()
+        if run.isascii() or len(run) == 1:
+            result.append(run)
+        else:
+            result.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return result
+
+
+def chunk_text(text: str, chunk_tokens: int = RETRIEVAL_CHUNK_TOKENS) -> List[str]:
+    """按句子聚合成块；单句超长时整句成块（选取时再由预算截断）"""
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for sentence in _SENTENCE_RE.split(text):
+        if not sentence.strip():
+            if current:
+                current.append(sentence)
+            continue
+        tokens = count_tokens(sentence)
+        if current and size + tokens > chunk_tokens:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += tokens
+    if current:
+        chunks.append("".join(current))
+    return [c.strip() for c in chunks]
+
+
+class MaterialsIndex:
+    def __init__(self, text: str, chunk_tokens: int = RETRIEVAL_CHUNK_TOKENS):
+        start = time.perf_counter()
+        self.text = text
+        self.chunks = chunk_text(text, chunk_tokens)
+        self.chunk_tokens = [count_tokens(c) for c in self.chunks]
+        # 倒排表：term -> [(块下标, 词频)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+        for idx, chunk in enumerate(self.chunks):
+            counts = Counter(terms(chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((idx, tf))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        n = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self.postings.items()
+        }
+        self.build_ms = (time.perf_counter() - start) * 1000
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.chunk_tokens)
+
+    def scores(self, query: str) -> List[float]:
+        result = [0.0] * len(self.chunks)
+        if not self.avg_length:
+            return result
+        for term, qtf in Counter(terms(query)).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for idx, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[idx] / self.avg_length)
+                result[idx] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return result
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float, str]]:
+        scored = sorted(enumerate(self.scores(query)), key=lambda x: (-x[1], x[0]))
+        return [(idx, round(score, 3), self.chunks[idx]) for idx, score in scored[:k] if score > 0]
+
+    def select(self, query: str, max_tokens: int) -> str:
+        """
+        按相关度装入 max_tokens；无关的块按原文顺序补足剩余预算，最后按原文顺序拼接
+        """
+        order = sorted(enumerate(self.scores(query)), key=lambda x: (-x[1], x[0]))
+        chosen = []
+        remaining = max_tokens
+        for idx, _ in order:
+            tokens = self.chunk_tokens[idx]
+            if tokens <= remaining:
+                chosen.append(idx)
+                remaining -= tokens
+        if not chosen:
+            # 每一块都比预算大：截取最相关的一块
+            return truncate_to_tokens(self.chunks[order[0][0]], max_tokens) if order else ""
+        chosen.sort()
+        parts = []
+        for i, idx in enumerate(chosen):
+            # 不相邻的块之间加省略标记，提示模型这里跳过了内容
+            if i and idx != chosen[i - 1] + 1:
+                parts.append(SNIPPET_SEPARATOR)
+            parts.append(self.chunks[idx])
+        return "".join(parts)
+
+
+class MaterialsStore:
+    def __init__(self, max_indexes: int):
+        self.max_indexes = max_indexes
+        self._indexes: "OrderedDict[str, MaterialsIndex]" = OrderedDict()
+        # 后台构建中的索引，避免同一份资料重复提交
+        self._building: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "built": 0, "reused": 0, "queries": 0, "build_ms": 0.0, "query_ms": 0.0,
+            "background_builds": 0, "head_fallbacks": 0,
+        }
+
+    @staticmethod
+    def materials_id(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def ingest(self, text: str) -> Tuple[str, MaterialsIndex]:
+        """同一份资料只构建一次索引"""
+        materials_id = self.materials_id(text)
+        index = self._indexes.get(materials_id)
+        if index is not None:
+            self._indexes.move_to_end(materials_id)
+            self.stats["reused"] += 1
+            return materials_id, index
+        index = MaterialsIndex(text)
+        self._add(materials_id, index)
+        return materials_id, index
+
+    def _add(self, materials_id: str, index: MaterialsIndex):
+        self._indexes[materials_id] = index
+        self.stats["built"] += 1
+        self.stats["build_ms"] += index.build_ms
+        while len(self._indexes) > self.max_indexes:
+            self._indexes.popitem(last=False)
+
+    async def ingest_async(self, text: str) -> Tuple[str, MaterialsIndex]:
+        """上传接口用：大段资料在线程池里构建索引，不阻塞事件循环"""
+        materials_id = self.materials_id(text)
+        if materials_id not in self._indexes:
+            index = await asyncio.to_thread(MaterialsIndex, text)
+            if materials_id not in self._indexes:
+                self._add(materials_id, index)
+        return self.ingest(text)
+
+    def get(self, materials_id: str) -> MaterialsIndex:
+        index = self._indexes.get(materials_id)
+        if index is None:
+            raise MaterialsNotFound("参考资料不存在或已过期，请重新上传")
+        self._indexes.move_to_end(materials_id)
+        return index
+
+    def resolve(self, text: str, materials_id: Optional[str]) -> str:
+        """请求里只带 materialsId 时取回原文，两者都带时以原文为准"""
+        if text or not materials_id:
+            return text
+        return self.get(materials_id).text
+
+    def _build_in_background(self, materials_id: str, text: str) -> bool:
+        """在事件循环里时提交后台构建并返回 True；没有运行中的事件循环时返回 False，由调用方同步构建"""
+        if materials_id in self._building:
+            return True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        task = loop.create_task(self.ingest_async(text))
+        self._building[materials_id] = task
+        self.stats["background_builds"] += 1
+
+        def done(t: asyncio.Task):
+            self._building.pop(materials_id, None)
+            if not t.cancelled() and t.exception() is not None:
+                print(f"[Retrieval Warn] 资料索引构建失败: {t.exception()}")
+
+        task.add_done_callback(done)
+        return True
+
+    def selector(self, query: str) -> Callable[[str, int], str]:
+        """给 context_budget.Part 用的选取函数：资料放不下时按相关度选块而不是截取开头"""
+        def select(text: str, max_tokens: int) -> str:
+            materials_id = self.materials_id(text)
+            if (
+                materials_id not in self._indexes
+                and len(text) > INLINE_BUILD_CHARS
+                and self._build_in_background(materials_id, text)
+            ):
+                self.stats["head_fallbacks"] += 1
+                return truncate_to_tokens(text, max_tokens)
+            _, index = self.ingest(text)
+            start = time.perf_counter()
+            result = index.select(query, max_tokens)
+            self.stats["queries"] += 1
+            self.stats["query_ms"] += (time.perf_counter() - start) * 1000
+            return result
+        return select
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            **{k: round(v, 1) if isinstance(v, float) else v for k, v in self.stats.items()},
+            "indexes": len(self._indexes),
+        }
+
+
+materials_store = MaterialsStore(RETRIEVAL_MAX_INDEXES)
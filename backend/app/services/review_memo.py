@@ -0,0 +1,54 @@
+# review_memo.py
+"""
+单节评审结果的记忆
+- 键为 (模型, 评审模板, 章节标题, 正文哈希)，即评审 prompt 实际用到的全部输入；模板改动后旧结果自然失效
+- 值为清洗后的评审结果 (normalize_review_data 的输出)，只记住解析成功的结果
+- 与 LLM 响应缓存相互独立：命中时省去 JSON 解析，且不受请求里其他字段的影响
+"""
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from app.config import REVIEW_MEMO_ENABLED, REVIEW_MEMO_TTL, REVIEW_MEMO_MAX_BYTES
+from app.services.llm_cache import MemoryLRU
+from app.services.prompts import get_template
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ReviewMemo:
+    def __init__(self, max_bytes: int, ttl: float, enabled: bool = True):
+        self.enabled = enabled
+        self._lru = MemoryLRU(max_bytes, ttl)
+        self.stats = {"hits": 0, "misses": 0, "stored": 0}
+
+    def key(self, model: str, template: str, title: str, content: str) -> str:
+        tpl = get_template(template)
+        return _digest(json.dumps(
+            [model, _digest(f"{tpl.system or ''}\n{tpl.text}"), title, _digest(content)],
+            ensure_ascii=False,
+        ))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        value = self._lru.get(key)
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return json.loads(value)
+
+    def set(self, key: str, result: Dict[str, Any]):
+        if not self.enabled:
+            return
+        self._lru.set(key, json.dumps(result, ensure_ascii=False))
+        self.stats["stored"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "entries": len(self._lru), "bytes": self._lru.size}
+
+
+review_memo = ReviewMemo(REVIEW_MEMO_MAX_BYTES, REVIEW_MEMO_TTL, REVIEW_MEMO_ENABLED)
@@ -0,0 +1,172 @@
+# scheduler.py
+"""
+上游推理服务的准入控制与优先级调度
+- 全局限制同时在途的上游请求数
+- 四个优先级：交互式流 > 短 JSON 调用 > 长文批量生成 > 后台任务
+- 每个优先级有独立的排队上限，排满立即拒绝 (429)，排队超时返回 503；
+  后台任务 (job) 没有 HTTP 请求在等，不设上限也不超时，只在空闲时拿到名额
+- 同一优先级内按客户端轮转，避免单个用户的批量任务占满队列
+"""
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List
+
+from app.config import LLM_MAX_INFLIGHT, LLM_QUEUE_LIMITS, LLM_QUEUE_TIMEOUT
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_JSON = 1
+PRIORITY_BATCH = 2
+PRIORITY_JOB = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_JSON: "json",
+    PRIORITY_BATCH: "batch",
+    PRIORITY_JOB: "job",
+}
+# 只排队、不拒绝也不超时的优先级
+UNBOUNDED = {PRIORITY_JOB}
+
+# 由路由层依赖注入写入，调度器据此做按客户端的公平排队
+current_client: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_client", default="anonymous"
+)
+
+
+class SchedulerRejected(Exception):
+    status_code = 503
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class QueueFullError(SchedulerRejected):
+    status_code = 429
+
+
+class QueueTimeoutError(SchedulerRejected):
+    status_code = 503
+
+
+class Scheduler:
+    def __init__(self, max_inflight: int, queue_limits: Dict[str, int], queue_timeout: float):
+        self.max_inflight = max_inflight
+        self.queue_limits = queue_limits
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # priority -> client_id -> 等待中的 Future 队列
+        self._queues: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            p: OrderedDict() for p in PRIORITY_NAMES
+        }
+        self._depth: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+        self._waits: Dict[int, Deque[float]] = {p: deque(maxlen=500) for p in PRIORITY_NAMES}
+        self._admitted: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+        self._rejected: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+        self._timeouts: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+
+    def _has_waiters(self) -> bool:
+        return any(self._depth.values())
+
+    async def acquire(self, priority: int):
+        name = PRIORITY_NAMES[priority]
+        if self.in_flight < self.max_inflight and not self._has_waiters():
+            self.in_flight += 1
+            self._record_wait(priority, 0.0)
+            return
+
+        unbounded = priority in UNBOUNDED
+        if not unbounded and self._depth[priority] >= self.queue_limits.get(name, 0):
+            self._rejected[priority] += 1
+            raise QueueFullError(f"推理队列已满 ({name})，请稍后重试")
+
+        client = current_client.get()
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(client, deque()).append(fut)
+        self._depth[priority] += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), None if unbounded else self.queue_timeout)
+        except asyncio.TimeoutError:
+            if fut.done():
+                # 超时与分配同时发生，已经拿到名额，直接使用
+                self._record_wait(priority, time.perf_counter() - start)
+                return
+            self._dequeue(priority, client, fut)
+            fut.cancel()
+            self._timeouts[priority] += 1
+            raise QueueTimeoutError(f"推理队列等待超时 ({name})，请稍后重试")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已被分配名额但调用方放弃了，归还名额
+                self.release()
+            else:
+                self._dequeue(priority, client, fut)
+                fut.cancel()
+            raise
+        self._record_wait(priority, time.perf_counter() - start)
+
+    def _record_wait(self, priority: int, seconds: float):
+        self._admitted[priority] += 1
+        self._waits[priority].append(seconds)
+
+    def _dequeue(self, priority: int, client: str, fut: asyncio.Future):
+        queue = self._queues[priority].get(client)
+        if queue is None or fut not in queue:
+            return
+        queue.remove(fut)
+        self._depth[priority] -= 1
+        if not queue:
+            del self._queues[priority][client]
+
+    def release(self):
+        self.in_flight -= 1
+        # 名额直接交接给下一个等待者：优先级高的先，同优先级按客户端轮转
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            while clients:
+                client, queue = next(iter(clients.items()))
+                fut = queue.popleft()
+                self._depth[priority] -= 1
+                if queue:
+                    clients.move_to_end(client)
+                else:
+                    del clients[client]
+                if fut.done():
+                    continue
+                self.in_flight += 1
+                fut.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self) -> Dict[str, object]:
+        classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            waits: List[float] = sorted(self._waits[priority])
+            classes[name] = {
+                "queue_depth": self._depth[priority],
+                "queue_limit": None if priority in UNBOUNDED else self.queue_limits.get(name, 0),
+                "rejected": self._rejected[priority],
+                "timeouts": self._timeouts[priority],
+                "admitted": self._admitted[priority],
+                "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "wait_p95_ms": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 1) if waits else 0.0,
+            }
+        return {
+            "in_flight": self.in_flight,
+            "max_inflight": self.max_inflight,
+            "classes": classes,
+        }
+
+
+scheduler = Scheduler(LLM_MAX_INFLIGHT, LLM_QUEUE_LIMITS, LLM_QUEUE_TIMEOUT)
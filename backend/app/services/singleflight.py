@@ -0,0 +1,114 @@
+# singleflight.py
+"""
+相同请求合并 (single-flight)：并发的相同调用只向上游发一次
+- do(): 非流式调用共享同一个上游 Task
+- stream(): 一个上游 SSE 流扇出给多个订阅者，后加入者先回放已缓冲的前缀
+"""
+import asyncio
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+
+class _Broadcast:
+    """一路上游流的共享状态"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # 每次有新数据就替换成新的 Event，订阅者只需等待当前这一个
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        event, self.changed = self.changed, asyncio.Event()
+        event.set()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self.stats = {
+            "call_origin": 0,
+            "call_coalesced": 0,
+            "stream_origin": 0,
+            "stream_coalesced": 0,
+        }
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        task = self._calls.get(key)
+        if task is None:
+            self.stats["call_origin"] += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish_call(key, t))
+        else:
+            self.stats["call_coalesced"] += 1
+        # shield：某个等待者被取消时不影响其他等待者
+        return await asyncio.shield(task)
+
+    def _finish_call(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已离开时，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncGenerator[str, None]],
+    ) -> AsyncGenerator[str, None]:
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.stats["stream_origin"] += 1
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, factory))
+        else:
+            self.stats["stream_coalesced"] += 1
+
+        broadcast.subscribers += 1
+        idx = 0
+        try:
+            while True:
+                changed = broadcast.changed
+                while idx < len(broadcast.chunks):
+                    yield broadcast.chunks[idx]
+                    idx += 1
+                if broadcast.done:
+                    break
+                await changed.wait()
+            if broadcast.error is not None:
+                raise broadcast.error
+        finally:
+            broadcast.subscribers -= 1
+            # 最后一个订阅者离开时不再继续向上游拉流
+            if broadcast.subscribers == 0 and not broadcast.done:
+                broadcast.task.cancel()
+
+    async def _pump(
+        self,
+        key: str,
+        broadcast: _Broadcast,
+        factory: Callable[[], AsyncGenerator[str, None]],
+    ):
+        try:
+            async for chunk in factory():
+                broadcast.chunks.append(chunk)
+                broadcast.notify()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            broadcast.notify()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **self.stats,
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+        }
@@ -0,0 +1,209 @@
+# stream_control.py
+"""
+流式响应的提前终止
+- 浏览器断开：单独监听 http.disconnect，立即停止读取上游（不必等下一次 send 失败）
+- 会话内取代 (supersede)：同一编辑会话在同一路由上发起新请求时，取消上一条仍在生成的流
+- WebSocket 通道中的操作没有 HTTP 请求：由 current_operation 提供路由与会话，
+  取消即操作任务被取消 (in-band cancel 或通道关闭)，记为 cancelled_client
+停止读取后 single-flight 的订阅者随之离开，最后一个订阅者离开时上游 httpx 流被关闭，推理服务停止解码
+"""
+import asyncio
+import contextvars
+import functools
+from typing import AsyncGenerator, Awaitable, Callable, Dict, Optional
+
+from fastapi import Request
+
+from app.config import STREAM_SUPERSEDE_ROUTES
+from app.services.context_budget import estimate_tokens
+from app.services.metrics import route_key
+
+# 各路由完整生成的平均 token 数（指数滑动平均），用于估算提前终止节省的 token
+AVG_ALPHA = 0.2
+
+# 由路由层依赖注入写入，流式响应据此监听断开、识别路由与会话
+current_request: contextvars.ContextVar[Optional[Request]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+class Operation:
+    """WebSocket 通道中的一次逻辑调用，代替 HTTP 请求提供路由路径与编辑会话"""
+    __slots__ = ("path", "session_id")
+
+    def __init__(self, path: str, session_id: Optional[str]):
+        self.path = path
+        self.session_id = session_id
+
+
+current_operation: contextvars.ContextVar[Optional[Operation]] = contextvars.ContextVar(
+    "current_operation", default=None
+)
+
+
+class _Control:
+    __slots__ = ("cancelled", "reason", "default_reason")
+
+    def __init__(self, default_reason: str):
+        self.cancelled = asyncio.Event()
+        self.reason = ""
+        # 生成器被直接关闭或所在任务被取消（没有经过 cancel）时记录的原因
+        self.default_reason = default_reason
+
+    def cancel(self, reason: str):
+        if not self.cancelled.is_set():
+            self.reason = reason
+            self.cancelled.set()
+
+
+_active: Dict[str, _Control] = {}
+_avg_tokens: Dict[str, float] = {}
+_stats = {
+    "completed": 0,
+    "cancelled_disconnect": 0,
+    "cancelled_superseded": 0,
+    "cancelled_client": 0,
+    "tokens_saved_est": 0,
+}
+
+
+def guard_stream(
+    stream: AsyncGenerator[str, None],
+    supersede_key: Optional[str] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    在路由内调用（需要当前请求或通道操作的上下文）
+    supersede_key 为空时，配置在 STREAM_SUPERSEDE_ROUTES 中的路由按 X-Session-Id 自动取代
+    """
+    request = current_request.get()
+    operation = current_operation.get()
+    if request is not None:
+        route, session_id = route_key(request.url.path), request.headers.get("X-Session-Id")
+        control = _Control("disconnect")
+        watch = functools.partial(_watch_disconnect, request, control)
+    elif operation is not None:
+        route, session_id = route_key(operation.path), operation.session_id
+        control = _Control("client")
+        watch = None
+    else:
+        return stream
+
+    if supersede_key is None and route in STREAM_SUPERSEDE_ROUTES:
+        if session_id:
+            supersede_key = f"{session_id}:{route}"
+    if supersede_key:
+        previous = _active.get(supersede_key)
+        if previous is not None:
+            previous.cancel("superseded")
+        _active[supersede_key] = control
+
+    return _guarded(stream, watch, route, control, supersede_key)
+
+
+async def _watch_disconnect(request: Request, control: _Control):
+    while not control.cancelled.is_set():
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            control.cancel("disconnect")
+            return
+
+
+# 上游流在 pump 任务中的结局，经队列交给下发方
+_END = object()
+_CANCELLED = object()
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+async def _pump(stream: AsyncGenerator[str, None], queue: "asyncio.Queue"):
+    """整条流只用这一个任务读取上游；被取消时读取中断，异常沿生成器链传播并关闭 httpx 流"""
+    try:
+        async for chunk in stream:
+            await queue.put(chunk)
+        outcome = _END
+    except asyncio.CancelledError:
+        outcome = _CANCELLED
+    except Exception as e:
+        outcome = _Failure(e)
+    finally:
+        await stream.aclose()
+    if outcome is _CANCELLED:
+        # 取消后不再下发：丢掉没来得及取走的片段，让下发方立即醒来
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(outcome)
+    else:
+        await queue.put(outcome)
+
+
+async def _cancel_on(control: _Control, pump: asyncio.Task):
+    await control.cancelled.wait()
+    pump.cancel()
+
+
+async def _guarded(
+    stream: AsyncGenerator[str, None],
+    watch: Optional[Callable[[], Awaitable[None]]],
+    route: str,
+    control: _Control,
+    supersede_key: Optional[str],
+) -> AsyncGenerator[str, None]:
+    # 容量为 1：下发慢时 pump 停在 put 上，背压传回上游读取
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    pump = asyncio.ensure_future(_pump(stream, queue))
+    watcher = asyncio.ensure_future(watch()) if watch is not None else None
+    canceller = asyncio.ensure_future(_cancel_on(control, pump))
+    tokens = 0
+    finished = False
+    failed = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                finished = True
+                break
+            if item is _CANCELLED:
+                break
+            if isinstance(item, _Failure):
+                failed = True
+                raise item.error
+            # 片段经 coalesce 合并后长短不一，按下发文本的 token 数计
+            tokens += estimate_tokens(item)
+            yield item
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        canceller.cancel()
+        pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)
+        # pump 尚未开始运行就被取消时流没有被关闭过
+        await stream.aclose()
+        if supersede_key and _active.get(supersede_key) is control:
+            del _active[supersede_key]
+        if not failed:
+            _record(route, tokens, finished, control)
+
+
+def _record(route: str, tokens: int, finished: bool, control: _Control):
+    if finished:
+        _stats["completed"] += 1
+        prev = _avg_tokens.get(route)
+        _avg_tokens[route] = tokens if prev is None else prev + AVG_ALPHA * (tokens - prev)
+        return
+    reason = control.reason or control.default_reason
+    _stats[f"cancelled_{reason}"] += 1
+    # 按该路由完整生成的平均长度估算未解码的部分
+    _stats["tokens_saved_est"] += max(0, round(_avg_tokens.get(route, 0) - tokens))
+
+
+def get_stream_stats() -> Dict[str, object]:
+    return {
+        **_stats,
+        "active_supersede_keys": len(_active),
+        "avg_tokens": {k: round(v, 1) for k, v in _avg_tokens.items()},
+    }
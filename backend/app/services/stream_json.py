@@ -0,0 +1,119 @@
+# stream_json.py
+"""
+增量、宽容的流式 JSON 解析器
+边接收 LLM 的流式输出边扫描括号/字符串状态，某个被关注路径上的值一闭合就立即产出，
+不必等整段回答结束再 repair_json
+"""
+import json
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+from json_repair import repair_json
+
+PathItem = Union[int, str]
+Path = Tuple[PathItem, ...]
+
+
+class _Frame:
+    __slots__ = ("kind", "start", "key", "index", "expecting_key")
+
+    def __init__(self, kind: str, start: int):
+        self.kind = kind          # "obj" 或 "arr"
+        self.start = start        # 在缓冲区中的起始下标
+        self.key: Optional[str] = None
+        self.index = 0
+        self.expecting_key = kind == "obj"
+
+
+def _parse_value(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return repair_json(text, return_objects=True)
+
+
+class IncrementalJSONParser:
+    """
+    watch(path) 返回 True 的位置上，值（对象 / 数组 / 字符串）闭合时即从 feed() 产出
+    路径由数组下标 (int) 与对象键 (str) 组成，例如 (0, "children", 1)
+    根容器之前的内容（如 ```json 代码块标记或开场白）会被跳过
+    """
+
+    def __init__(self, watch: Callable[[Path], bool]):
+        self.watch = watch
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._started = False
+        self.finished = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+
+    def _current_path(self) -> Path:
+        path: List[PathItem] = []
+        for frame in self._stack:
+            path.append(frame.index if frame.kind == "arr" else frame.key)
+        return tuple(path)
+
+    def feed(self, text: str) -> List[Tuple[Path, Any]]:
+        self.buffer += text
+        out: List[Tuple[Path, Any]] = []
+        buf = self.buffer
+        i = self._pos
+        n = len(buf)
+        while i < n and not self.finished:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._close_string(buf, i, out)
+                i += 1
+                continue
+
+            if not self._started:
+                if ch in "[{":
+                    self._started = True
+                    self._stack.append(_Frame("arr" if ch == "[" else "obj", i))
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "[{":
+                self._stack.append(_Frame("arr" if ch == "[" else "obj", i))
+            elif ch in "]}":
+                frame = self._stack.pop()
+                path = self._current_path()
+                if self._stack and self.watch(path):
+                    out.append((path, _parse_value(buf[frame.start:i + 1])))
+                if not self._stack:
+                    self.finished = True
+            elif ch == ":":
+                if self._stack and self._stack[-1].kind == "obj":
+                    self._stack[-1].expecting_key = False
+            elif ch == ",":
+                frame = self._stack[-1]
+                if frame.kind == "arr":
+                    frame.index += 1
+                else:
+                    frame.expecting_key = True
+            i += 1
+        self._pos = i
+        return out
+
+    def _close_string(self, buf: str, end: int, out: List[Tuple[Path, Any]]):
+        if not self._stack:
+            return
+        raw = buf[self._string_start:end + 1]
+        frame = self._stack[-1]
+        if frame.kind == "obj" and frame.expecting_key:
+            frame.key = _parse_value(raw)
+            return
+        path = self._current_path()
+        if self.watch(path):
+            out.append((path, _parse_value(raw)))
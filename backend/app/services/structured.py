@@ -0,0 +1,83 @@
+# structured.py
+"""
+结构化输出：把 schemas.py 中的返回结构转成 JSON Schema，作为约束解码参数发给上游
+- 上游按 schema 解码时输出必然是合法 JSON，解析端直接 json.loads，不再走 repair_json 与字段名猜测
+- 上游拒绝约束参数（400 / 422）时去掉参数重试；重试成功则按节点记为不支持，
+  解析端的修复逻辑继续兜底
+"""
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+from pydantic import TypeAdapter
+
+from app.config import LLM_STRUCTURED_OUTPUT
+from app.schemas import (
+    ContextualGuideOutput,
+    EditScriptOutput,
+    GlobalGuideOutput,
+    OutlineChapterOutput,
+    ReviewOutput,
+    SuggestionsOutput,
+    WritingPointOutput,
+)
+
+MODES = ("json_schema", "guided_json", "json_object", "off")
+
+
+class OutputSchema:
+    def __init__(self, name: str, type_: Any):
+        self.name = name
+        self.schema = TypeAdapter(type_).json_schema()
+        self.is_object = self.schema.get("type") == "object"
+
+
+OUTLINE = OutputSchema("outline", List[OutlineChapterOutput])
+REVIEW = OutputSchema("review", ReviewOutput)
+SUGGESTIONS = OutputSchema("suggestions", SuggestionsOutput)
+GLOBAL_GUIDE = OutputSchema("global_guide", GlobalGuideOutput)
+CONTEXTUAL_GUIDE = OutputSchema("contextual_guide", ContextualGuideOutput)
+POINTS = OutputSchema("points", List[WritingPointOutput])
+STRING_LIST = OutputSchema("string_list", List[str])
+EDIT_SCRIPT = OutputSchema("edit_script", EditScriptOutput)
+
+_unsupported: Set[str] = set()
+_stats = {"constrained": 0, "rejected": 0}
+
+
+def request_params(schema: Optional[OutputSchema], endpoint_url: str) -> Dict[str, Any]:
+    """本次请求需要附加到 payload 的约束解码参数；不适用时返回空字典"""
+    mode = LLM_STRUCTURED_OUTPUT
+    if schema is None or mode not in MODES or mode == "off" or endpoint_url in _unsupported:
+        return {}
+    if mode == "json_object":
+        if not schema.is_object:
+            return {}
+        params = {"response_format": {"type": "json_object"}}
+    elif mode == "guided_json":
+        params = {"guided_json": schema.schema}
+    else:
+        params = {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": schema.name, "schema": schema.schema},
+        }}
+    _stats["constrained"] += 1
+    return params
+
+
+def rejected(exc: Exception, params: Dict[str, Any]) -> bool:
+    """带约束参数的请求被上游拒绝 (400 / 422)：调用方去掉参数重试一次"""
+    if not params or not isinstance(exc, httpx.HTTPStatusError):
+        return False
+    if exc.response.status_code not in (400, 422):
+        return False
+    _stats["rejected"] += 1
+    return True
+
+
+def mark_unsupported(endpoint_url: str):
+    """去掉参数后重试成功，说明 400 确实来自约束参数：该节点之后不再发送"""
+    _unsupported.add(endpoint_url)
+
+
+def get_structured_stats() -> Dict[str, Any]:
+    return {**_stats, "mode": LLM_STRUCTURED_OUTPUT, "unsupported_endpoints": sorted(_unsupported)}
@@ -0,0 +1,204 @@
+# upstreams.py
+"""
+多个推理服务之间的负载均衡
+- 每个节点可配置权重和可服务的模型列表（为空表示全部模型）
+- 选点策略：least_outstanding 按 (在途请求数 + 1) / 权重；latency 再乘以延迟的滑动平均
+- 熔断：连续失败 LLM_CIRCUIT_FAILURES 次后摘除节点 LLM_CIRCUIT_COOLDOWN 秒，
+  冷却结束后放行一个探测请求（半开），成功即恢复；
+  所有节点都被摘除时（单节点部署尤为常见）不直接拒绝，退回到最接近恢复的节点
+- 主动健康检查：后台定期探测各节点，失败的节点不参与选点
+"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+
+import httpx
+
+from app.config import (
+    LLM_ENDPOINTS,
+    LLM_LB_STRATEGY,
+    LLM_CIRCUIT_FAILURES,
+    LLM_CIRCUIT_COOLDOWN,
+    LLM_HEALTH_PATH,
+    LLM_HEALTH_INTERVAL,
+)
+from app.services.scheduler import SchedulerRejected
+
+# 延迟滑动平均的权重；新节点按该初值参与选点，避免冷启动时被饿死
+LATENCY_ALPHA = 0.2
+INITIAL_LATENCY = 1.0
+HEALTH_TIMEOUT = 2.0
+
+
+class UpstreamUnavailable(SchedulerRejected):
+    status_code = 503
+
+
+class Endpoint:
+    def __init__(self, url: str, weight: float = 1.0, models: Optional[List[str]] = None, api_key: str = ""):
+        self.url = url.rstrip("/")
+        self.weight = max(float(weight), 0.01)
+        self.models: Set[str] = set(models or [])
+        self.api_key = api_key
+        self.outstanding = 0
+        self.latency = INITIAL_LATENCY
+        self.failures = 0
+        self.open_until = 0.0
+        self.half_open = False
+        self.healthy = True
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.url}/v1/chat/completions"
+
+    def serves(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.open_until > now:
+            return False
+        # 冷却结束后只放行一个探测请求
+        return not (self.half_open and self.outstanding > 0)
+
+    def score(self, strategy: str) -> float:
+        load = (self.outstanding + 1) / self.weight
+        return load * self.latency if strategy == "latency" else load
+
+    def record_success(self, latency: float):
+        self.latency += LATENCY_ALPHA * (latency - self.latency)
+        self.failures = 0
+        self.half_open = False
+        self.open_until = 0.0
+
+    def record_failure(self, cooldown: float, threshold: int):
+        self.errors += 1
+        self.failures += 1
+        if self.half_open or self.failures >= threshold:
+            self.open_until = time.monotonic() + cooldown
+            self.half_open = True
+
+    def get_stats(self) -> Dict[str, object]:
+        now = time.monotonic()
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "models": sorted(self.models),
+            "healthy": self.healthy,
+            "circuit": "open" if self.open_until > now else ("half_open" if self.half_open else "closed"),
+            "outstanding": self.outstanding,
+            "latency_ewma_ms": round(self.latency * 1000, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class UpstreamPool:
+    def __init__(self, endpoints: List[Endpoint], strategy: str, failures: int, cooldown: float):
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.failures = failures
+        self.cooldown = cooldown
+        self.stats = {"retries": 0, "unavailable": 0, "fallbacks": 0}
+        self._health_task: Optional[asyncio.Task] = None
+
+    def pick(self, model: str, exclude: Set[Endpoint] = frozenset()) -> Endpoint:
+        now = time.monotonic()
+        serving = [e for e in self.endpoints if e not in exclude and e.serves(model)]
+        candidates = [e for e in serving if e.available(now)]
+        if candidates:
+            return min(candidates, key=lambda e: e.score(self.strategy))
+        if not serving:
+            self.stats["unavailable"] += 1
+            raise UpstreamUnavailable(f"没有可用的推理节点 ({model})，请稍后重试")
+        # 熔断只在有其他节点可切换时才有意义：全部摘除时拒绝请求等于整体停服，
+        # 选健康检查通过、熔断最早到期的节点继续尝试，成功即关闭熔断
+        self.stats["fallbacks"] += 1
+        return min(serving, key=lambda e: (not e.healthy, e.open_until, e.score(self.strategy)))
+
+    def has_alternative(self, model: str, exclude: Set[Endpoint]) -> bool:
+        now = time.monotonic()
+        return any(
+            e not in exclude and e.serves(model) and e.available(now) for e in self.endpoints
+        )
+
+    @asynccontextmanager
+    async def use(self, endpoint: Endpoint):
+        """占用节点的一个在途名额；结果由调用方通过 success / failure 上报"""
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        try:
+            yield endpoint
+        finally:
+            endpoint.outstanding -= 1
+
+    def success(self, endpoint: Endpoint, latency: float):
+        endpoint.record_success(latency)
+
+    def failure(self, endpoint: Endpoint):
+        endpoint.record_failure(self.cooldown, self.failures)
+
+    # ================= 主动健康检查 =================
+
+    async def _probe(self, client: httpx.AsyncClient, endpoint: Endpoint):
+        try:
+            resp = await client.get(f"{endpoint.url}{LLM_HEALTH_PATH}", timeout=HEALTH_TIMEOUT)
+            # 服务端没有该路径 (404) 也说明进程存活
+            endpoint.healthy = resp.status_code < 500
+        except httpx.HTTPError:
+            endpoint.healthy = False
+
+    async def _health_loop(self):
+        # 探测使用独立的短连接 client，不占用调用上游的连接池
+        async with httpx.AsyncClient() as client:
+            while True:
+                await asyncio.gather(*(self._probe(client, e) for e in self.endpoints))
+                await asyncio.sleep(LLM_HEALTH_INTERVAL)
+
+    def start_health_checks(self):
+        # 单节点时没有可切换的目标，交给熔断处理即可
+        if LLM_HEALTH_INTERVAL > 0 and len(self.endpoints) > 1 and self._health_task is None:
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            **self.stats,
+            "strategy": self.strategy,
+            "endpoints": [e.get_stats() for e in self.endpoints],
+        }
+
+
+def _parse_endpoints(raw: str) -> List[Endpoint]:
+    """
+    LLM_ENDPOINTS 为 JSON 数组：[{"url": ..., "weight": 2, "models": [...], "apiKey": ...}]
+    也可以是逗号分隔的 URL 列表（权重均为 1，服务全部模型）
+    """
+    raw = raw.strip()
+    if raw.startswith("["):
+        return [
+            Endpoint(e["url"], e.get("weight", 1), e.get("models"), e.get("apiKey", ""))
+            for e in json.loads(raw)
+        ]
+    return [Endpoint(url.strip()) for url in raw.split(",") if url.strip()]
+
+
+upstream_pool = UpstreamPool(
+    _parse_endpoints(LLM_ENDPOINTS),
+    LLM_LB_STRATEGY,
+    LLM_CIRCUIT_FAILURES,
+    LLM_CIRCUIT_COOLDOWN,
+)
@@ -0,0 +1 @@
+# 后端性能基准与本地 mock 推理服务
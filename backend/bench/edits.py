@@ -0,0 +1,97 @@
+# edits.py
+"""
+编辑脚本输出的基准：小范围修改时整段重写与编辑脚本 (editScript=true) 的延迟和输出字符数
+- 进程内启动 bench.mock_server（MOCK_ECHO 打开：整段重写的输出与原文等长），
+  通过 ASGI 直接调用 /selection-ref，不经过网络上的后端
+- 每种原文长度各跑 --rounds 次，取延迟中位数；输出字符数取自响应内容与 /llm/stats
+
+用法（在 backend 目录下）：python -m bench.edits [--sizes 500,2000,4000] [--token-ms 1] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import threading
+import time
+
+MOCK_PORT = int(os.getenv("BENCH_MOCK_PORT", "30013"))
+os.environ.setdefault("LLM_BASE_URL", f"http://127.0.0.1:{MOCK_PORT}")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.services import edit_script, llm_service  # noqa: E402
+from bench import mock_server  # noqa: E402
+from bench.load import _text  # noqa: E402
+
+URL = "/api/writing/selection-ref"
+
+
+def _start_mock():
+    config = uvicorn.Config(mock_server.app, host="127.0.0.1", port=MOCK_PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(client: httpx.AsyncClient, size: int, edits: bool, rounds: int, rng: random.Random):
+    latencies, output_chars, modes = [], [], []
+    before = dict(edit_script._stats)
+    for i in range(rounds):
+        body = {
+            # 每轮原文不同，避免命中缓存或被 single-flight 合并
+            "originalText": f"第{i}轮。" + _text(rng, size),
+            "instruction": "把第二句改得更具体",
+            "chatMessages": [],
+            "editScript": edits,
+        }
+        start = time.perf_counter()
+        resp = await client.post(URL, json=body)
+        latencies.append(time.perf_counter() - start)
+        resp.raise_for_status()
+        if edits:
+            modes.append(resp.json()["mode"])
+        else:
+            output_chars.append(len(resp.text))
+    if edits:
+        output_chars = [(edit_script._stats["output_chars"] - before["output_chars"]) / rounds]
+    return {
+        "size": size,
+        "mode": "edits" if edits else "full",
+        "latency_ms": round(statistics.median(latencies) * 1000, 1),
+        "output_chars": round(statistics.mean(output_chars)),
+        "fallbacks": sum(1 for m in modes if m != "edits"),
+    }
+
+
+async def main(args):
+    _start_mock()
+    mock_server._config.update(echo=True, token_ms=args.token_ms)
+    rng = random.Random(0)
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        for size in args.sizes:
+            for edits in (False, True):
+                results.append(await measure(client, size, edits, args.rounds, rng))
+    await llm_service.close_client()
+    print(f"{'size':>6}{'mode':>7}{'latency_ms':>12}{'output':>8}{'fallbacks':>11}")
+    for r in results:
+        print(f"{r['size']:>6}{r['mode']:>7}{r['latency_ms']:>12}{r['output_chars']:>8}{r['fallbacks']:>11}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[500, 2000, 4000])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--token-ms", type=float, default=1)
+    parser.add_argument("--json", default="")
+    asyncio.run(main(parser.parse_args()))
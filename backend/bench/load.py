@@ -0,0 +1,325 @@
+# load.py
+"""
+后端整体压测：按真实使用比例驱动 routers/writing.py 的全部接口
+- 默认在进程内启动 bench.mock_server 和后端 (app.main)，不占用真实推理服务；
+  --target 指向已运行的后端时只发压（后端需自行配置 LLM_BASE_URL）
+- 固定并发的闭环压测，统计每个接口与整体的 p50/p95/p99 延迟、首字节时间 (TTFT)、错误数和 RPS
+- --json 保存结果，--compare 与之前保存的结果对比，p95 或 RPS 退化超过阈值时以非零码退出
+
+用法（在 backend 目录下）：
+  python -m bench.load --duration 30 --concurrency 32 --json out.json
+  python -m bench.load --requests 500 --error-rate 0.02 --malformed-rate 0.1 --compare out.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+MOCK_PORT = int(os.getenv("BENCH_MOCK_PORT", "30013"))
+BACKEND_PORT = int(os.getenv("BENCH_BACKEND_PORT", "30014"))
+os.environ.setdefault("LLM_BASE_URL", f"http://127.0.0.1:{MOCK_PORT}")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from bench.mock_server import app as mock_app  # noqa: E402
+
+API = "/api/writing"
+
+SENTENCES = [
+    "调研访谈显示该问题在行业内普遍存在。",
+    "现有方案依赖人工巡检，响应时间长且成本高。",
+    "我们的系统将平均处理时长从四小时缩短到二十分钟。",
+    "试点单位在三个月内完成了全部业务迁移。",
+    "核心算法已申请两项发明专利。",
+    "The pilot covered 12 sites and 3,400 devices.",
+]
+
+
+def _text(rng: random.Random, chars: int) -> str:
+    parts = []
+    total = 0
+    while total < chars:
+        s = rng.choice(SENTENCES)
+        parts.append(s)
+        total += len(s)
+    return "".join(parts)
+
+
+def _document(rng: random.Random, sections: int, chars_per_section: int) -> str:
+    return "\n\n".join(
+        f"## {i + 1}. 小节{i + 1}\n\n{_text(rng, chars_per_section)}" for i in range(sections)
+    )
+
+
+def _points(rng: random.Random, n: int = 3) -> List[Dict[str, str]]:
+    return [{"id": f"p{k}", "text": _text(rng, 30)} for k in range(n)]
+
+
+def _chat(rng: random.Random, turns: int) -> List[Dict[str, str]]:
+    return [
+        {"role": "user" if k % 2 == 0 else "model", "text": _text(rng, 60)} for k in range(turns)
+    ]
+
+
+def _outline(rng: random.Random, chapters: int, sections: int) -> List[Dict[str, object]]:
+    nodes = []
+    for c in range(chapters):
+        cid = f"c{c}"
+        nodes.append({"id": cid, "title": f"第{c + 1}章 {_text(rng, 8)}", "level": 1})
+        for s in range(sections):
+            nodes.append({
+                "id": f"{cid}s{s}",
+                "title": f"{c + 1}.{s + 1} {_text(rng, 8)}",
+                "level": 2,
+                "parentId": cid,
+                "writingPoints": _points(rng, 2),
+            })
+    return nodes
+
+
+class Scenario:
+    def __init__(self, path: str, weight: float, payload: Callable[[random.Random, int], Optional[dict]]):
+        self.path = path
+        self.weight = weight
+        self.payload = payload
+
+
+# 权重大致对应编辑器里的调用频率：续写 / 智能编辑 / 对话最频繁，全文生成与全文评审最少
+SCENARIOS = [
+    Scenario("/continue", 20, lambda r, i: {"sectionTitle": f"{i}.1 现状分析", "precedingText": _text(r, r.choice([200, 800, 2000]))}),
+    Scenario("/smart-edit", 10, lambda r, i: {"selection": _text(r, 150), "instruction": "更专业一些", "type": r.choice(["rewrite", "continue"])}),
+    Scenario("/chat", 8, lambda r, i: {"query": f"问题{i}：如何量化收益？", "context": _text(r, 1500)}),
+    Scenario("/generate/chunk", 6, lambda r, i: {"sectionTitle": f"{i}.2 技术方案", "context": _text(r, 600), "writingPoints": _points(r)}),
+    Scenario("/review/chunk", 6, lambda r, i: {"sectionTitle": f"{i}.3 市场分析", "content": _text(r, 1200), "writingPoints": _points(r)}),
+    Scenario("/suggestions", 3, lambda r, i: {"topic": f"主题{i}", "context": _text(r, 400)}),
+    Scenario("/suggestions/stream", 3, lambda r, i: {"topic": f"主题{i}", "context": _text(r, 400)}),
+    Scenario("/points", 3, lambda r, i: {"title": f"{i}.1 痛点", "materials": _text(r, 800)}),
+    Scenario("/points/stream", 3, lambda r, i: {"title": f"{i}.1 痛点", "materials": _text(r, 800)}),
+    Scenario("/points/more", 1, lambda r, i: {"currentPoints": _points(r), "content": _text(r, 400)}),
+    Scenario("/polish", 3, lambda r, i: {"content": _text(r, r.choice([500, 1500, 5000]))}),
+    Scenario("/rewrite", 2, lambda r, i: {"content": _text(r, r.choice([500, 1500, 5000])), "requirements": "精简"}),
+    Scenario("/review", 2, lambda r, i: {"content": _document(r, r.choice([1, 4]), 1200)}),
+    Scenario("/fix-todo", 2, lambda r, i: {"todo": "补充数据来源", "content": _text(r, 800)}),
+    Scenario("/detailed-info", 1, lambda r, i: {"topic": f"主题{i}", "context": _text(r, 600)}),
+    Scenario("/related-queries", 1, lambda r, i: {"content": _text(r, 400)}),
+    Scenario("/outline", 1, lambda r, i: {"topic": f"项目申报书{i}", "requirements": "五章"}),
+    Scenario("/outline/stream", 1, lambda r, i: {"topic": f"项目申报书{i}", "requirements": "五章"}),
+    Scenario("/outline/from-materials", 0.5, lambda r, i: {"topic": f"项目{i}", "concept": _text(r, 200), "materialsSummary": _text(r, 3000)}),
+    Scenario("/outline/from-materials/stream", 0.5, lambda r, i: {"topic": f"项目{i}", "concept": _text(r, 200), "materialsSummary": _text(r, 3000)}),
+    Scenario("/generate", 0.5, lambda r, i: {"outline": _document(r, 3, 40), "requirements": "正式"}),
+    Scenario("/generate/stream", 0.5, lambda r, i: {"outline": _document(r, 3, 40), "requirements": "正式"}),
+    Scenario("/generate/template", 1, lambda r, i: {"title": f"{i}.1 团队介绍", "points": _points(r)}),
+    Scenario("/generate/document", 0.3, lambda r, i: {"outline": _outline(r, 2, 3), "parallel": 4}),
+    Scenario("/auto-write/questions", 1, lambda r, i: {"sectionTitle": f"{i}.1 痛点验证", "writingPoints": _points(r), "materials": _text(r, 600)}),
+    Scenario("/auto-write/next-question", 2, lambda r, i: {"sectionTitle": f"{i}.1 痛点验证", "writingPoints": _points(r), "history": _chat(r, r.randint(1, 6))}),
+    Scenario("/rewrite/guidance", 1, lambda r, i: {"currentContent": _text(r, 1200), "guidance": "突出量化指标", "materials": _text(r, 800), "writingPoints": _points(r)}),
+    Scenario("/partial-merge", 1, lambda r, i: {"originalText": _text(r, 600), "chatMessages": _chat(r, 4)}),
+    Scenario("/selection-ref", 1, lambda r, i: {"originalText": _text(r, 300), "chatMessages": _chat(r, 4), "instruction": "引用对话结论"}),
+    Scenario("/review/batch", 0.3, lambda r, i: {"sections": [{"sectionTitle": f"{k}.1", "content": _text(r, 800)} for k in range(4)]}),
+    Scenario("/review/full", 0.5, lambda r, i: {"outline": _outline(r, 3, 2)}),
+    Scenario("/review/apply", 1, lambda r, i: {"content": _text(r, r.choice([800, 5000])), "suggestions": ["补充数据", "精简表述"]}),
+    Scenario("/guide/global", 0.5, lambda r, i: {"topic": f"项目{i}", "concept": _text(r, 200), "materials": _text(r, 1500), "outline": _outline(r, 2, 2)}),
+    Scenario("/guide/contextual", 1, lambda r, i: {"title": f"{i}.1 市场", "content": _text(r, 600)}),
+    Scenario("/llm/stats", 0.2, lambda r, i: None),
+    Scenario("/prompts", 0.2, lambda r, i: None),
+]
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _summary(samples: List[dict], elapsed: float) -> dict:
+    ok = [s for s in samples if s["status"] < 400]
+    latency = sorted(s["latency"] * 1000 for s in ok)
+    ttft = sorted(s["ttft"] * 1000 for s in ok if s["ttft"] is not None)
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_ms": round(_percentile(latency, 50), 1),
+        "latency_p95_ms": round(_percentile(latency, 95), 1),
+        "latency_p99_ms": round(_percentile(latency, 99), 1),
+        "ttft_p50_ms": round(_percentile(ttft, 50), 1),
+        "ttft_p95_ms": round(_percentile(ttft, 95), 1),
+        "ttft_p99_ms": round(_percentile(ttft, 99), 1),
+    }
+
+
+async def _one(client: httpx.AsyncClient, scenario: Scenario, payload: Optional[dict], headers: dict) -> dict:
+    start = time.perf_counter()
+    ttft = None
+    status = 0
+    try:
+        method = "GET" if payload is None else "POST"
+        async with client.stream(method, API + scenario.path, json=payload, headers=headers) as resp:
+            status = resp.status_code
+            async for chunk in resp.aiter_raw():
+                if ttft is None and chunk:
+                    ttft = time.perf_counter() - start
+    except httpx.HTTPError:
+        status = 599
+    return {"route": scenario.path, "status": status, "latency": time.perf_counter() - start, "ttft": ttft}
+
+
+async def run_load(args, base_url: str) -> dict:
+    rng = random.Random(args.seed)
+    scenarios = [s for s in SCENARIOS if not args.routes or s.path in args.routes]
+    weights = [s.weight for s in scenarios]
+    samples: List[dict] = []
+    counter = iter(range(sys.maxsize))
+    deadline = time.perf_counter() + args.duration if args.duration else None
+
+    async def worker(wid: int, client: httpx.AsyncClient):
+        # 每个 worker 模拟一个编辑会话
+        headers = {"X-Client-Id": f"bench-{wid}", "X-Session-Id": f"bench-session-{wid}"}
+        if args.cache_bypass:
+            headers["X-Cache-Bypass"] = "1"
+        while True:
+            i = next(counter)
+            if deadline is None and i >= args.requests:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            scenario = rng.choices(scenarios, weights)[0]
+            samples.append(await _one(client, scenario, scenario.payload(rng, i), headers))
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(w, client) for w in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    by_route: Dict[str, List[dict]] = {}
+    for s in samples:
+        by_route.setdefault(s["route"], []).append(s)
+    return {
+        "config": {
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "seed": args.seed,
+            "routes": args.routes or "all",
+            "cache_bypass": args.cache_bypass,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "overall": _summary(samples, elapsed),
+        "routes": {route: _summary(items, elapsed) for route, items in sorted(by_route.items())},
+    }
+
+
+def _start_server(app, port: int) -> uvicorn.Server:
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _print_report(result: dict):
+    header = f"{'route':<34}{'reqs':>6}{'err':>5}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'ttft50':>9}{'ttft95':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = list(result["routes"].items()) + [("OVERALL", result["overall"])]
+    for route, r in rows:
+        print(f"{route:<34}{r['requests']:>6}{r['errors']:>5}{r['rps']:>8}"
+              f"{r['latency_p50_ms']:>9}{r['latency_p95_ms']:>9}{r['latency_p99_ms']:>9}"
+              f"{r['ttft_p50_ms']:>9}{r['ttft_p95_ms']:>9}")
+
+
+def _compare(result: dict, baseline_path: str, threshold: float) -> bool:
+    """与基线对比；p95 延迟上升或 RPS 下降超过 threshold 视为退化"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressed = False
+    print(f"\n对比基线 {baseline_path}（阈值 {threshold:.0%}）")
+    pairs = [("OVERALL", baseline["overall"], result["overall"])] + [
+        (route, baseline["routes"][route], r)
+        for route, r in result["routes"].items()
+        if route in baseline["routes"]
+    ]
+    for route, old, new in pairs:
+        notes = []
+        if old["latency_p95_ms"] and new["latency_p95_ms"] > old["latency_p95_ms"] * (1 + threshold):
+            notes.append(f"p95 {old['latency_p95_ms']} -> {new['latency_p95_ms']} ms")
+        # RPS 只在整体上比较，单个接口的请求数受随机比例影响
+        if route == "OVERALL" and new["rps"] < old["rps"] * (1 - threshold):
+            notes.append(f"rps {old['rps']} -> {new['rps']}")
+        if notes:
+            regressed = True
+            print(f"  [退化] {route}: " + "; ".join(notes))
+    if not regressed:
+        print("  未发现退化")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default="", help="已运行的后端地址；为空则在进程内启动 mock 与后端")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=0, help="压测秒数；为 0 时按 --requests 计数")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--routes", nargs="*", default=[], help="只压这些接口，如 /continue /polish")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-bypass", action="store_true", help="带 X-Cache-Bypass 头，测未命中缓存的路径")
+    parser.add_argument("--ttft-ms", type=float, default=None)
+    parser.add_argument("--token-ms", type=float, default=None)
+    parser.add_argument("--completion-chars", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=None)
+    parser.add_argument("--malformed-rate", type=float, default=None)
+    parser.add_argument("--json", default="", help="保存结果")
+    parser.add_argument("--compare", default="", help="与之前保存的结果对比")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.target:
+        base_url = args.target.rstrip("/")
+        mock_url = None
+    else:
+        from app.main import app as backend_app
+        _start_server(mock_app, MOCK_PORT)
+        _start_server(backend_app, BACKEND_PORT)
+        base_url = f"http://127.0.0.1:{BACKEND_PORT}"
+        mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+
+    knobs = {
+        "ttft_ms": args.ttft_ms,
+        "token_ms": args.token_ms,
+        "completion_chars": args.completion_chars,
+        "error_rate": args.error_rate,
+        "malformed_rate": args.malformed_rate,
+    }
+    mock_config = None
+    if mock_url:
+        httpx.post(f"{mock_url}/mock/reset")
+        mock_config = httpx.post(
+            f"{mock_url}/mock/config", json={k: v for k, v in knobs.items() if v is not None}
+        ).json()
+
+    result = asyncio.run(run_load(args, base_url))
+    result["mock"] = mock_config
+    if mock_url:
+        result["mock_stats"] = httpx.get(f"{mock_url}/mock/stats").json()
+
+    _print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare and _compare(result, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
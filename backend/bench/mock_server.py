@@ -0,0 +1,187 @@
+# mock_server.py
+"""
+本地 mock OpenAI 兼容推理服务 (/v1/chat/completions)，用于基准测试，不占用真实 GPU
+用法：uvicorn bench.mock_server:app --port 30013
+
+延迟模型：
+- 首 token 时间 = MOCK_TTFT_MS + 未命中前缀缓存的字符数 × MOCK_PREFILL_US_PER_CHAR
+- 前缀缓存按 MOCK_PREFIX_BLOCK 个字符分块做链式哈希（与 vLLM 的 block 级前缀缓存类似），
+  只有从开头起连续命中的块才算命中
+- 之后每个 token 间隔 MOCK_TOKEN_MS
+- MOCK_ECHO：非 JSON 请求原样输出最后一条 user 消息（模拟整段重写，输出长度随原文增长），
+  默认输出固定的 MOCK_COMPLETION_CHARS 个字符
+- 要求编辑脚本 ("edits") 的请求返回一条替换，find 取自最后一条 user 消息中唯一出现的片段
+- MOCK_MODEL_SPEED (JSON，{模型名: 倍数}) 按请求的 model 把以上延迟缩短对应倍数，模拟快速小模型
+
+故障注入：
+- MOCK_ERROR_RATE：按比例直接返回错误，状态码为 MOCK_ERROR_STATUS（默认 500）
+- MOCK_SLOW_RATE：按比例在首 token 前额外等待 MOCK_SLOW_MS，模拟长尾（排队、抢占、坏节点）
+- MOCK_MALFORMED_RATE：要求 JSON 的请求按比例返回包在代码块里、被截断的 JSON，
+  用于触发 clean_and_parse_json 的修复 / 兜底路径
+运行中可通过 POST /mock/config 修改以上参数（只需传要改的字段）
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+from collections import OrderedDict
+from typing import Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_PREFIX_BLOCK = int(os.getenv("MOCK_PREFIX_BLOCK", "16"))
+MOCK_PREFIX_CACHE_BLOCKS = int(os.getenv("MOCK_PREFIX_CACHE_BLOCKS", "20000"))
+
+# 可在运行中通过 /mock/config 调整的参数
+_config = {
+    "ttft_ms": float(os.getenv("MOCK_TTFT_MS", "20")),
+    "prefill_us_per_char": float(os.getenv("MOCK_PREFILL_US_PER_CHAR", "50")),
+    "token_ms": float(os.getenv("MOCK_TOKEN_MS", "5")),
+    "completion_chars": int(os.getenv("MOCK_COMPLETION_CHARS", "60")),
+    "echo": os.getenv("MOCK_ECHO", "0") == "1",
+    "prefix_cache": os.getenv("MOCK_PREFIX_CACHE", "1") == "1",
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "error_status": int(os.getenv("MOCK_ERROR_STATUS", "500")),
+    "slow_rate": float(os.getenv("MOCK_SLOW_RATE", "0")),
+    "slow_ms": float(os.getenv("MOCK_SLOW_MS", "1000")),
+    "malformed_rate": float(os.getenv("MOCK_MALFORMED_RATE", "0")),
+    "model_speed": json.loads(os.getenv("MOCK_MODEL_SPEED", "{}")),
+}
+
+app = FastAPI(title="Mock LLM Server")
+
+_random = random.Random(int(os.getenv("MOCK_SEED", "0")))
+_prefix_blocks: "OrderedDict[str, None]" = OrderedDict()
+_stats = {"requests": 0, "prompt_chars": 0, "cached_chars": 0, "errors": 0, "malformed": 0, "slow": 0}
+
+
+def _flatten(messages: List[Dict[str, str]]) -> str:
+    # 近似服务端 chat template：按顺序拼接角色与内容
+    return "".join(f"<|{m.get('role')}|>{m.get('content', '')}" for m in messages)
+
+
+def _prefill_chars(prompt: str) -> int:
+    """返回需要重新 prefill 的字符数，并把本次 prompt 的所有块写入前缀缓存"""
+    if not _config["prefix_cache"]:
+        return len(prompt)
+    digest = hashlib.sha1()
+    cached = 0
+    still_hit = True
+    for i in range(0, len(prompt), MOCK_PREFIX_BLOCK):
+        block = prompt[i:i + MOCK_PREFIX_BLOCK]
+        digest.update(block.encode("utf-8"))
+        key = digest.hexdigest()
+        full_block = len(block) == MOCK_PREFIX_BLOCK
+        if still_hit and full_block and key in _prefix_blocks:
+            cached += len(block)
+            _prefix_blocks.move_to_end(key)
+        else:
+            still_hit = False
+            if full_block:
+                _prefix_blocks[key] = None
+    while len(_prefix_blocks) > MOCK_PREFIX_CACHE_BLOCKS:
+        _prefix_blocks.popitem(last=False)
+    return len(prompt) - cached
+
+
+def _edit_script(user: str) -> str:
+    # 从最长一行的中间开始找一个在整条消息里只出现一次的片段
+    line = max(user.split("\n"), key=len)
+    for start in range(len(line) // 2, max(0, len(line) - 16)):
+        find = line[start:start + 16]
+        if user.count(find) == 1:
+            return json.dumps({"edits": [{"find": find, "replace": find + "（已修改）"}]}, ensure_ascii=False)
+    return json.dumps({"edits": []})
+
+
+def _completion_text(messages: List[Dict[str, str]]) -> str:
+    text = "\n".join(m.get("content", "") for m in messages)
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    if '"edits"' in text:
+        return _edit_script(user)
+    if "JSON" in text or "json" in text:
+        if _random.random() < _config["malformed_rate"]:
+            _stats["malformed"] += 1
+            # 模型常见的坏输出：代码块包裹 + 缺少收尾
+            return '```json\n["要点一", "要点二", "要点三'
+        return '["要点一", "要点二", "要点三"]'
+    if _config["echo"]:
+        return user
+    return ("这是一段用于基准测试的模拟输出。" * 200)[:_config["completion_chars"]]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    _stats["requests"] += 1
+    if _random.random() < _config["error_rate"]:
+        _stats["errors"] += 1
+        return JSONResponse({"error": {"message": "mock injected error"}}, status_code=_config["error_status"])
+
+    prompt = _flatten(messages)
+    uncached = _prefill_chars(prompt)
+    _stats["prompt_chars"] += len(prompt)
+    _stats["cached_chars"] += len(prompt) - uncached
+
+    speed = float(_config["model_speed"].get(body.get("model"), 1))
+    ttft = (_config["ttft_ms"] + uncached * _config["prefill_us_per_char"] / 1000) / 1000 / speed
+    if _random.random() < _config["slow_rate"]:
+        _stats["slow"] += 1
+        ttft += _config["slow_ms"] / 1000
+    token_delay = _config["token_ms"] / 1000 / speed
+    text = _completion_text(messages)
+    usage = {"prompt_tokens": len(prompt), "completion_tokens": len(text)}
+
+    if not body.get("stream"):
+        await asyncio.sleep(ttft + len(text) * token_delay)
+        return JSONResponse({
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}}],
+            "usage": usage,
+        })
+
+    async def events():
+        await asyncio.sleep(ttft)
+        for ch in text:
+            chunk = {"choices": [{"index": 0, "delta": {"content": ch}}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(token_delay)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return _stats
+
+
+@app.post("/mock/reset")
+async def mock_reset():
+    _prefix_blocks.clear()
+    for k in _stats:
+        _stats[k] = 0
+    return _stats
+
+
+@app.get("/mock/config")
+async def mock_get_config():
+    return _config
+
+
+@app.post("/mock/config")
+async def mock_set_config(request: Request):
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in _config:
+            _config[key] = type(_config[key])(value)
+    return _config
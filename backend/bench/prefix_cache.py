@@ -0,0 +1,129 @@
+# prefix_cache.py
+"""
+对比两种 prompt 布局的首 token 时间 (TTFT)：
+- stable：固定指令在前 (system)，可变内容在后 —— 可命中服务端前缀缓存
+- inline：可变内容夹在指令中间 (旧布局)
+
+在进程内启动 bench.mock_server（模拟 block 级前缀缓存），通过 llm_service 真实发请求
+用法（在 backend 目录下）：python -m bench.prefix_cache [--requests 30] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import threading
+import time
+
+PORT = int(os.getenv("BENCH_MOCK_PORT", "30013"))
+os.environ.setdefault("LLM_BASE_URL", f"http://127.0.0.1:{PORT}")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from app.services.llm_service import call_llm_stream, close_client  # noqa: E402
+from app.services.prompts import PROMPTS, PromptTemplate  # noqa: E402
+from bench.mock_server import app as mock_app  # noqa: E402
+
+# 前端 DEFAULT_PROMPTS.review_gen 风格的自定义模板：可变的标题/要点在固定指令之前
+CUSTOM_REVIEW_TEMPLATE = PromptTemplate("review_gen:custom", """
+请对以下文章章节进行深度评审。
+章节标题："{{TITLE}}"
+核心要点（需验证是否达成）：
+{{POINTS}}
+
+请返回一个严格的 JSON 对象（不要Markdown标记），包含：
+1. "score": (0-100) 评分。
+2. "summary": (string) 简短的评审摘要（100字以内）。
+3. "todos": (string[]) 一个包含3-5条具体的修改待办事项（To-Do List）的数组。
+评审维度：逻辑一致性、证据充分性、量化描述是否带约束边界、与章节要点的覆盖程度、语言是否专业简洁。
+若发现编造数据或无来源的具体数字，必须在 todos 中单独指出。
+
+待评审文本：
+{{CONTENT}}
+""")
+
+TEMPLATES = {
+    "chunk": PROMPTS["chunk"],
+    "auto_write_next_question": PROMPTS["auto_write_next_question"],
+    "review_gen_custom": CUSTOM_REVIEW_TEMPLATE,
+}
+
+SCENARIOS = {
+    "chunk": lambda i: {
+        "TITLE": f"{i % 7 + 1}.{i % 3 + 1} 市场机会分析之{i}",
+        "STYLE": "professional",
+        "POINTS": "\n".join(f"{k}. 要点{i}-{k}：{'细节描述' * 5}" for k in range(1, 4)),
+        "CONTEXT": f"前文摘要{i}：" + "上一节讨论了行业现状与竞争格局。" * 8,
+    },
+    "auto_write_next_question": lambda i: {
+        "CONTEXT": f"章节标题：{i}.1 痛点验证\n写作要点：\n- 要点{i}",
+        "DIALOG": "\n".join(f"Q{k}: 问题{k}\nA{k}: 回答{i}-{k}" for k in range(1, i % 4 + 2)),
+        "ROUND": f"第 {i % 4 + 2} 轮",
+    },
+    "review_gen_custom": lambda i: {
+        "TITLE": f"{i}.1 场景化痛点验证",
+        "POINTS": f"- 要点{i}：还原客户场景\n- 要点{i}：普遍性求证",
+        "CONTENT": f"正文{i}：" + "调研访谈显示该问题在行业内普遍存在。" * 6,
+    },
+}
+
+
+def start_mock_server():
+    config = uvicorn.Config(mock_app, host="127.0.0.1", port=PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(scenario: str, stable: bool, n: int):
+    httpx.post(f"http://127.0.0.1:{PORT}/mock/reset")
+    template = TEMPLATES[scenario]
+    ttfts = []
+    for i in range(n):
+        messages = template.render(SCENARIOS[scenario](i), stable=stable)
+        start = time.perf_counter()
+        async for _ in call_llm_stream("mock-model", messages):
+            ttfts.append((time.perf_counter() - start) * 1000)
+            break
+    server_stats = httpx.get(f"http://127.0.0.1:{PORT}/mock/stats").json()
+    ordered = sorted(ttfts)
+    return {
+        "scenario": scenario,
+        "layout": "stable" if stable else "inline",
+        "requests": n,
+        "ttft_mean_ms": round(statistics.mean(ordered), 1),
+        "ttft_p50_ms": round(ordered[len(ordered) // 2], 1),
+        "ttft_p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))], 1),
+        "prefix_hit_ratio": round(server_stats["cached_chars"] / max(1, server_stats["prompt_chars"]), 3),
+    }
+
+
+async def main(args):
+    random.seed(0)
+    results = []
+    for scenario in SCENARIOS:
+        for stable in (False, True):
+            results.append(await measure(scenario, stable, args.requests))
+    await close_client()
+
+    print(f"{'scenario':<28}{'layout':<8}{'mean':>8}{'p50':>8}{'p95':>8}{'hit':>8}")
+    for r in results:
+        print(f"{r['scenario']:<28}{r['layout']:<8}{r['ttft_mean_ms']:>8}"
+              f"{r['ttft_p50_ms']:>8}{r['ttft_p95_ms']:>8}{r['prefix_hit_ratio']:>8}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--json", default="")
+    args = parser.parse_args()
+    start_mock_server()
+    asyncio.run(main(args))
@@ -0,0 +1,100 @@
+# retrieval.py
+"""
+参考资料检索的基准：索引构建耗时、查询耗时，以及与"只保留开头"截断相比的命中率
+- 合成若干规模的资料，在随机位置埋入与各小节相关的关键事实
+- 命中率：按预算选出的资料里包含目标事实的比例
+
+用法（在 backend 目录下）：python -m bench.retrieval [--queries 50] [--budget 1500] [--json out.json]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from app.services.context_budget import truncate_to_tokens
+from app.services.retrieval import MaterialsIndex
+
+FILLER = [
+    "本项目面向中小制造企业的设备运维场景。",
+    "团队成员具有多年行业经验，曾服务多家大型客户。",
+    "市场调研覆盖了华东、华南地区的上百家企业。",
+    "产品采用云边协同架构，支持私有化部署。",
+    "公司已与多所高校建立联合实验室。",
+    "The platform exposes REST APIs for third-party integration.",
+]
+TOPICS = ["预测性维护", "能耗优化", "质量追溯", "备件管理", "安全巡检", "供应链协同", "工艺参数", "售后服务"]
+
+
+def make_materials(rng: random.Random, chars: int):
+    """返回 (资料文本, [(查询, 关键事实)])"""
+    sentences = []
+    total = 0
+    while total < chars:
+        s = rng.choice(FILLER)
+        sentences.append(s)
+        total += len(s)
+    facts = []
+    for i, topic in enumerate(TOPICS):
+        fact = f"在{topic}方面，试点客户的关键指标改善了{rng.randint(10, 60)}%（编号F{i}）。"
+        sentences.insert(rng.randrange(len(sentences)), fact)
+        facts.append((f"{i + 1}.1 {topic}的应用成效\n- 说明{topic}带来的量化收益", fact))
+    return "".join(sentences), facts
+
+
+def _ms(values):
+    ordered = sorted(values)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))], 3),
+        "mean_ms": round(statistics.mean(ordered), 3),
+    }
+
+
+def measure(chars: int, queries: int, budget: int, rng: random.Random):
+    text, facts = make_materials(rng, chars)
+    start = time.perf_counter()
+    index = MaterialsIndex(text)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    head = truncate_to_tokens(text, budget)
+    query_times = []
+    retrieved_hits = 0
+    head_hits = 0
+    for i in range(queries):
+        query, fact = facts[i % len(facts)]
+        start = time.perf_counter()
+        selected = index.select(query, budget)
+        query_times.append((time.perf_counter() - start) * 1000)
+        retrieved_hits += fact in selected
+        head_hits += fact in head
+    return {
+        "chars": len(text),
+        "chunks": len(index.chunks),
+        "tokens": index.total_tokens,
+        "build_ms": round(build_ms, 1),
+        "select": _ms(query_times),
+        "fact_recall_retrieval": round(retrieved_hits / queries, 3),
+        "fact_recall_head": round(head_hits / queries, 3),
+    }
+
+
+def main(args):
+    rng = random.Random(0)
+    results = [measure(chars, args.queries, args.budget, rng) for chars in args.sizes]
+    print(f"{'chars':>9}{'chunks':>8}{'build_ms':>10}{'sel_p50':>9}{'sel_p95':>9}{'recall':>8}{'head':>7}")
+    for r in results:
+        print(f"{r['chars']:>9}{r['chunks']:>8}{r['build_ms']:>10}{r['select']['p50_ms']:>9}"
+              f"{r['select']['p95_ms']:>9}{r['fact_recall_retrieval']:>8}{r['fact_recall_head']:>7}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[5000, 50000, 500000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--json", default="")
+    main(parser.parse_args())
@@ -0,0 +1,146 @@
+# streaming.py
+"""
+流式输出合并写出的基准：每路生成的写出次数、服务端 CPU 时间、首字延迟与合并带来的额外延迟
+- 合成上游：每路 --tokens 个一两个汉字的增量，间隔 --gap-ms（模拟解码速度），多路并发
+- 走与 create_stream_response 相同的路径（coalesce → guard_stream → StreamingResponse），
+  以 ASGI send 计数 http.response.body 消息，即 HTTP 写出次数
+- 另测上游 SSE 行解析：整行 json.loads 与只解码 content 字段的快速路径
+
+用法（在 backend 目录下）：python -m bench.streaming [--streams 200] [--tokens 400] [--gap-ms 5] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from fastapi import Request
+
+from app.routers.writing import create_text_stream_response
+from app.services import llm_service
+from app.services.stream_batching import coalesce
+from app.services.stream_control import current_request
+
+POLICIES = [("off", 0, 0), ("64B/20ms", 64, 20), ("96B/30ms", 96, 30), ("256B/50ms", 256, 50)]
+CHARS = "流式输出合并写出的基准测试用于衡量每路生成的写出次数与额外延迟，。"
+
+
+def _deltas(rng: random.Random, tokens: int):
+    return ["".join(rng.choice(CHARS) for _ in range(rng.choice((1, 1, 2)))) for _ in range(tokens)]
+
+
+async def _run_stream(deltas, gap: float, max_bytes: int, max_ms: float):
+    produced = []
+
+    async def upstream():
+        for d in deltas:
+            await asyncio.sleep(gap)
+            produced.append(time.perf_counter())
+            yield d
+
+    start = time.perf_counter()
+    writes = 0
+    sent_chars = 0
+    lags = []
+    ttfb = None
+    # 已发出的增量个数 -> 用于计算每次写出里最早那个增量等待了多久
+    lengths = [len(d) for d in deltas]
+    sent_deltas = 0
+
+    async def send(message):
+        nonlocal writes, sent_chars, ttfb, sent_deltas
+        if message["type"] != "http.response.body" or not message.get("body"):
+            return
+        now = time.perf_counter()
+        writes += 1
+        if ttfb is None:
+            ttfb = now - start
+        lags.append(now - produced[sent_deltas])
+        sent_chars += len(message["body"].decode("utf-8"))
+        while sent_deltas < len(lengths) and sent_chars >= sum(lengths[:sent_deltas + 1]):
+            sent_deltas += 1
+
+    never = asyncio.Event()
+
+    async def receive():
+        await never.wait()
+        return {"type": "http.disconnect"}
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "method": "POST", "path": "/api/writing/polish", "headers": [], "query_string": b"",
+    }
+    current_request.set(Request(scope, receive))
+    response = await create_text_stream_response(coalesce(upstream(), max_bytes, max_ms))
+    await response(scope, receive, send)
+    return writes, ttfb, lags
+
+
+async def measure(name: str, max_bytes: int, max_ms: float, args, rng: random.Random):
+    streams = [_deltas(rng, args.tokens) for _ in range(args.streams)]
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    results = await asyncio.gather(*[
+        _run_stream(d, args.gap_ms / 1000, max_bytes, max_ms) for d in streams
+    ])
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    writes = [w for w, _, _ in results]
+    ttfb = sorted(t for _, t, _ in results)
+    lags = sorted(l for _, _, ls in results for l in ls)
+    return {
+        "policy": name,
+        "writes_per_stream": round(statistics.mean(writes), 1),
+        "cpu_ms_per_stream": round(cpu * 1000 / args.streams, 2),
+        "wall_s": round(wall, 2),
+        "ttfb_p50_ms": round(ttfb[len(ttfb) // 2] * 1000, 2),
+        "lag_p99_ms": round(lags[int(0.99 * (len(lags) - 1))] * 1000, 2),
+    }
+
+
+def measure_parse(lines: int):
+    rng = random.Random(1)
+    samples = [
+        json.dumps({
+            "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1700000000,
+            "model": "deepseek-chat",
+            "choices": [{"index": 0, "delta": {"content": rng.choice(CHARS)}, "finish_reason": None}],
+        }, ensure_ascii=False)
+        for _ in range(lines)
+    ]
+    result = {}
+    for name, fast in (("json.loads", False), ("fast_path", True)):
+        llm_service.LLM_STREAM_FAST_PARSE = fast
+        start = time.perf_counter()
+        for line in samples:
+            llm_service._delta_content(line)
+        result[name] = round((time.perf_counter() - start) / lines * 1e6, 3)
+    llm_service.LLM_STREAM_FAST_PARSE = True
+    return {"us_per_line": result}
+
+
+async def main(args):
+    rng = random.Random(0)
+    results = []
+    for name, max_bytes, max_ms in POLICIES:
+        results.append(await measure(name, max_bytes, max_ms, args, rng))
+    print(f"{'policy':>11}{'writes':>9}{'cpu_ms':>9}{'ttfb_p50':>10}{'lag_p99':>9}")
+    for r in results:
+        print(f"{r['policy']:>11}{r['writes_per_stream']:>9}{r['cpu_ms_per_stream']:>9}"
+              f"{r['ttfb_p50_ms']:>10}{r['lag_p99_ms']:>9}")
+    parse = measure_parse(args.parse_lines)
+    print("SSE 行解析 (us/行):", parse["us_per_line"])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"policies": results, "parse": parse}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--gap-ms", type=float, default=5)
+    parser.add_argument("--parse-lines", type=int, default=200000)
+    parser.add_argument("--json", default="")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+# tail.py
+"""
+上游长尾与瞬时错误下的调用延迟基准：对比关闭 / 开启退避重试与对冲请求时的 p50/p95/p99 和失败率
+- 进程内启动 bench.mock_server，直接调用 llm_service.call_llm（按 /points 路由计），不经过 HTTP 层
+- 长尾：MOCK_SLOW_RATE 比例的请求在首 token 前多等 --slow-ms
+- 瞬时错误：--error-rate 比例的请求直接返回 503
+
+用法（在 backend 目录下）：python -m bench.tail [--requests 400] [--concurrency 16] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+
+MOCK_PORT = int(os.getenv("BENCH_MOCK_PORT", "30013"))
+os.environ.setdefault("LLM_BASE_URL", f"http://127.0.0.1:{MOCK_PORT}")
+
+import uvicorn  # noqa: E402
+
+from app.config import CHAT_MODEL  # noqa: E402
+from app.services import llm_service, resilience  # noqa: E402
+from app.services.metrics import current_route  # noqa: E402
+from bench import mock_server  # noqa: E402
+
+ROUTE = "/api/writing/points"
+
+
+def _start_mock():
+    config = uvicorn.Config(mock_server.app, host="127.0.0.1", port=MOCK_PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _configure(hedge: bool, retries: int):
+    resilience.LLM_HEDGE_ENABLED = hedge
+    resilience.LLM_RETRIES = retries
+    resilience._policies.clear()
+    resilience._latency.clear()
+
+
+async def measure(name: str, args, hedge: bool, retries: int, slow_rate: float, error_rate: float):
+    _configure(hedge, retries)
+    mock_server._config.update(slow_rate=slow_rate, slow_ms=args.slow_ms, error_rate=error_rate, error_status=503)
+    before = dict(resilience._stats)
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(i: int):
+        nonlocal failures
+        async with sem:
+            current_route.set(ROUTE)
+            # 每个请求内容不同，避免被 single-flight 合并
+            messages = [{"role": "user", "content": f"请以 JSON 数组列出写作要点（{name} #{i}）"}]
+            start = time.perf_counter()
+            try:
+                await llm_service.call_llm(CHAT_MODEL, messages)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * (len(ordered) - 1) + 0.5))] * 1000, 1)
+
+    return {
+        "scenario": name,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": round(ordered[-1] * 1000, 1),
+        "failed": failures,
+        **{k: resilience._stats[k] - before[k] for k in ("retries", "hedges", "hedge_wins")},
+    }
+
+
+async def main(args):
+    _start_mock()
+    scenarios = [
+        ("tail, baseline", False, 0, args.slow_rate, 0),
+        ("tail, hedged", True, 0, args.slow_rate, 0),
+        ("503s, no retry", False, 0, 0, args.error_rate),
+        ("503s, retry x2", False, 2, 0, args.error_rate),
+    ]
+    results = []
+    for name, hedge, retries, slow_rate, error_rate in scenarios:
+        results.append(await measure(name, args, hedge, retries, slow_rate, error_rate))
+    await llm_service.close_client()
+    print(f"{'scenario':>16}{'p50':>8}{'p95':>8}{'p99':>9}{'max':>9}{'failed':>8}{'retries':>9}{'hedges':>8}{'wins':>6}")
+    for r in results:
+        print(f"{r['scenario']:>16}{r['p50_ms']:>8}{r['p95_ms']:>8}{r['p99_ms']:>9}{r['max_ms']:>9}"
+              f"{r['failed']:>8}{r['retries']:>9}{r['hedges']:>8}{r['hedge_wins']:>6}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-ms", type=float, default=1500)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--json", default="")
+    asyncio.run(main(parser.parse_args()))
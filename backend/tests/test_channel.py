@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from app.services.channel import Channel
+
+
+async def _dispatch(route, body, cache):
+    return "result", {"route": route, "body": body}
+
+
+def _channel():
+    sent = []
+
+    async def send_text(text):
+        sent.append(json.loads(text))
+
+    return Channel(send_text, _dispatch, lambda route: None), sent
+
+
+def test_bad_frames_get_an_error_and_the_channel_keeps_working():
+    async def main():
+        channel, sent = _channel()
+        await channel.handle(None)
+        await channel.handle("不是 JSON")
+        await channel.handle(json.dumps({"type": "ping"}))
+        assert [f["type"] for f in sent] == ["error", "error", "pong"]
+        assert sent[0]["status"] == 400
+        await channel.close()
+
+    asyncio.run(main())
+
+
+def test_start_runs_the_operation_and_replies_with_its_id():
+    async def main():
+        channel, sent = _channel()
+        await channel.handle(json.dumps({"type": "start", "id": 7, "route": "/chat", "body": {"q": 1}}))
+        for _ in range(20):
+            if sent:
+                break
+            await asyncio.sleep(0.01)
+        assert sent[0] == {"type": "result", "id": "7", "data": {"route": "/chat", "body": {"q": 1}}}
+        await channel.close()
+
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import pytest
+
+from app.services import doc_sessions as ds
+from app.services.doc_sessions import (
+    DocumentSessionStore,
+    DocumentSessionConflict,
+    DocumentSessionNotFound,
+    InvalidPatch,
+)
+
+OUTLINE = [
+    {"id": "a", "level": 1, "title": "一", "content": "甲乙丙"},
+    {"id": "b", "level": 2, "title": "二", "content": "丁"},
+]
+
+
+def _store():
+    return DocumentSessionStore(max_sessions=4, ttl=3600)
+
+
+def test_patches_apply_in_order_and_bump_version():
+    store = _store()
+    session = store.create([{"op": "setOutline", "outline": OUTLINE}])
+    assert session.version == 1
+    store.patch(session.id, [
+        {"op": "spliceContent", "nodeId": "a", "start": 1, "end": 2, "text": "XY"},
+        {"op": "upsertNode", "node": {"id": "c", "title": "三"}, "after": "a"},
+        {"op": "appendChat", "key": "a", "messages": [{"role": "user", "text": "hi"}]},
+    ], base_version=1)
+    assert session.version == 2
+    assert session.content("a") == "甲XY丙"
+    assert [n["id"] for n in session.nodes] == ["a", "c", "b"]
+    assert session.chat("a") == [{"role": "user", "text": "hi"}]
+
+
+def test_invalid_op_leaves_session_untouched():
+    store = _store()
+    session = store.create([{"op": "setOutline", "outline": OUTLINE}])
+    before = session.snapshot()
+    with pytest.raises(InvalidPatch):
+        store.patch(session.id, [
+            {"op": "setContent", "nodeId": "a", "content": "已改"},
+            {"op": "removeNode", "nodeId": "b"},
+            {"op": "spliceContent", "nodeId": "a", "start": 5, "end": 99, "text": ""},
+        ])
+    assert session.snapshot() == before
+    assert session.version == 1
+    assert store.get_stats()["rejected"] == 1
+
+
+def test_copy_on_write_does_not_mutate_shared_nodes():
+    store = _store()
+    session = store.create([{"op": "setOutline", "outline": OUTLINE}])
+    old_nodes = session.nodes
+    untouched = old_nodes[1]
+    store.patch(session.id, [{"op": "setContent", "nodeId": "a", "content": "新"}])
+    assert old_nodes[0]["content"] == "甲乙丙"
+    # 未改动的节点与旧列表共享
+    assert session.nodes[1] is untouched
+
+
+def test_stale_base_version_is_a_409_conflict():
+    store = _store()
+    session = store.create([{"op": "setOutline", "outline": OUTLINE}])
+    store.patch(session.id, [{"op": "setContent", "nodeId": "a", "content": "x"}], base_version=1)
+    with pytest.raises(DocumentSessionConflict) as exc:
+        store.patch(session.id, [{"op": "setContent", "nodeId": "a", "content": "y"}], base_version=1)
+    assert exc.value.status_code == 409
+    assert session.content("a") == "x"
+    # 不带 baseVersion 时不检查
+    store.patch(session.id, [{"op": "setContent", "nodeId": "a", "content": "z"}])
+    assert session.version == 3
+
+
+def test_size_limit_rolls_back(monkeypatch):
+    monkeypatch.setattr(ds, "DOC_SESSION_MAX_CHARS", 10)
+    store = _store()
+    session = store.create([{"op": "setOutline", "outline": OUTLINE}])
+    with pytest.raises(InvalidPatch):
+        store.patch(session.id, [{"op": "setContent", "nodeId": "a", "content": "x" * 20}])
+    assert session.content("a") == "甲乙丙"
+    assert session.version == 1
+
+
+def test_resolve_prefers_inline_values():
+    store = _store()
+    session = store.create([{"op": "setOutline", "outline": OUTLINE}])
+    assert store.resolve_content("原文", session.id, "a") == "原文"
+    assert store.resolve_content("", session.id, "a") == "甲乙丙"
+    assert store.resolve_content("", session.id, None) == "# 一\n甲乙丙\n\n## 二\n丁"
+    assert store.resolve_content("", None, "a") == ""
+
+
+def test_lru_eviction_and_unknown_session():
+    store = DocumentSessionStore(max_sessions=2, ttl=3600)
+    first = store.create([])
+    store.create([])
+    store.create([])
+    with pytest.raises(DocumentSessionNotFound):
+        store.get(first.id)
+    assert store.get_stats()["evicted"] == 1
+
+
+def test_requests_need_content_or_doc_session():
+    from pydantic import ValidationError
+    from app.schemas import PolishRequest, BatchReviewRequest
+
+    with pytest.raises(ValidationError):
+        PolishRequest()
+    assert PolishRequest(content="").content == ""
+    assert PolishRequest(docSessionId="s", nodeId="a").content == ""
+    with pytest.raises(ValidationError):
+        BatchReviewRequest(sections=[{"nodeId": "a"}])
+    batch = BatchReviewRequest(sections=[{"nodeId": "a"}], docSessionId="s")
+    assert batch.sections[0].docSessionId == "s"
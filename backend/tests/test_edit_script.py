@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from app.services import edit_script
+from app.services.edit_script import EditScriptError, apply, apply_edits, locate, parse_edits, unified_diff
+
+ORIGINAL = "第一句。第二句很短。\n第三句。"
+
+
+def _script(*pairs):
+    return json.dumps({"edits": [{"find": f, "replace": r} for f, r in pairs]}, ensure_ascii=False)
+
+
+def test_unique_edits_are_applied_with_original_offsets():
+    patched, edits = apply(ORIGINAL, _script(("第三句", "第三句改"), ("第二句很短", "第二句更具体")))
+    assert patched == "第一句。第二句更具体。\n第三句改。"
+    assert [(e["start"], e["end"]) for e in edits] == [(4, 9), (11, 14)]
+    assert ORIGINAL[edits[0]["start"]:edits[0]["end"]] == "第二句很短"
+
+
+def test_fenced_script_and_bare_list_are_parsed():
+    assert parse_edits("```json\n" + _script(("a", "b")) + "\n```") == [{"find": "a", "replace": "b"}]
+    assert parse_edits('[{"find": "a"}]') == [{"find": "a", "replace": ""}]
+
+
+@pytest.mark.parametrize("raw, reason", [
+    ("不是 JSON", "unparsable"),
+    ('{"edits": [{"replace": "x"}]}', "unparsable"),
+])
+def test_unparsable_scripts(raw, reason):
+    with pytest.raises(EditScriptError) as exc:
+        parse_edits(raw)
+    assert exc.value.reason == reason
+
+
+def test_too_many_edits(monkeypatch):
+    monkeypatch.setattr(edit_script, "EDIT_SCRIPT_MAX_EDITS", 1)
+    with pytest.raises(EditScriptError) as exc:
+        parse_edits(_script(("a", "b"), ("c", "d")))
+    assert exc.value.reason == "too_many"
+
+
+def test_ambiguous_and_missing_find():
+    with pytest.raises(EditScriptError) as exc:
+        locate("句。句。", "句。")
+    assert exc.value.reason == "ambiguous"
+    with pytest.raises(EditScriptError) as exc:
+        locate(ORIGINAL, "第四句")
+    assert exc.value.reason == "not_found"
+    with pytest.raises(EditScriptError) as exc:
+        locate(ORIGINAL, "")
+    assert exc.value.reason == "empty_find"
+
+
+def test_fuzzy_match_ignores_whitespace_differences(monkeypatch):
+    text = "alpha  beta\ngamma"
+    assert locate(text, "alpha beta gamma") == (0, len(text))
+    monkeypatch.setattr(edit_script, "EDIT_SCRIPT_FUZZY", False)
+    with pytest.raises(EditScriptError):
+        locate(text, "alpha beta gamma")
+
+
+def test_fuzzy_match_must_also_be_unique():
+    with pytest.raises(EditScriptError) as exc:
+        locate("a b. a  b.", "ab")
+    assert exc.value.reason == "ambiguous"
+
+
+def test_overlapping_edits_are_rejected_as_a_whole():
+    with pytest.raises(EditScriptError) as exc:
+        apply_edits(ORIGINAL, [
+            {"find": "第一句。第二", "replace": "x"},
+            {"find": "第二句很短", "replace": "y"},
+        ])
+    assert exc.value.reason == "overlap"
+
+
+def test_no_op_edits_are_skipped():
+    patched, edits = apply_edits(ORIGINAL, [{"find": "不在原文", "replace": "不在原文"}])
+    assert patched == ORIGINAL and edits == []
+
+
+def test_fallback_reason_is_counted():
+    before = edit_script.get_edit_script_stats()["fallbacks"].get("not_found", 0)
+    with pytest.raises(EditScriptError):
+        apply(ORIGINAL, _script(("第九句", "x")))
+    assert edit_script.get_edit_script_stats()["fallbacks"]["not_found"] == before + 1
+
+
+def test_unified_diff_keeps_line_structure():
+    diff = unified_diff("a\nb\nc", "a\nB\nc")
+    assert "-b" in diff.splitlines() and "+B" in diff.splitlines()
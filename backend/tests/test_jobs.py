@@ -0,0 +1,165 @@
+import asyncio
+
+from app.services import jobs
+from app.services.jobs import JobQueue, QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED
+
+
+async def _wait_status(queue, job_id, *statuses, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"任务状态停在 {queue.get(job_id)['status']}")
+
+
+def test_job_runs_and_streams_output(tmp_path):
+    async def runner(kind, params, job):
+        job.append("你好")
+        job.progress(1, 2)
+        job.append("世界")
+        return "你好世界"
+
+    async def main():
+        queue = JobQueue(str(tmp_path / "jobs.db"), workers=1)
+        await queue.start(runner)
+        job = await queue.submit("generate", {"x": 1}, "client")
+        assert job["status"] in (QUEUED, RUNNING)
+        done = await _wait_status(queue, job["jobId"], SUCCEEDED)
+        assert done["result"] == "你好世界" and done["output"] == "你好世界"
+        assert done["progress"] == {"done": 1, "total": 2, "failed": 0}
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_failure_is_recorded(tmp_path):
+    async def runner(kind, params, job):
+        job.append("部分")
+        raise RuntimeError("上游错误")
+
+    async def main():
+        queue = JobQueue(str(tmp_path / "jobs.db"), workers=1)
+        await queue.start(runner)
+        job = await queue.submit("generate", {}, "client")
+        failed = await _wait_status(queue, job["jobId"], FAILED)
+        assert failed["error"] == "上游错误"
+        assert failed["output"] == "部分"
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_cancel_queued_and_running_jobs(tmp_path):
+    async def main():
+        gate = asyncio.Event()
+
+        async def runner(kind, params, job):
+            gate.set()
+            await asyncio.sleep(10)
+
+        queue = JobQueue(str(tmp_path / "jobs.db"), workers=1)
+        await queue.start(runner)
+        running = await queue.submit("generate", {}, "client")
+        queued = await queue.submit("generate", {}, "client")
+        await asyncio.wait_for(gate.wait(), 1)
+        assert (await queue.cancel(queued["jobId"]))["status"] == CANCELLED
+        await queue.cancel(running["jobId"])
+        await _wait_status(queue, running["jobId"], CANCELLED)
+        # 已取消的排队任务不会再被执行
+        await asyncio.sleep(0.05)
+        assert queue.get(queued["jobId"])["status"] == CANCELLED
+        assert queue.get_stats()["cancelled"] == 2
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_running_job_is_requeued_after_restart(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def hanging(kind, params, job):
+            job.append("旧输出")
+            gate.set()
+            await asyncio.sleep(10)
+
+        queue = JobQueue(path, workers=1)
+        await queue.start(hanging)
+        job = await queue.submit("generate", {"n": 1}, "client")
+        await asyncio.wait_for(gate.wait(), 1)
+        # 进程退出：运行中的任务保持 running
+        await queue.stop()
+
+        async def finishing(kind, params, job):
+            assert params == {"n": 1}
+            return "新结果"
+
+        restarted = JobQueue(path, workers=1)
+        await restarted.start(finishing)
+        done = await _wait_status(restarted, job["jobId"], SUCCEEDED)
+        assert done["result"] == "新结果"
+        assert done["attempts"] == 2
+        assert restarted.get_stats()["recovered"] == 1
+        await restarted.stop()
+
+    asyncio.run(main())
+
+
+def test_job_interrupted_too_often_fails_on_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_MAX_ATTEMPTS", 1)
+    path = str(tmp_path / "jobs.db")
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def hanging(kind, params, job):
+            gate.set()
+            await asyncio.sleep(10)
+
+        queue = JobQueue(path, workers=1)
+        await queue.start(hanging)
+        job = await queue.submit("generate", {}, "client")
+        await asyncio.wait_for(gate.wait(), 1)
+        await queue.stop()
+
+        restarted = JobQueue(path, workers=1)
+        await restarted.start(hanging)
+        assert restarted.get(job["jobId"])["status"] == FAILED
+        await restarted.stop()
+
+    asyncio.run(main())
+
+
+def test_subscribe_resumes_from_offset(tmp_path):
+    async def main():
+        release = asyncio.Event()
+
+        async def runner(kind, params, job):
+            job.append("abc")
+            await release.wait()
+            job.append("def")
+            return "abcdef"
+
+        queue = JobQueue(str(tmp_path / "jobs.db"), workers=1)
+        await queue.start(runner)
+        job = await queue.submit("generate", {}, "client")
+        await _wait_status(queue, job["jobId"], RUNNING)
+        events = []
+
+        async def consume():
+            async for event, data in queue.subscribe(job["jobId"], offset=2, keepalive=1):
+                events.append((event, data if event == "output" else None))
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.wait_for(consumer, 2)
+        outputs = "".join(d for e, d in events if e == "output")
+        assert outputs == "cdef"
+        assert events[-1][0] == SUCCEEDED
+        await queue.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,19 @@
+from app.services.prompts import get_template
+
+
+def _user(messages):
+    return messages[-1]["content"]
+
+
+def test_empty_constraints_line_is_omitted():
+    tpl = get_template("outline_from_materials")
+    text = _user(tpl.render({"TOPIC": "主题", "CONCEPT": "", "MATERIALS": "", "CONSTRAINTS": ""}, stable=True))
+    assert "附加约束" not in text
+    # 其他空字段仍显式标为（无）
+    assert "核心构想：（无）" in text
+
+
+def test_constraints_line_is_rendered_when_present():
+    tpl = get_template("outline_from_materials")
+    text = _user(tpl.render({"TOPIC": "主题", "CONSTRAINTS": "必须包含一级标题：['背景']"}, stable=True))
+    assert "【附加约束】：必须包含一级标题：['背景']" in text
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from app.services.resumable import ResumableStore, StreamGone
+
+
+async def _feed(pieces, gate=None):
+    for piece in pieces:
+        if gate is not None:
+            await gate.get()
+        yield piece
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_resume_by_bytes_replays_from_the_middle_of_a_chunk():
+    async def main():
+        store = ResumableStore(max_streams=4, max_bytes=1 << 20, ttl=60, grace=60)
+        sid = store.start(_feed(["你好", "世界"]))
+        await _settle()
+        start, skip = store.index_for_bytes(sid, 4)
+        assert (start, skip) == (0, 4)
+        out = [chunk async for _, chunk in store.subscribe(sid, start, resumed=True)]
+        assert out == ["你好", "世界"]
+        assert store.get_stats()["resumed"] == 1
+
+    asyncio.run(main())
+
+
+def test_streams_with_readers_are_never_evicted():
+    async def main():
+        store = ResumableStore(max_streams=1, max_bytes=1 << 20, ttl=60, grace=60)
+        gate = asyncio.Queue()
+        live = store.start(_feed(["a", "b"], gate))
+        reader = store.subscribe(live)
+        gate.put_nowait(None)
+        assert await reader.__anext__() == (0, "a")
+        # 超出流数上限，但唯一的流有人在读：新流照常开始，旧流不被取消
+        other = store.start(_feed(["x"]))
+        await _settle()
+        gate.put_nowait(None)
+        assert await reader.__anext__() == (1, "b")
+        assert store.get_stats()["evicted"] == 0
+        assert [c async for _, c in store.subscribe(other)] == ["x"]
+        await reader.aclose()
+
+    asyncio.run(main())
+
+
+def test_idle_streams_are_evicted_before_anything_else():
+    async def main():
+        store = ResumableStore(max_streams=2, max_bytes=1 << 20, ttl=60, grace=60)
+        done = store.start(_feed(["old"]))
+        gate = asyncio.Queue()
+        live = store.start(_feed(["a", "b"], gate))
+        reader = store.subscribe(live)
+        gate.put_nowait(None)
+        await reader.__anext__()
+        await _settle()
+        store.start(_feed(["new"]))
+        with pytest.raises(StreamGone):
+            store.index_for_bytes(done, 0)
+        assert store.get_stats()["evicted"] == 1
+        await reader.aclose()
+
+    asyncio.run(main())
+
+
+def test_byte_cap_trims_history_that_every_reader_has_seen():
+    async def main():
+        store = ResumableStore(max_streams=4, max_bytes=4, ttl=60, grace=60)
+        gate = asyncio.Queue()
+        sid = store.start(_feed(["aa", "bb", "cc", "dd"], gate))
+        reader = store.subscribe(sid)
+        got = []
+        for _ in range(3):
+            gate.put_nowait(None)
+            got.append(await reader.__anext__())
+        await _settle()
+        # 读者停在第 2 个片段上，之前的片段可丢弃，上游继续生成
+        assert store.get_stats()["trimmed_chunks"] == 2
+        assert store.get_stats()["bytes"] <= 4
+        with pytest.raises(StreamGone):
+            store.index_for_bytes(sid, 1)
+        assert store.index_for_bytes(sid, 5) == (2, 1)
+        gate.put_nowait(None)
+        got += [item async for item in reader]
+        assert got == [(0, "aa"), (1, "bb"), (2, "cc"), (3, "dd")]
+
+    asyncio.run(main())
+
+
+def test_unread_history_is_kept_even_over_the_byte_cap():
+    async def main():
+        store = ResumableStore(max_streams=4, max_bytes=2, ttl=60, grace=60)
+        gate = asyncio.Queue()
+        sid = store.start(_feed(["aa", "bb", "cc"], gate))
+        reader = store.subscribe(sid)
+        gate.put_nowait(None)
+        assert await reader.__anext__() == (0, "aa")
+        # 读者还没读到的片段不丢弃
+        gate.put_nowait(None)
+        gate.put_nowait(None)
+        await _settle()
+        assert [c async for _, c in reader] == ["bb", "cc"]
+        assert store.get_stats()["evicted"] == 0
+
+    asyncio.run(main())
+
+
+def test_per_stream_grace_overrides_the_default():
+    async def main():
+        store = ResumableStore(max_streams=4, max_bytes=1 << 20, ttl=60, grace=60)
+        gate = asyncio.Queue()
+        sid = store.start(_feed(["a", "b"], gate), grace=0.01)
+        reader = store.subscribe(sid)
+        gate.put_nowait(None)
+        await reader.__anext__()
+        await reader.aclose()
+        await asyncio.sleep(0.05)
+        assert store.get_stats()["cancelled_idle"] == 1
+        with pytest.raises(StreamGone):
+            store.index_for_bytes(sid, 0)
+
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+import asyncio
+import sys
+import threading
+
+from app.services import context_budget
+from app.services.retrieval import MaterialsIndex, MaterialsStore
+
+
+def _materials(n: int) -> str:
+    return "".join(f"第{i}段讲述主题{i % 40}的背景与做法。" for i in range(n))
+
+
+def test_token_cache_is_consistent_under_thread_pool_builds(monkeypatch):
+    # 缓存很小时淘汰频繁：事件循环与线程池里的索引构建同时读写缓存
+    monkeypatch.setattr(context_budget, "TOKEN_CACHE_MAX_BYTES", 4096)
+    # 频繁切换线程，让竞争在测试里稳定出现
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    errors = []
+
+    def hammer(offset: int):
+        try:
+            for i in range(3000):
+                context_budget.count_tokens(f"文本{offset}-{i % 97}")
+        except Exception as e:
+            errors.append(e)
+
+    async def main():
+        store = MaterialsStore(max_indexes=8)
+        threads = [threading.Thread(target=hammer, args=(t,)) for t in range(3)]
+        for t in threads:
+            t.start()
+        await asyncio.gather(*(store.ingest_async(_materials(300) + str(k)) for k in range(4)))
+        for t in threads:
+            t.join()
+
+    try:
+        asyncio.run(main())
+    finally:
+        sys.setswitchinterval(previous)
+    assert errors == []
+    expected = sum(context_budget._key_bytes(k) for k in context_budget._count_cache)
+    assert context_budget._cache_bytes == expected
+    assert context_budget._cache_bytes <= 4096
+
+
+def test_chunks_keep_every_character_in_order():
+    text = _materials(200)
+    index = MaterialsIndex(text, chunk_tokens=50)
+    assert len(index.chunks) > 1
+    assert "".join(index.chunks) == text
+    assert all(t <= 50 for t in index.chunk_tokens)
+
+
+def test_select_prefers_relevant_chunks_in_original_order():
+    text = "苹果的种植需要充足的光照。" * 10 + "港口的吞吐量逐年增长。" * 10 + "苹果的储存要注意温度。" * 10
+    index = MaterialsIndex(text, chunk_tokens=40)
+    selected = index.select("苹果储存温度", 60)
+    assert "储存" in selected
+    assert "港口" not in selected
+    assert context_budget.count_tokens(selected.replace("\n……\n", "")) <= 60
+    # 全部放得下时原样返回
+    assert index.select("苹果", 10 ** 6) == text
+
+
+def test_store_reuses_index_by_content():
+    store = MaterialsStore(max_indexes=2)
+    first_id, first = store.ingest("资料一。")
+    assert store.ingest("资料一。") == (first_id, first)
+    assert store.resolve("", first_id) == "资料一。"
+    store.ingest("资料二。")
+    store.ingest("资料三。")
+    assert store.get_stats()["indexes"] == 2
+    assert store.get_stats()["reused"] == 1
+
+
+def test_selector_falls_back_to_head_while_building_large_materials():
+    async def main():
+        store = MaterialsStore(max_indexes=4)
+        text = _materials(2000)
+        select = store.selector("主题7")
+        first = select(text, 100)
+        assert text.startswith(first)
+        assert store.get_stats()["head_fallbacks"] == 1
+        # 索引在线程池里建好之后按相关度选取
+        for _ in range(100):
+            if store.get_stats()["indexes"]:
+                break
+            await asyncio.sleep(0.01)
+        select(text, 100)
+        assert store.get_stats()["queries"] == 1
+
+    asyncio.run(main())
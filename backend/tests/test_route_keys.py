@@ -0,0 +1,37 @@
+from app import config
+from app.services import resilience
+from app.services.context_budget import route_budget
+from app.services.metrics import route_key
+from app.services.model_router import model_router
+
+
+def test_route_key_strips_the_router_prefix_only():
+    assert route_key("/api/writing/continue") == "/continue"
+    assert route_key("/api/writing/review/chunk") == "/review/chunk"
+    assert route_key("job:generate") == "job:generate"
+    assert route_key("/api/writingx") == "/api/writingx"
+
+
+def test_route_keyed_settings_share_one_spelling():
+    keyed = [
+        config.STREAM_SUPERSEDE_ROUTES,
+        config.ROUTE_INPUT_BUDGETS,
+        config.LLM_HEDGE_ROUTES,
+        config.MODEL_ROUTES,
+        config.CHANNEL_ROUTES,
+    ]
+    for routes in keyed:
+        for route in routes:
+            assert route.startswith("/") or route.startswith("job:"), route
+            assert not route.startswith("/api/"), route
+
+
+def test_lookups_use_the_unprefixed_route(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(resilience, "_overrides", {"/points": {"retries": 7}})
+    monkeypatch.setattr(resilience, "_policies", {})
+    policy = resilience.policy_for("/api/writing/points")
+    assert policy.hedge and policy.retries == 7
+    assert model_router.tier_of("/api/writing/continue") == "fast"
+    limit = route_budget(config.CHAT_MODEL, "/unknown")
+    assert route_budget(config.CHAT_MODEL, "/continue") == min(1000, limit)
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from app.services.scheduler import (
+    Scheduler,
+    QueueFullError,
+    QueueTimeoutError,
+    current_client,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BATCH,
+    PRIORITY_JOB,
+)
+
+
+def _scheduler(max_inflight=1, timeout=1.0, **limits):
+    queue_limits = {"interactive": 8, "json": 8, "batch": 8}
+    queue_limits.update(limits)
+    return Scheduler(max_inflight, queue_limits, timeout)
+
+
+async def _waiter(scheduler, priority, client, order, label):
+    current_client.set(client)
+    async with scheduler.slot(priority):
+        order.append(label)
+        await asyncio.sleep(0)
+
+
+def test_admits_immediately_below_limit():
+    async def main():
+        s = _scheduler(max_inflight=2)
+        await s.acquire(PRIORITY_BATCH)
+        await s.acquire(PRIORITY_BATCH)
+        assert s.in_flight == 2
+        s.release()
+        s.release()
+        assert s.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_higher_priority_is_served_first():
+    async def main():
+        s = _scheduler()
+        order = []
+        await s.acquire(PRIORITY_INTERACTIVE)
+        batch = asyncio.ensure_future(_waiter(s, PRIORITY_BATCH, "a", order, "batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(_waiter(s, PRIORITY_INTERACTIVE, "b", order, "interactive"))
+        await asyncio.sleep(0)
+        s.release()
+        await asyncio.gather(batch, interactive)
+        assert order == ["interactive", "batch"]
+
+    asyncio.run(main())
+
+
+def test_clients_are_served_round_robin():
+    async def main():
+        s = _scheduler()
+        order = []
+        await s.acquire(PRIORITY_BATCH)
+        tasks = []
+        # 客户端 a 先排了三个，b 后排一个：b 不应等 a 全部完成
+        for label, client in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]:
+            tasks.append(asyncio.ensure_future(_waiter(s, PRIORITY_BATCH, client, order, label)))
+            await asyncio.sleep(0)
+        s.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a1", "b1", "a2", "a3"]
+
+    asyncio.run(main())
+
+
+def test_full_queue_is_rejected_with_429():
+    async def main():
+        s = _scheduler(batch=1)
+        await s.acquire(PRIORITY_BATCH)
+        queued = asyncio.ensure_future(s.acquire(PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError) as exc:
+            await s.acquire(PRIORITY_BATCH)
+        assert exc.value.status_code == 429
+        # 其他优先级有各自的排队上限
+        other = asyncio.ensure_future(s.acquire(PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        assert s.get_stats()["classes"]["batch"]["rejected"] == 1
+        s.release()
+        await other
+        s.release()
+        await queued
+        s.release()
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def main():
+        s = _scheduler(timeout=0.05)
+        await s.acquire(PRIORITY_BATCH)
+        with pytest.raises(QueueTimeoutError) as exc:
+            await s.acquire(PRIORITY_BATCH)
+        assert exc.value.status_code == 503
+        stats = s.get_stats()["classes"]["batch"]
+        assert stats["timeouts"] == 1 and stats["queue_depth"] == 0
+        s.release()
+        assert s.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_job_class_never_rejects_or_times_out():
+    async def main():
+        s = _scheduler(timeout=0.01)
+        await s.acquire(PRIORITY_INTERACTIVE)
+        jobs = [asyncio.ensure_future(s.acquire(PRIORITY_JOB)) for _ in range(20)]
+        await asyncio.sleep(0.05)
+        assert not any(j.done() for j in jobs)
+        assert s.get_stats()["classes"]["job"]["queue_limit"] is None
+        s.release()
+        for job in jobs:
+            await job
+            s.release()
+        assert s.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        s = _scheduler()
+        await s.acquire(PRIORITY_BATCH)
+        waiter = asyncio.ensure_future(s.acquire(PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert s.get_stats()["classes"]["batch"]["queue_depth"] == 0
+        s.release()
+        assert s.in_flight == 0
+
+    asyncio.run(main())
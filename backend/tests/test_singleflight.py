@@ -0,0 +1,135 @@
+import asyncio
+
+from app.services.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def main():
+        sf = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        results = await asyncio.gather(*(sf.do("k", fn) for _ in range(5)))
+        assert results == ["ok"] * 5
+        assert len(calls) == 1
+        assert sf.get_stats()["call_coalesced"] == 4
+        # 完成后不再合并
+        assert await sf.do("k", fn) == "ok"
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    async def main():
+        sf = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.02)
+            return "ok"
+
+        first = asyncio.ensure_future(sf.do("k", fn))
+        second = asyncio.ensure_future(sf.do("k", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "ok"
+
+    asyncio.run(main())
+
+
+def test_late_joiner_replays_buffered_prefix():
+    async def main():
+        sf = SingleFlight()
+        gate = asyncio.Event()
+        upstreams = []
+
+        async def factory():
+            upstreams.append(1)
+            yield "a"
+            yield "b"
+            await gate.wait()
+            yield "c"
+
+        early = sf.stream("k", factory)
+        assert await early.__anext__() == "a"
+        assert await early.__anext__() == "b"
+        late = sf.stream("k", factory)
+        # 后加入者先拿到已生成的前缀
+        assert await late.__anext__() == "a"
+        gate.set()
+        rest_early = [c async for c in early]
+        rest_late = [c async for c in late]
+        assert rest_early == ["c"]
+        assert rest_late == ["b", "c"]
+        assert len(upstreams) == 1
+
+    asyncio.run(main())
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    async def main():
+        sf = SingleFlight()
+        closed = asyncio.Event()
+
+        async def factory():
+            try:
+                yield "a"
+                await asyncio.sleep(10)
+                yield "b"
+            finally:
+                closed.set()
+
+        first = sf.stream("k", factory)
+        second = sf.stream("k", factory)
+        assert await first.__anext__() == "a"
+        assert await second.__anext__() == "a"
+        await first.aclose()
+        await asyncio.sleep(0.01)
+        # 还有订阅者时上游继续
+        assert not closed.is_set()
+        await second.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        assert sf.get_stats()["in_flight_streams"] == 0
+
+    asyncio.run(main())
+
+
+def test_upstream_error_reaches_every_subscriber():
+    async def main():
+        sf = SingleFlight()
+
+        async def factory():
+            yield "a"
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        async def consume():
+            return [c async for c in sf.stream("k", factory)]
+
+        results = await asyncio.gather(consume(), consume(), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(main())
+
+
+def test_different_keys_are_not_merged():
+    async def main():
+        sf = SingleFlight()
+
+        async def factory():
+            yield "x"
+
+        await asyncio.gather(
+            *(asyncio.ensure_future(_collect(sf.stream(k, factory))) for k in ("a", "b"))
+        )
+        assert sf.get_stats()["stream_origin"] == 2
+
+    asyncio.run(main())
+
+
+async def _collect(stream):
+    return [c async for c in stream]
@@ -0,0 +1,42 @@
+import asyncio
+
+from app.services.stream_batching import coalesce
+
+
+def test_small_deltas_are_merged_and_nothing_is_lost():
+    async def upstream():
+        for i in range(50):
+            yield str(i % 10)
+
+    async def main():
+        out = [c async for c in coalesce(upstream(), max_bytes=10, max_ms=1000)]
+        assert "".join(out) == "".join(str(i % 10) for i in range(50))
+        # 首个片段单独发出，之后按 10 字节一批
+        assert out[0] == "0" and all(len(c) <= 10 for c in out[1:])
+        assert len(out) < 50
+
+    asyncio.run(main())
+
+
+def test_slow_consumer_stops_upstream_reads():
+    produced = 0
+
+    async def upstream():
+        nonlocal produced
+        for _ in range(1000):
+            produced += 1
+            yield "x"
+            await asyncio.sleep(0)
+
+    async def main():
+        stream = coalesce(upstream(), max_bytes=8, max_ms=1000)
+        assert await stream.__anext__() == "x"
+        batch = await stream.__anext__()
+        assert batch == "x" * 8
+        await asyncio.sleep(0.05)
+        # 下游暂停读取：上游只再被读满一批
+        assert produced == 1 + 8 + 8
+        rest = [c async for c in stream]
+        assert len("".join(rest)) == 1000 - 9
+
+    asyncio.run(main())
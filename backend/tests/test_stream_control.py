@@ -0,0 +1,27 @@
+import asyncio
+
+from app.services import stream_control
+from app.services.stream_control import Operation, current_operation, guard_stream
+
+
+async def _chunks(pieces):
+    for piece in pieces:
+        yield piece
+
+
+def test_tokens_saved_counts_text_not_chunks():
+    async def main():
+        current_operation.set(Operation("/api/writing/test-saved", None))
+        # 完整生成：一个合并后的大片段
+        full = [c async for c in guard_stream(_chunks(["字" * 100]))]
+        assert full == ["字" * 100]
+        assert stream_control.get_stream_stats()["avg_tokens"]["/test-saved"] == 100
+
+        before = stream_control.get_stream_stats()["tokens_saved_est"]
+        stream = guard_stream(_chunks(["字" * 30, "字" * 70]))
+        assert await stream.__anext__() == "字" * 30
+        await stream.aclose()
+        stats = stream_control.get_stream_stats()
+        assert stats["tokens_saved_est"] - before == 70
+
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+from app.services.stream_json import IncrementalJSONParser
+
+
+def _feed_all(parser, pieces):
+    out = []
+    for piece in pieces:
+        out.extend(parser.feed(piece))
+    return out
+
+
+def test_values_are_emitted_as_soon_as_they_close():
+    parser = IncrementalJSONParser(lambda path: len(path) == 1)
+    assert parser.feed('[{"title": "第一章", "children": [') == []
+    out = parser.feed('1, 2]}, {"title": "第二')
+    assert out == [((0,), {"title": "第一章", "children": [1, 2]})]
+    out = parser.feed('章"}]')
+    assert out == [((1,), {"title": "第二章"})]
+    assert parser.finished
+
+
+def test_split_at_every_character():
+    text = '{"items": ["a", "b,c", "d\\"e"], "n": 1}'
+    parser = IncrementalJSONParser(lambda path: path[:1] == ("items",) and len(path) == 2)
+    out = _feed_all(parser, list(text))
+    assert [v for _, v in out] == ["a", "b,c", 'd"e']
+    assert [p for p, _ in out] == [("items", 0), ("items", 1), ("items", 2)]
+
+
+def test_code_fence_and_preamble_are_skipped():
+    parser = IncrementalJSONParser(lambda path: len(path) == 1)
+    out = _feed_all(parser, ["好的，结果如下：\n```json\n[", '"x", ', '"y"]\n```'])
+    assert [v for _, v in out] == ["x", "y"]
+    # 根容器闭合后的代码块结束标记不再解析
+    assert parser.finished
+
+
+def test_truncated_input_yields_only_closed_values():
+    parser = IncrementalJSONParser(lambda path: len(path) == 1)
+    out = _feed_all(parser, ['[{"a": 1}, {"a": 2}, {"a": "没写完'])
+    assert [v for _, v in out] == [{"a": 1}, {"a": 2}]
+    assert not parser.finished
+
+
+def test_brackets_inside_strings_do_not_change_nesting():
+    parser = IncrementalJSONParser(lambda path: path == ("k",))
+    out = parser.feed('{"k": "[not] {an} array", "z": 0}')
+    assert out == [(("k",), "[not] {an} array")]
+
+
+def test_malformed_value_is_repaired():
+    parser = IncrementalJSONParser(lambda path: len(path) == 1)
+    # 对象内缺少逗号，闭合后按 repair_json 宽容解析
+    out = parser.feed('[{"a": 1 "b": 2}]')
+    assert out == [((0,), {"a": 1, "b": 2})]
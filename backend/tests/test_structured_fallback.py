@@ -0,0 +1,34 @@
+import asyncio
+
+import httpx
+
+from app.services import llm_service, structured
+from app.services.upstreams import Endpoint
+
+
+def _error(endpoint, status):
+    request = httpx.Request("POST", endpoint.chat_url)
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def test_endpoint_that_rejected_the_schema_is_marked(monkeypatch):
+    a, b = Endpoint("http://schema-a"), Endpoint("http://schema-b")
+    monkeypatch.setattr(llm_service.upstream_pool, "endpoints", [a, b])
+    monkeypatch.setattr(structured, "LLM_STRUCTURED_OUTPUT", "json_schema")
+    monkeypatch.setattr(structured, "_unsupported", set())
+    calls = []
+
+    async def post_once(client, endpoint, payload, timeout):
+        calls.append((endpoint.url, "response_format" in payload))
+        if endpoint is a and "response_format" in payload:
+            raise _error(a, 400)
+        if endpoint is a:
+            # 去掉参数重试时 a 出现节点故障，换到 b 成功
+            raise _error(a, 502)
+        return {"choices": [{"message": {"content": "{}"}}]}
+
+    monkeypatch.setattr(llm_service, "_post_once", post_once)
+    result = asyncio.run(llm_service._post_completion("m", [{"role": "user", "content": "x"}], 0, 0, structured.REVIEW))
+    assert result == "{}"
+    assert calls == [("http://schema-a", True), ("http://schema-a", False), ("http://schema-b", False)]
+    assert structured.get_structured_stats()["unsupported_endpoints"] == ["http://schema-a"]
@@ -0,0 +1,45 @@
+import pytest
+
+from app.services.upstreams import Endpoint, UpstreamPool, UpstreamUnavailable
+
+
+def _pool(*urls):
+    return UpstreamPool([Endpoint(u) for u in urls], "least_outstanding", failures=3, cooldown=15)
+
+
+def _trip(pool, endpoint):
+    for _ in range(3):
+        pool.failure(endpoint)
+
+
+def test_open_circuit_is_skipped_while_another_endpoint_is_available():
+    pool = _pool("http://a", "http://b")
+    a, b = pool.endpoints
+    _trip(pool, a)
+    assert pool.pick("m") is b
+    assert pool.stats["fallbacks"] == 0
+
+
+def test_single_endpoint_keeps_serving_with_an_open_circuit():
+    pool = _pool("http://only")
+    (only,) = pool.endpoints
+    _trip(pool, only)
+    assert only.get_stats()["circuit"] == "open"
+    assert pool.pick("m") is only
+    assert pool.stats["fallbacks"] == 1
+    # 退回的请求成功后熔断关闭
+    pool.success(only, 0.1)
+    assert only.get_stats()["circuit"] == "closed"
+
+
+def test_all_open_falls_back_to_the_endpoint_closest_to_recovery():
+    pool = _pool("http://a", "http://b")
+    a, b = pool.endpoints
+    _trip(pool, a)
+    _trip(pool, b)
+    a.open_until += 10
+    assert pool.pick("m") is b
+    # 已经试过的节点不再退回
+    with pytest.raises(UpstreamUnavailable):
+        pool.pick("m", {a, b})
+    assert not pool.has_alternative("m", {b})
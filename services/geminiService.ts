@@ -2,6 +2,11 @@ import { PromptsConfig } from "../types"; // 确保导入了类型定义
 
 // ... const BASE_URL = ""; 
 
+// 每个编辑页面一个会话 ID：后端据此让新的续写 / 智能编辑请求取消上一条未完成的流
+const SESSION_ID = Math.random().toString(36).slice(2) + Date.now().toString(36);
+const JSON_HEADERS = { "Content-Type": "application/json", "X-Session-Id": SESSION_ID };
+const STREAM_RESUME_RETRIES = 3;
+
 // ✅ 补回丢失的 DEFAULT_PROMPTS
 export const DEFAULT_PROMPTS: PromptsConfig = {
   outline_gen: `请为一篇关于"{{TOPIC}}"的专业文章/论文创建一个结构化大纲。
@@ -161,12 +166,96 @@ export const DEFAULT_PROMPTS: PromptsConfig = {
 // 如果配置了 Vite Proxy，留空；否则填 
 const BASE_URL = ""; 
 
+// ================= WebSocket 通道 =================
+// 续写、智能编辑、对话、推荐这类高频交互调用复用一条 WebSocket 连接（/api/writing/ws），
+// 每次调用是连接上的一个操作，省去每次请求的连接建立与请求头开销；连接不可用时回退为 HTTP
+const CHANNEL_ROUTES = new Set(["/continue", "/smart-edit", "/chat", "/suggestions"]);
+
+type ChannelOp = {
+  onDelta: (text: string) => void;
+  resolve: (data: any) => void;
+  reject: (err: Error) => void;
+};
+
+const channelOps = new Map<string, ChannelOp>();
+let channelSocket: Promise<WebSocket | null> | null = null;
+let channelUnsupported = false;
+let nextOpId = 0;
+
+const openChannel = (): Promise<WebSocket | null> => {
+  if (channelUnsupported) return Promise.resolve(null);
+  if (channelSocket) return channelSocket;
+  channelSocket = new Promise((resolve) => {
+    const base = BASE_URL
+      ? BASE_URL.replace(/^http/, "ws")
+      : `${location.protocol === "https:" ? "wss:" : "ws:"}//${location.host}`;
+    let opened = false;
+    let ws: WebSocket;
+    try {
+      ws = new WebSocket(`${base}/api/writing/ws?sessionId=${SESSION_ID}`);
+    } catch {
+      channelUnsupported = true;
+      resolve(null);
+      return;
+    }
+    ws.onopen = () => {
+      opened = true;
+      resolve(ws);
+    };
+    ws.onclose = () => {
+      // 从未连上（后端或代理不支持 WebSocket）：本页之后都走 HTTP；连上后断开的下次调用时重连
+      if (!opened) channelUnsupported = true;
+      channelSocket = null;
+      channelOps.forEach((op) => op.reject(new Error("Channel closed")));
+      channelOps.clear();
+      resolve(null);
+    };
+    ws.onmessage = (ev) => {
+      const frame = JSON.parse(ev.data);
+      const op = channelOps.get(frame.id);
+      if (!op) return;
+      if (frame.type === "delta") {
+        op.onDelta(frame.data);
+        return;
+      }
+      if (frame.type === "event") return;
+      channelOps.delete(frame.id);
+      if (frame.type === "result") op.resolve(frame.data);
+      else if (frame.type === "done") op.resolve(null);
+      else if (frame.type === "cancelled") op.reject(new Error("Cancelled"));
+      else op.reject(new Error(`API Error: ${frame.status}`));
+    };
+  });
+  return channelSocket;
+};
+
+// 通过通道发起一次调用：非流式接口 resolve 响应体，流式接口逐段回调 onDelta、结束时 resolve null
+const channelCall = (ws: WebSocket, endpoint: string, body: any, onDelta: (text: string) => void = () => {}) => {
+  const id = String(++nextOpId);
+  return new Promise<any>((resolve, reject) => {
+    channelOps.set(id, { onDelta, resolve, reject });
+    ws.send(JSON.stringify({ type: "start", id, route: endpoint, body }));
+  });
+};
+
 // 通用请求封装
 const postRequest = async (endpoint: string, body: any) => {
+  if (CHANNEL_ROUTES.has(endpoint)) {
+    const ws = await openChannel();
+    if (ws) {
+      try {
+        const data = await channelCall(ws, endpoint, body);
+        return data.result;
+      } catch (err) {
+        console.error(`Call ${endpoint} failed:`, err);
+        throw err;
+      }
+    }
+  }
   try {
     const res = await fetch(`${BASE_URL}/api/writing${endpoint}`, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: JSON_HEADERS,
       body: JSON.stringify(body),
     });
     if (!res.ok) throw new Error(`API Error: ${res.status}`);
@@ -179,29 +268,55 @@ const postRequest = async (endpoint: string, body: any) => {
 };
 
 const postStream = async (endpoint: string, body: any, onChunk?: (text: string) => void) => {
+  if (CHANNEL_ROUTES.has(endpoint)) {
+    const ws = await openChannel();
+    if (ws) return streamOverChannel(ws, endpoint, body, onChunk);
+  }
+  // 回调传的是累积全文，每帧最多通知一次，避免每个片段都触发整段重新渲染
+  let frame = 0;
   try {
     const res = await fetch(`${BASE_URL}/api/writing${endpoint}`, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: JSON_HEADERS,
       body: JSON.stringify(body),
     });
 
     if (!res.body) return "";
 
-    const reader = res.body.getReader();
+    // 带 X-Stream-Id 的流在断线后按已收到的字节数续传，不重新生成
+    const streamId = res.headers.get("X-Stream-Id");
+    let reader = res.body.getReader();
     const decoder = new TextDecoder("utf-8");
     let fullText = "";
+    let received = 0;
+    let retries = 0;
+    const notify = () => {
+      frame = 0;
+      onChunk?.(fullText);
+    };
 
     while (true) {
-      const { value, done } = await reader.read();
+      let result;
+      try {
+        result = await reader.read();
+      } catch (readErr) {
+        if (!streamId || retries >= STREAM_RESUME_RETRIES) throw readErr;
+        retries++;
+        const resumed = await fetch(`${BASE_URL}/api/writing/streams/${streamId}?offset=${received}`, { headers: JSON_HEADERS });
+        if (!resumed.ok || !resumed.body) throw readErr;
+        reader = resumed.body.getReader();
+        continue;
+      }
+      const { value, done } = result;
       if (done) break;
+      received += value.byteLength;
       
       const chunk = decoder.decode(value, { stream: true });
       fullText += chunk;
       
-      // 如果前端传了回调，就实时通知
-      if (onChunk) {
-        onChunk(fullText); // 注意：这里传的是累积的全文，因为前端 setGeneratedContent 通常是直接设置 value
+      // 如果前端传了回调，就在下一帧通知
+      if (onChunk && !frame) {
+        frame = requestAnimationFrame(notify); // 注意：这里传的是累积的全文，因为前端 setGeneratedContent 通常是直接设置 value
         // 如果你的前端逻辑是 append，这里就只传 chunk。
         // 根据 WriterInterface 逻辑：setGeneratedContent(chunk) -> <textarea value={generatedContent} />
         // 这意味着 state 保存的是全文。所以我们这里要传 accumulated text (fullText) 或者让 setGeneratedContent 做拼接。
@@ -213,14 +328,45 @@ const postStream = async (endpoint: string, body: any, onChunk?: (text: string)
         // 策略 A: 传 fullText 给它。这样 setGeneratedContent(fullText) 正确显示进度。
       }
     }
+    if (frame) {
+      cancelAnimationFrame(frame);
+      notify();
+    }
     return fullText;
   } catch (err) {
+    if (frame) cancelAnimationFrame(frame);
     console.error(`Stream ${endpoint} failed:`, err);
     if(onChunk) onChunk(`Error: ${(err as Error).message}`);
     return "";
   }
 };
 
+const streamOverChannel = async (ws: WebSocket, endpoint: string, body: any, onChunk?: (text: string) => void) => {
+  // 与 postStream 相同：回调累积全文，每帧最多通知一次
+  let frame = 0;
+  let fullText = "";
+  const notify = () => {
+    frame = 0;
+    onChunk?.(fullText);
+  };
+  try {
+    await channelCall(ws, endpoint, body, (text) => {
+      fullText += text;
+      if (onChunk && !frame) frame = requestAnimationFrame(notify);
+    });
+    if (frame) {
+      cancelAnimationFrame(frame);
+      notify();
+    }
+    return fullText;
+  } catch (err) {
+    if (frame) cancelAnimationFrame(frame);
+    console.error(`Stream ${endpoint} failed:`, err);
+    if (onChunk) onChunk(`Error: ${(err as Error).message}`);
+    return "";
+  }
+};
+
 
 // --- 基础配置 (保留空函数以防报错) ---
 export const setAIConfig = (baseUrl: string, apiKey: string, model: string) => {
@@ -273,21 +419,46 @@ export const generateArticleStream = async (outline: string, requirements: strin
   try {
     const res = await fetch(`${BASE_URL}/api/writing/generate/stream`, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: JSON_HEADERS,
       body: JSON.stringify({ outline, requirements }),
     });
     if (!res.body) return;
-    const reader = res.body.getReader();
+    const streamId = res.headers.get("X-Stream-Id");
+    let reader = res.body.getReader();
     const decoder = new TextDecoder("utf-8");
+    let lastEventId = "";
+    let retries = 0;
+    // 事件可能跨多次 read，按空行切分完整事件，未结束的部分留在 buffer 中
+    let buffer = "";
     while (true) {
-      const { value, done } = await reader.read();
+      let result;
+      try {
+        result = await reader.read();
+      } catch (readErr) {
+        // 断线后带 Last-Event-ID 续传，服务端从下一个片段继续
+        if (!streamId || retries >= STREAM_RESUME_RETRIES) throw readErr;
+        retries++;
+        const resumed = await fetch(`${BASE_URL}/api/writing/streams/${streamId}`, {
+          headers: { ...JSON_HEADERS, "Last-Event-ID": lastEventId },
+        });
+        if (!resumed.ok || !resumed.body) throw readErr;
+        reader = resumed.body.getReader();
+        continue;
+      }
+      const { value, done } = result;
       if (done) break;
-      const chunk = decoder.decode(value, { stream: true });
-      // 适配 data: 前缀 (如果后端返回 SSE) 或直接文本
-      const lines = chunk.split('\n');
-      for (const line of lines) {
-         if (line.startsWith('data: ')) onChunk(line.slice(6));
-         else if (line.trim()) onChunk(line); // 兼容纯文本流
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop() ?? "";
+      for (const event of events) {
+        // 一个事件内的多行 data 按 SSE 规范以换行拼接（片段本身含换行时后端会拆成多行）
+        const data: string[] = [];
+        for (const line of event.split('\n')) {
+          if (line.startsWith('id: ')) lastEventId = line.slice(4);
+          else if (line.startsWith('data: ')) data.push(line.slice(6));
+          else if (line.trim()) data.push(line); // 兼容纯文本流
+        }
+        if (data.length) onChunk(data.join('\n'));
       }
     }
   } catch (err) { console.error(err); onChunk("Error stream"); }
@@ -13,6 +13,8 @@ export default defineConfig({
         // 关键设置：修改请求头的 Origin 为目标 URL，
         // 很多后端/Nginx 只有开启这个才能通过跨域检查
         changeOrigin: true, 
+        // 同时转发 /api/writing/ws 的 WebSocket 升级请求
+        ws: true,
         
         // 如果后端不需要 /api 前缀，需要用 rewrite 去掉（根据你的代码，你的后端是需要 /api 的，所以这里不需要 rewrite）
         // rewrite: (path) => path.replace(/^\/api/, '')